@@ -0,0 +1,183 @@
+"""
+Benchmark suite that times and memory-profiles ToursPreprocessor.etl and Shapley_Attribution.train on synthetic
+datasets over a grid of user and channel counts, and writes the measurements as JSON so that runs can be compared
+"""
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from next_gen_attribution.benchmarking.synthetic_data import generate_tours_datasets
+from next_gen_attribution.modeling.shapley_attribution import Shapley_Attribution
+from next_gen_attribution.preprocessing.tours_preprocessor import ToursPreprocessor
+from next_gen_attribution.utility import logger, well_known_paths
+
+log = logger.init("Benchmark")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def _preprocess(spark_date: str, data_tag: str) -> None:
+    ToursPreprocessor(spark_date=spark_date, data_tag=data_tag).etl()
+
+
+def _train(spark_date: str, data_tag: str, engine: str) -> None:
+    Shapley_Attribution(
+        model_version=data_tag,
+        params={"spark_date": spark_date, "data_tag": data_tag, "data_format": "csv"},
+    ).train(engine, plot="none")
+
+
+def _measure(args: tuple) -> dict:
+    """
+    runs target(**kwargs) in a fresh worker process, so that the peak resident set size is that of this call alone
+    on top of the imports (baseline); module-level so that it can be shipped to worker processes
+    :returns: wall time and CPU time in seconds, baseline and peak resident set size in megabytes
+    """
+    target, kwargs = args
+    logging.disable(logging.INFO)
+    baseline_rss_mb = _peak_rss_mb()
+    start_wall_time, start_cpu_time = time.perf_counter(), time.process_time()
+    target(**kwargs)
+    return {
+        "wall_time_s": time.perf_counter() - start_wall_time,
+        "cpu_time_s": time.process_time() - start_cpu_time,
+        "baseline_rss_mb": baseline_rss_mb,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _measure_in_fresh_process(target, **kwargs) -> dict:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_measure, (target, kwargs)).result()
+
+
+def _metadata() -> dict:
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(
+    n_users_grid: list,
+    n_channels_grid: list,
+    conversion_rate: float = 0.2,
+    repeats: int = 3,
+    engine: str = "bitmask",
+    seed: int = 0,
+    output_fpath: str = None,
+    keep_data: bool = False,
+) -> dict:
+    """
+    generates a synthetic dataset for every (n_users, n_channels) of the grid, then preprocesses it and trains
+    Shapley attribution on it repeats times, each in a fresh process
+    :param engine: Shapley engine to benchmark, one of {power_set, bitmask, sparse, monte_carlo}
+    :param output_fpath: JSON file to write the results to, defaults to benchmark_output/benchmark_<timestamp>.json
+    :param keep_data: whether to keep the synthetic datasets, preprocessed data and model outputs
+    :returns: the results, as written to output_fpath
+    """
+    results = {
+        "metadata": _metadata(),
+        "config": {
+            "n_users_grid": list(n_users_grid),
+            "n_channels_grid": list(n_channels_grid),
+            "conversion_rate": conversion_rate,
+            "repeats": repeats,
+            "engine": engine,
+            "seed": seed,
+        },
+        "measurements": [],
+    }
+    for n_users, n_channels in product(n_users_grid, n_channels_grid):
+        # non-date names keep benchmark datasets out of --dateRange runs
+        spark_date = f"benchmark_{n_users}u_{n_channels}c"
+        data_tag = "benchmark"
+        case = {
+            "n_users": n_users,
+            "n_channels": n_channels,
+            "conversion_rate": conversion_rate,
+        }
+        log.info(f"Benchmarking {n_users} users over {n_channels} channels")
+        generate_tours_datasets(
+            spark_date, n_users, n_channels, conversion_rate, seed=seed
+        )
+        try:
+            for repeat in range(repeats):
+                measurement = _measure_in_fresh_process(
+                    _preprocess, spark_date=spark_date, data_tag=data_tag
+                )
+                n_journeys = len(
+                    pd.read_csv(
+                        os.path.join(
+                            well_known_paths["PREPROCESSED_DATA_DIR"],
+                            spark_date,
+                            data_tag,
+                            "journeys.csv",
+                        ),
+                        usecols=["journey"],
+                    )
+                )
+                results["measurements"].append(
+                    {
+                        "target": "ToursPreprocessor.etl",
+                        **case,
+                        "repeat": repeat,
+                        "n_journeys": n_journeys,
+                        **measurement,
+                    }
+                )
+                log.info(f"ToursPreprocessor.etl: {measurement}")
+
+                measurement = _measure_in_fresh_process(
+                    _train, spark_date=spark_date, data_tag=data_tag, engine=engine
+                )
+                results["measurements"].append(
+                    {
+                        "target": "Shapley_Attribution.train",
+                        **case,
+                        "repeat": repeat,
+                        "n_journeys": n_journeys,
+                        "engine": engine,
+                        **measurement,
+                    }
+                )
+                log.info(f"Shapley_Attribution.train: {measurement}")
+        finally:
+            if not keep_data:
+                for output_dir in [
+                    os.path.join(well_known_paths["DATASETS_DIR"], spark_date),
+                    os.path.join(well_known_paths["PREPROCESSED_DATA_DIR"], spark_date),
+                    os.path.join(well_known_paths["MODEL_OUTPUT_DIR"], data_tag),
+                ]:
+                    shutil.rmtree(output_dir, ignore_errors=True)
+
+    output_fpath = output_fpath or os.path.join(
+        well_known_paths["BENCHMARK_OUTPUT_DIR"],
+        f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+    )
+    output_dir = os.path.dirname(output_fpath)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    log.info(f"Saving benchmark results to {output_fpath}...")
+    with open(output_fpath, "w") as f:
+        json.dump(results, f, indent=2)
+    return results
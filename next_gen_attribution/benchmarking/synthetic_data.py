@@ -0,0 +1,132 @@
+"""
+Synthetic Tours datasets in the layout of a datasets/<spark_date>/ directory, i.e.,
+1) lytics_web_data_last_5_expanded.csv, the last 5 source/campaign touchpoints of every user as tracked by one of {ea, et, legacy}
+2) lytics_cleaned.csv, the map between _uid and individual_id
+3) conversion.csv, the conversion events of individuals
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from next_gen_attribution.utility import logger, well_known_paths
+
+log = logger.init("Synthetic Data")
+
+# the first channels are named like the production ones, email and adobe are always present for the email-adobe fix
+_CHANNELS = [
+    "email",
+    "adobe",
+    "google",
+    "facebook",
+    "bing",
+    "direct",
+    "affiliate",
+    "tiktok",
+    "instagram",
+    "youtube",
+]
+_TRACKERS = ["ea_", "et_", ""]
+
+
+def channel_names(n_channels: int) -> list:
+    """
+    :returns: n_channels source touchpoint values, named like the production ones first
+    """
+    if n_channels < 2:
+        raise RuntimeError("n_channels must be at least 2 (email and adobe).")
+    return (_CHANNELS + [f"channel{i}" for i in range(len(_CHANNELS), n_channels)])[
+        :n_channels
+    ]
+
+
+def _conversion_probabilities(
+    touched: np.ndarray, conversion_rate: float, rng: np.random.Generator
+) -> np.ndarray:
+    # each channel adds a random lift to the log-odds of converting, the intercept is bisected so that the
+    # expected conversion rate matches the requested one
+    score = touched @ rng.uniform(0.0, 1.5, size=touched.shape[1])
+    low, high = -30.0, 30.0
+    for _ in range(60):
+        intercept = (low + high) / 2
+        if np.mean(1 / (1 + np.exp(-(intercept + score)))) < conversion_rate:
+            low = intercept
+        else:
+            high = intercept
+    return 1 / (1 + np.exp(-(intercept + score)))
+
+
+def generate_tours_datasets(
+    spark_date: str,
+    n_users: int = 5000,
+    n_channels: int = 8,
+    conversion_rate: float = 0.2,
+    n_campaigns: int = 30,
+    seed: int = 0,
+) -> str:
+    """
+    writes synthetic lytics, id and conversion data to datasets/<spark_date>/, where journeys of 0-5 touchpoints
+    are drawn from channels of decaying popularity and users convert with a journey-dependent probability
+    :returns: the directory the datasets were written to
+    """
+    rng = np.random.default_rng(seed)
+    channels = np.array(channel_names(n_channels), dtype=object)
+    campaigns = np.array([f"camp{i}" for i in range(n_campaigns)], dtype=object)
+    uids = np.char.add("u", np.char.zfill(np.arange(n_users).astype(str), 8))
+
+    # journey lengths skew short, channel popularity decays with rank
+    lengths = rng.choice(6, size=n_users, p=[0.1, 0.3, 0.25, 0.15, 0.1, 0.1])
+    popularity = 1 / np.arange(1, n_channels + 1)
+    sources = rng.choice(n_channels, size=(n_users, 5), p=popularity / popularity.sum())
+    tracked = np.arange(5) < lengths[:, None]
+    touched = np.zeros((n_users, n_channels))
+    touched[np.nonzero(tracked)[0], sources[tracked]] = 1
+    converted = rng.random(n_users) < _conversion_probabilities(
+        touched, conversion_rate, rng
+    )
+
+    # each user is tracked by one of {ea, et, legacy}, the other trackers' columns stay empty
+    tracker = rng.choice(len(_TRACKERS), size=n_users, p=[0.3, 0.3, 0.4])
+    lytics_data = {"_uid": uids, "junk": rng.integers(0, 10, size=n_users)}
+    for t, prefix in enumerate(_TRACKERS):
+        for position in range(5):
+            is_set = tracked[:, position] & (tracker == t)
+            lytics_data[f"{prefix}utm_source_{position}"] = np.where(
+                is_set, channels[sources[:, position]], None
+            )
+            lytics_data[f"{prefix}utm_campaign_{position}"] = np.where(
+                is_set, rng.choice(campaigns, size=n_users), None
+            )
+
+    # converted users are almost always identified, others only sometimes
+    identified = rng.random(n_users) < np.where(converted, 0.95, 0.6)
+    individual_ids = np.where(identified, np.arange(1, n_users + 1), np.nan)
+    converted_ids = individual_ids[converted & identified]
+    # some individuals convert more than once, some conversions belong to individuals never seen on the web
+    conversion_ids = np.concatenate(
+        [
+            converted_ids,
+            rng.choice(converted_ids, size=len(converted_ids) // 10),
+            n_users + 1 + np.arange(len(converted_ids) // 20),
+        ]
+    ).astype(int)
+
+    output_dir = os.path.join(well_known_paths["DATASETS_DIR"], spark_date)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    log.info(
+        f"Writing {n_users} users over {n_channels} channels with {converted.sum()} conversions to {output_dir}..."
+    )
+    pd.DataFrame(lytics_data).to_csv(
+        os.path.join(output_dir, "lytics_web_data_last_5_expanded.csv"), index=False
+    )
+    pd.DataFrame({"_uid": uids, "individual_id": individual_ids}).to_csv(
+        os.path.join(output_dir, "lytics_cleaned.csv"), index=False
+    )
+    pd.DataFrame(
+        {
+            "Individual_id": rng.permutation(conversion_ids),
+            "SourceCode": rng.choice(["X", "Y", "Z"], size=len(conversion_ids)),
+        }
+    ).to_csv(os.path.join(output_dir, "conversion.csv"), index=False)
+    return output_dir
@@ -1,10 +1,12 @@
 import os
 from abc import ABC, abstractmethod
-from typing import Tuple
 
+import numpy as np
 import pandas as pd
 
-from next_gen_attribution.utility import logger, well_known_paths
+from next_gen_attribution.utility import logger, object_store_settings, well_known_paths
+from next_gen_attribution.utility.instrumentation import Instrumentation
+from next_gen_attribution.utility.object_store import object_store_reader
 from next_gen_attribution.utility.utility import load_params
 
 log = logger.init("Attribution Modeling on Dataset")
@@ -13,6 +15,17 @@ log = logger.init("Attribution Modeling on Dataset")
 class Attribution(ABC):
     """abstract class for attribution models"""
 
+    # channel name prefix of the touchpoints of each level, at the campaign levels the touchpoints are the tokens
+    # of the ordered paths of journeys_<level>, e.g., "google/camp1" at the source_campaign level
+    _touchpoint_prefixes = {
+        "source": "utm_source_",
+        "campaign": "utm_campaign_",
+        "source_campaign": "utm_source_campaign_",
+    }
+    # whether the model trains on the ordered paths of the touchpoints, i.e., on the path counts of
+    # journeys_<level> instead of the journey counts of journeys at the source level
+    _path_based = False
+
     def __init__(
         self,
         model_type: str,
@@ -20,6 +33,7 @@ class Attribution(ABC):
         workflow_mode: str,
         data_source: str,
         model_version: str,
+        params: dict = None,
     ) -> None:
         self._model_type = model_type
         self._business_unit = business_unit
@@ -33,23 +47,188 @@ class Attribution(ABC):
                 well_known_paths["PARAMS_DIR"], self._model_type, "default.yaml"
             )
         )
+        # entries overriding the default params, e.g., another spark_date or data_tag
+        self._params.update(params or {})
+
+        # plots rendered in background processes by train(), see join_plots
+        self._plot_processes = []
 
         self._model_output_dir = well_known_paths["MODEL_OUTPUT_DIR"]
         if not os.path.exists(self._model_output_dir):
             os.makedirs(self._model_output_dir)
 
-    def _get_data(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        preprocessed_data_fpath = os.path.join(
-            well_known_paths["PREPROCESSED_DATA_DIR"],
+    def _touchpoint_level(self) -> str:
+        touchpoint_level = self._params.get("touchpoint_level", "source")
+        if touchpoint_level not in self._touchpoint_prefixes:
+            raise RuntimeError(
+                "touchpoint_level must be one of {'source', 'campaign', 'source_campaign'}."
+            )
+        return touchpoint_level
+
+    def path_level(self) -> str:
+        """
+        :returns: the touchpoint level whose path counts the model trains on, or None for the journey counts
+        """
+        touchpoint_level = self._touchpoint_level()
+        if touchpoint_level == "source" and not self._path_based:
+            return None
+        return touchpoint_level
+
+    def _preprocessed_data_fpath(self, data_fname: str) -> str:
+        """
+        :returns: the local path of preprocessed data, downloaded to the object store cache first with
+        data_source s3
+        """
+        relative_fpath = os.path.join(
             self._params["spark_date"],
             self._params["data_tag"],
-            "preprocessed.csv",
+            f"{data_fname}.{self._params['data_format']}",
+        )
+        if self._data_source == "local":
+            return os.path.join(
+                well_known_paths["PREPROCESSED_DATA_DIR"], relative_fpath
+            )
+        elif self._data_source == "s3":
+            return object_store_reader().fetch(
+                object_store_settings["PREPROCESSED_DATA_URL"] + relative_fpath
+            )
+        else:
+            raise RuntimeError("data_source must be one of {'local', 's3'}.")
+
+    def _get_data(self) -> pd.DataFrame:
+        # user-level data are saved as "preprocessed", aggregated journeys as "journeys"
+        data_fname = {"users": "preprocessed", "journeys": "journeys"}[
+            self._params["data_level"]
+        ]
+        if self._touchpoint_level() != "source":
+            # campaign-level touchpoints are only saved as the path counts of journeys_<level>
+            if self._params["data_level"] != "journeys":
+                raise RuntimeError(
+                    "campaign touchpoint levels require data_level: journeys."
+                )
+        path_level = self.path_level()
+        if self._params["data_level"] == "journeys" and path_level is not None:
+            data_fname = f"journeys_{path_level}"
+        preprocessed_data_fpath = self._preprocessed_data_fpath(data_fname)
+        if self._params["data_format"] == "csv":
+            # paths are read as is, e.g., "" for no touchpoint or the path of a single "null" campaign
+            return pd.read_csv(
+                preprocessed_data_fpath,
+                keep_default_na=not data_fname.startswith("journeys_"),
+            )
+        elif self._params["data_format"] == "parquet":
+            return pd.read_parquet(preprocessed_data_fpath)
+        else:
+            raise RuntimeError("data_format must be one of {'csv', 'parquet'}.")
+
+    def data_key(self) -> tuple:
+        """
+        :returns: (spark_date, data_tag, data_format, data_level, path level) of the preprocessed data the model
+        trains on, which tells apart the datasets of several models
+        """
+        return tuple(
+            self._params[key]
+            for key in ["spark_date", "data_tag", "data_format", "data_level"]
+        ) + (self.path_level(),)
+
+    def load_data(self) -> pd.DataFrame:
+        """
+        :returns: the preprocessed data the model trains on, e.g., to hand one load to the train() of several models
+        """
+        return self._get_data()
+
+    def _group_channels(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        merges the utm_source indicator columns and path touchpoints of each group of the channel_groups param,
+        e.g., {"paid_search": ["google", "bing"]}, into one channel named after the group, then rebuilds the
+        journey bitmasks over the grouped channels
+        """
+        group_of = {
+            channel: group
+            for group, channels in self._params["channel_groups"].items()
+            for channel in channels
+        }
+        source_columns = list(data.filter(regex="^utm_source_"))
+        grouped_columns = {}
+        for column in source_columns:
+            channel = column[len("utm_source_") :]
+            grouped_columns.setdefault(
+                f"utm_source_{group_of.get(channel, channel)}", []
+            ).append(column)
+        indicators = pd.DataFrame(
+            {
+                grouped_column: data[columns].max(axis=1)
+                for grouped_column, columns in sorted(grouped_columns.items())
+            },
+            index=data.index,
+        )
+        grouped_data = data.drop(columns=source_columns)
+        if "journey" in grouped_data.columns:
+            bits = np.left_shift(
+                np.uint64(1), np.arange(indicators.shape[1], dtype=np.uint64)
+            )
+            grouped_data["journey"] = indicators.to_numpy(dtype=np.uint64) @ bits
+        if "path" in grouped_data.columns:
+            paths = grouped_data["path"].fillna("")
+            grouped_paths = {
+                path: ">".join(
+                    group_of.get(channel, channel) for channel in path.split(">")
+                )
+                for path in paths.unique()
+                if path
+            }
+            grouped_data["path"] = paths.map(grouped_paths).fillna("")
+        return pd.concat([grouped_data, indicators], axis=1)
+
+    def _roll_up_to_sources(
+        self, results: pd.DataFrame, additive_columns: list
+    ) -> pd.DataFrame:
+        """
+        splits the source_campaign-level channels of results into "source" and "campaign" columns, and sums each
+        of additive_columns over the campaigns of every source into a "source_<column>" column
+        :returns: results with the hierarchy columns added
+        """
+        prefix = self._touchpoint_prefixes["source_campaign"]
+        source_campaign = results["channel"].str[len(prefix) :].str.split("/", n=1)
+        results = results.assign(
+            source=self._touchpoint_prefixes["source"] + source_campaign.str[0],
+            campaign=self._touchpoint_prefixes["campaign"] + source_campaign.str[1],
+        )
+        for column in additive_columns:
+            results[f"source_{column}"] = results.groupby("source")[column].transform(
+                "sum"
+            )
+        return results
+
+    def set_model_version(self, model_version: str) -> None:
+        """
+        redirects the outputs of the next train() calls to the directory of model_version, e.g., of a rolling window
+        """
+        self._model_version = model_version
+
+    def join_plots(self) -> None:
+        """
+        waits for the plots that train() renders in background processes, logging those that failed
+        """
+        while self._plot_processes:
+            process = self._plot_processes.pop(0)
+            process.join()
+            if process.exitcode != 0:
+                self._logger.error(
+                    f"Plot process {process.pid} failed with exit code {process.exitcode}"
+                )
+
+    def _save_metrics(self, instrumentation: Instrumentation) -> None:
+        """
+        saves the stage metrics of a run to the metrics/ directory of this model version's output
+        """
+        instrumentation.save(
+            os.path.join(self._model_output_dir, self._model_version, "metrics")
         )
-        return pd.read_csv(preprocessed_data_fpath)
 
     @abstractmethod
-    def train(self, datasets_dict=None) -> None:
+    def train(self, data: pd.DataFrame = None) -> pd.DataFrame:
         """
-        implements a specific attribution's model training
-        :returns: None (currently, the model is not saved and instead directly outputs plots)
+        implements a specific attribution's model training, on data if given or else on the saved preprocessed data
+        :returns: the credit of each channel, with one row per channel and a "channel" column
         """
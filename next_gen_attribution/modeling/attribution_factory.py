@@ -7,6 +7,8 @@ __author__ = "HB"
 
 import importlib
 
+import pandas as pd
+
 from next_gen_attribution.modeling.attribution import Attribution
 
 
@@ -20,12 +22,15 @@ class AttributionFactory:
         workflow_mode: str,
         data_source: str,
         model_version: str,
+        params: dict = None,
     ):
         self._model_type = model_type
         self._business_unit = business_unit
         self._workflow_mode = workflow_mode
         self._data_source = data_source
         self._model_version = model_version
+        # entries overriding the model's default params
+        self._params = params
 
     def _attribution_factory(self) -> Attribution:
         """
@@ -41,6 +46,7 @@ class AttributionFactory:
                 self._workflow_mode,
                 self._data_source,
                 self._model_version,
+                self._params,
             )
         elif self._model_type == "markov":
             module = importlib.import_module(
@@ -51,13 +57,32 @@ class AttributionFactory:
                 self._workflow_mode,
                 self._data_source,
                 self._model_version,
+                self._params,
             )
         else:
             raise RuntimeError("model_type must be one of {'shapley', 'markov', ...}.")
 
-    def train(self) -> None:
+    def attribution(self) -> Attribution:
+        """
+        public member function that instantiates the model, e.g., to train it several times or to score users with it
+        :returns: an object instantiated from one of {Shapley_Attribution, Markov_Attribution}
+        """
+        return self._attribution_factory()
+
+    def path_level(self) -> str:
+        """
+        public member function that tells the journey counts and path counts models train on apart
+        :returns: the touchpoint level whose path counts the model trains on, or None for the aggregated journeys,
+        e.g., to pass as the path_level of PreprocessorFactory.etl
+        """
+        return self._attribution_factory().path_level()
+
+    def train(self, **kwargs) -> pd.DataFrame:
         """
         public member function that is overridden by model-specific scoring
-        :returns: None (the model directly outputs plots)
+        :param data: (optional) aggregated journeys (or path counts, see path_level), e.g., as returned by
+        PreprocessorFactory.etl, to train on instead of the preprocessed data saved under the spark_date and
+        data_tag of the model params
+        :returns: the credit of each channel, with one row per channel and a "channel" column
         """
-        return self._attribution_factory().train()
+        return self._attribution_factory().train(**kwargs)
@@ -0,0 +1,172 @@
+"""
+Batch training of several attribution model variants, e.g., shapley and markov, several data tags or channel
+groupings, that loads every distinct dataset once and trains the variants concurrently in a pool of workers
+"""
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from next_gen_attribution.modeling.attribution import Attribution
+from next_gen_attribution.modeling.attribution_factory import AttributionFactory
+from next_gen_attribution.utility import logger, well_known_paths
+
+log = logger.init("Batch Attribution")
+
+# datasets shared with every variant a worker trains, set once per worker by _init_worker
+_datasets = {}
+
+
+def _init_worker(datasets: dict) -> None:
+    global _datasets
+    _datasets = datasets
+
+
+def _train_variant(args: tuple) -> dict:
+    """
+    trains one variant on its shared dataset, module-level so that it can be shipped to worker processes
+    :returns: the variant's name, credit of each channel (None if it failed), wall time and error if any
+    """
+    name, attribution, data_key = args
+    start_time = time.perf_counter()
+    try:
+        results = attribution.train(data=_datasets[data_key])
+        error = None
+    except Exception:
+        results, error = None, traceback.format_exc()
+    return {
+        "name": name,
+        "results": results,
+        "wall_time_s": time.perf_counter() - start_time,
+        "error": error,
+    }
+
+
+class BatchAttribution:
+    """trains several attribution model variants sharing one data load, concurrently in a pool of workers"""
+
+    def __init__(
+        self,
+        specs: list,
+        business_unit: str,
+        workflow_mode: str,
+        data_source: str,
+        model_version: str,
+        n_workers: int = None,
+    ) -> None:
+        # each spec is a (model_type, params) pair or a {"name", "model_type", "params"} dict
+        self._specs = specs
+        self._business_unit = business_unit
+        self._workflow_mode = workflow_mode
+        self._data_source = data_source
+        self._model_version = model_version
+        self._n_workers = n_workers or os.cpu_count()
+        self._output_dir = os.path.join(
+            well_known_paths["MODEL_OUTPUT_DIR"], model_version
+        )
+
+    def _variants(self) -> list:
+        variants = []
+        for i, spec in enumerate(self._specs):
+            if not isinstance(spec, dict):
+                model_type, params = spec
+                spec = {"model_type": model_type, "params": params}
+            variants.append(
+                {
+                    "name": spec.get("name", f"{spec['model_type']}_{i}"),
+                    "model_type": spec["model_type"],
+                    "params": spec.get("params") or {},
+                }
+            )
+        names = [variant["name"] for variant in variants]
+        if len(set(names)) < len(names):
+            raise RuntimeError("variant names must be unique.")
+        return variants
+
+    def _attribution(self, variant: dict) -> Attribution:
+        # every variant writes its outputs to its own model_output/<model_version>/<name>/ directory, workers skip
+        # the plot, whose process would outlive the worker's task
+        return AttributionFactory(
+            variant["model_type"],
+            self._business_unit,
+            self._workflow_mode,
+            self._data_source,
+            os.path.join(self._model_version, variant["name"]),
+            {**variant["params"], "plot": "none"},
+        ).attribution()
+
+    def _load_datasets(self, attributions: list) -> tuple:
+        """
+        loads every distinct (spark_date, data_tag, data_format, data_level, path level) the variants train on,
+        once, where the path level tells the journey counts and the path counts of each touchpoint level apart
+        :returns: ({data key: data}, data key of each variant)
+        """
+        datasets, data_keys = {}, []
+        for attribution in attributions:
+            data_key = attribution.data_key()
+            if data_key not in datasets:
+                log.info(f"Loading preprocessed data {data_key}")
+                datasets[data_key] = attribution.load_data()
+            data_keys.append(data_key)
+        return datasets, data_keys
+
+    def _report(self, variants: list, outcomes: list) -> pd.DataFrame:
+        # one row per (variant, channel), failed variants keep a single row with their error
+        reports = []
+        for variant, outcome in zip(variants, outcomes):
+            report = (
+                outcome["results"].copy()
+                if outcome["results"] is not None
+                else pd.DataFrame({"channel": [None]})
+            )
+            report.insert(0, "variant", variant["name"])
+            report.insert(1, "model_type", variant["model_type"])
+            report["wall_time_s"] = outcome["wall_time_s"]
+            report["error"] = outcome["error"]
+            reports.append(report)
+        return pd.concat(reports, ignore_index=True)
+
+    def _save_report(self, report: pd.DataFrame) -> None:
+        if not os.path.exists(self._output_dir):
+            os.makedirs(self._output_dir)
+        output_fpath = os.path.join(self._output_dir, "batch_report.csv")
+        log.info(f"Saving batch report to {output_fpath}...")
+        report.to_csv(output_fpath, index=False)
+
+    def train(self) -> pd.DataFrame:
+        """
+        trains every variant on its dataset, loaded once and shared with the workers at start-up
+        :returns: the report of all variants, with one row per (variant, channel), also saved in csv format
+        """
+        variants = self._variants()
+        attributions = [self._attribution(variant) for variant in variants]
+
+        log.info(f"Loading the datasets of {len(variants)} variants")
+        datasets, data_keys = self._load_datasets(attributions)
+
+        log.info(
+            f"Training {len(variants)} variants on {len(datasets)} datasets with {self._n_workers} workers"
+        )
+        tasks = [
+            (variant["name"], attribution, data_key)
+            for variant, attribution, data_key in zip(variants, attributions, data_keys)
+        ]
+        if self._n_workers > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(self._n_workers, len(tasks)),
+                initializer=_init_worker,
+                initargs=(datasets,),
+            ) as executor:
+                outcomes = list(executor.map(_train_variant, tasks))
+        else:
+            _init_worker(datasets)
+            outcomes = [_train_variant(task) for task in tasks]
+        for outcome in outcomes:
+            if outcome["error"]:
+                log.error(f"Variant {outcome['name']} failed:\n{outcome['error']}")
+
+        report = self._report(variants, outcomes)
+        self._save_report(report)
+        return report
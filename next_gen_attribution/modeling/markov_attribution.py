@@ -1,12 +1,24 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
 from next_gen_attribution.modeling.attribution import Attribution
+from next_gen_attribution.modeling.path_index import PathIndex
+from next_gen_attribution.utility.instrumentation import Instrumentation
 
 
 class Markov_Attribution(Attribution):
+    _path_based = True
+
     def __init__(
         self,
         workflow_mode: str = "dev",
         data_source: str = "local",
         model_version: str = "main_20221121",
+        params: dict = None,
     ):
         super().__init__(
             "markov",
@@ -14,8 +26,173 @@ class Markov_Attribution(Attribution):
             workflow_mode,
             data_source,
             model_version,
+            params,
+        )
+
+    def _path_conversions(self, data: pd.DataFrame) -> pd.DataFrame:
+        # paths are ">"-joined source touchpoints, users without any touchpoint have an empty path
+        data = data.assign(path=data["path"].fillna(""))
+        if "n_users" in data.columns:
+            # path counts already carry the number of users and conversions of each path
+            path_conversion_df = data.groupby("path", as_index=False).agg(
+                users=("n_users", "sum"), conversions=("n_conversions", "sum")
+            )
+        else:
+            path_conversion_df = data.groupby("path", as_index=False).agg(
+                users=("is_converted", "size"), conversions=("is_converted", "sum")
+            )
+        return path_conversion_df.loc[path_conversion_df["path"] != ""]
+
+    def _index_paths(self, path_conversion_df: pd.DataFrame) -> PathIndex:
+        return PathIndex.from_paths(
+            path_conversion_df["path"],
+            path_conversion_df["users"],
+            path_conversion_df["conversions"],
+        )
+
+    def _pick_channels(self, path_index: PathIndex) -> None:
+        self._channels = path_index.channels
+        # states are ordered as start, channels, conversion, null
+        self._start_state = 0
+        self._conversion_state = len(self._channels) + 1
+        self._null_state = len(self._channels) + 2
+
+    def _transition_matrix(self, path_index: PathIndex) -> sparse.csr_matrix:
+        # every path contributes start -> s_0 -> ... -> s_last -> {conversion, null}, weighted by its users,
+        # which the trie holds summed over the paths sharing each prefix
+        from_states, to_states, counts = path_index.transition_counts()
+        n_states = len(self._channels) + 3
+        # duplicate (from, to) pairs are summed when converting from COO
+        transition_counts = sparse.coo_matrix(
+            (counts.astype(np.float64), (from_states, to_states)),
+            shape=(n_states, n_states),
+        ).tocsr()
+        out_counts = np.asarray(transition_counts.sum(axis=1)).ravel()
+        out_counts[out_counts == 0] = 1
+        return sparse.diags(1 / out_counts) @ transition_counts
+
+    def _removal_effects(self, transition_matrix: sparse.csr_matrix) -> tuple:
+        # transient states are start and channels, conversion and null are absorbing
+        n_transient = len(self._channels) + 1
+        transient = transition_matrix[:n_transient, :n_transient]
+        to_conversion = transition_matrix[:n_transient, self._conversion_state]
+        lu = splu(sparse.identity(n_transient, format="csc") - transient.tocsc())
+        # conversion probability from each transient state, x = (I - Q)^-1 r
+        conversion_probability = lu.solve(to_conversion.toarray().ravel())
+        # columns of the fundamental matrix N = (I - Q)^-1 for all channels, in one batched solve,
+        # i.e., fundamental[:, j - 1] holds the column of channel state j
+        fundamental = lu.solve(np.eye(n_transient)[:, 1:])
+        channel_states = np.arange(1, n_transient)
+        # removing channel j redirects it to null, so a journey only converts if it never reaches j:
+        # P(convert without j) = x_start - P(reach j) x_j, with P(reach j) = N[start, j] / N[j, j]
+        reach_probability = (
+            fundamental[self._start_state]
+            / fundamental[channel_states, channel_states - 1]
+        )
+        conversion_probability_without = (
+            conversion_probability[self._start_state]
+            - reach_probability * conversion_probability[channel_states]
         )
+        removal_effects = (
+            1
+            - conversion_probability_without / conversion_probability[self._start_state]
+        )
+        return conversion_probability[self._start_state], removal_effects
 
-    def train(self) -> None:
-        pass
-        # HB: (Matthew collaboration!)
+    def _attribute_conversions(
+        self, removal_effects: np.ndarray, total_conversions: float
+    ) -> pd.DataFrame:
+        # no channel gets credit when no removal has any effect, e.g., without conversions
+        total_effect = removal_effects.sum()
+        shares = (
+            removal_effects / total_effect
+            if total_effect > 0
+            else np.zeros(len(removal_effects))
+        )
+        return pd.DataFrame(
+            {
+                "channel": [
+                    self._touchpoint_prefixes[self._touchpoint_level()] + channel
+                    for channel in self._channels
+                ],
+                "removal_effect": removal_effects,
+                "attributed_conversions": shares * total_conversions,
+            }
+        )
+
+    def _save_removal_effects(self, removal_effect_df: pd.DataFrame) -> None:
+        output_dir = os.path.join(self._model_output_dir, self._model_version)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        output_fpath = os.path.join(output_dir, "removal_effects.csv")
+        self._logger.info(f"Saving removal effects to {output_fpath}...")
+        removal_effect_df.to_csv(output_fpath, index=False)
+
+    def train(
+        self, profile_stage: str = None, data: pd.DataFrame = None
+    ) -> pd.DataFrame:
+        """
+        trains the Markov attribution model and saves the metrics of every stage
+        :param profile_stage: stage to profile with cProfile, e.g., "removal_effects"
+        :param data: in-memory aggregated journeys (or user-level data) to train on instead of the saved ones
+        :returns: the removal effect and attributed conversions of each channel (also saved in csv format)
+        """
+        instrumentation = Instrumentation("train", self._logger, profile_stage)
+        stage = instrumentation.run
+
+        if data is None:
+            data = stage(f"Getting preprocessed data", self._get_data)
+        if self._params.get("channel_groups"):
+            data = stage(
+                f"Grouping channels into {list(self._params['channel_groups'])}",
+                self._group_channels,
+                data,
+            )
+
+        path_conversion_df = stage(
+            "Computing the observed users and conversions of each path",
+            self._path_conversions,
+            data,
+        )
+
+        path_index = stage(
+            "Indexing the paths in a prefix trie", self._index_paths, path_conversion_df
+        )
+        stage("Picking channels from the paths", self._pick_channels, path_index)
+        self._logger.info(
+            f"There are {len(path_conversion_df)} unique paths over {len(self._channels)} channels, sharing {len(path_index) - 1} prefixes"
+        )
+
+        transition_matrix = stage(
+            "Building the sparse transition matrix over start, channel, conversion and null states",
+            self._transition_matrix,
+            path_index,
+        )
+
+        if path_conversion_df["conversions"].sum() == 0:
+            # removal effects are relative to a conversion probability of 0, e.g., in a window without conversions
+            self._logger.warning(
+                "There are no conversions to attribute, every channel gets zero credit"
+            )
+            conversion_probability, removal_effects = 0.0, np.zeros(len(self._channels))
+        else:
+            conversion_probability, removal_effects = stage(
+                "Computing conversion probability and removal effects",
+                self._removal_effects,
+                transition_matrix,
+            )
+        self._logger.info(f"The conversion probability is {conversion_probability}")
+
+        removal_effect_df = stage(
+            "Attributing conversions proportionally to removal effects",
+            self._attribute_conversions,
+            removal_effects,
+            path_conversion_df["conversions"].sum(),
+        )
+        if self._touchpoint_level() == "source_campaign":
+            removal_effect_df = self._roll_up_to_sources(
+                removal_effect_df, ["attributed_conversions"]
+            )
+        stage("Saving removal effects", self._save_removal_effects, removal_effect_df)
+        self._save_metrics(instrumentation)
+        return removal_effect_df
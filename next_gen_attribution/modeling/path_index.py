@@ -0,0 +1,172 @@
+"""
+Prefix trie of the ordered touchpoint paths of the users, with the users and conversions of every prefix, that
+path-based models like Markov_Attribution query for transition and path statistics instead of re-scanning the data
+"""
+import numpy as np
+import pandas as pd
+
+
+class PathIndex:
+    """
+    prefix trie stored as flat arrays, where node 0 is the empty prefix and every other node extends the prefix of
+    its parent by one touchpoint; nodes are numbered depth by depth in (parent, touchpoint) order, so that the
+    children of a node are contiguous and every (parent, touchpoint) key is found with a binary search
+    """
+
+    def __init__(
+        self,
+        channels: list,
+        parents: np.ndarray,
+        touchpoints: np.ndarray,
+        users: np.ndarray,
+        conversions: np.ndarray,
+        ending_users: np.ndarray,
+        ending_conversions: np.ndarray,
+    ) -> None:
+        # touchpoint i of the trie is channels[i], the touchpoint of the root is -1
+        self.channels = channels
+        self._parents = parents
+        self._touchpoints = touchpoints
+        # users (conversions) whose path starts with the prefix of each node
+        self.users = users
+        self.conversions = conversions
+        # users (conversions) whose path is exactly the prefix of each node
+        self.ending_users = ending_users
+        self.ending_conversions = ending_conversions
+        self._codes = {channel: i for i, channel in enumerate(channels)}
+        self._keys = parents[1:] * len(channels) + touchpoints[1:]
+
+    @classmethod
+    def from_paths(
+        cls, paths: pd.Series, users: np.ndarray, conversions: np.ndarray
+    ) -> "PathIndex":
+        """
+        builds the trie depth by depth from ">"-joined paths, e.g., "google>email>facebook", with one vectorized
+        pass over the touchpoints at each position (paths may repeat, their counts are summed)
+        """
+        positions = paths.fillna("").str.split(">", expand=True)
+        channels = sorted(
+            channel
+            for channel in pd.unique(positions.to_numpy().ravel())
+            if pd.notna(channel) and channel != ""
+        )
+        # touchpoint codes of each path by position, -1 past its end
+        codes = np.column_stack(
+            [
+                pd.Categorical(positions[position], categories=channels).codes
+                for position in positions.columns
+            ]
+        ).astype(np.int64)
+        users = np.asarray(users, dtype=np.int64)
+        conversions = np.asarray(conversions, dtype=np.int64)
+
+        parents, touchpoints = [np.array([-1])], [np.array([-1])]
+        node_users, node_conversions = [[users.sum()]], [[conversions.sum()]]
+        nodes = np.zeros(len(codes), dtype=np.int64)
+        n_nodes = 1
+        for position in range(codes.shape[1]):
+            extended = codes[:, position] >= 0
+            keys, inverse = np.unique(
+                nodes[extended] * len(channels) + codes[extended, position],
+                return_inverse=True,
+            )
+            parents.append(keys // len(channels))
+            touchpoints.append(keys % len(channels))
+            node_users.append(np.bincount(inverse, weights=users[extended]))
+            node_conversions.append(np.bincount(inverse, weights=conversions[extended]))
+            nodes[extended] = n_nodes + inverse
+            n_nodes += len(keys)
+        return cls(
+            channels,
+            np.concatenate(parents),
+            np.concatenate(touchpoints),
+            np.concatenate(node_users).astype(np.int64),
+            np.concatenate(node_conversions).astype(np.int64),
+            np.bincount(nodes, weights=users, minlength=n_nodes).astype(np.int64),
+            np.bincount(nodes, weights=conversions, minlength=n_nodes).astype(np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    def find(self, path: str) -> int:
+        """
+        :returns: the node of the prefix path, e.g., "google>email", or -1 if no user's path starts with it
+        """
+        node = 0
+        for channel in filter(None, path.split(">")):
+            if channel not in self._codes:
+                return -1
+            key = node * len(self.channels) + self._codes[channel]
+            position = np.searchsorted(self._keys, key)
+            if position == len(self._keys) or self._keys[position] != key:
+                return -1
+            node = position + 1
+        return node
+
+    def prefix_counts(self, path: str) -> tuple:
+        """
+        :returns: (users, conversions) whose path starts with path
+        """
+        node = self.find(path)
+        return (0, 0) if node < 0 else (self.users[node], self.conversions[node])
+
+    def path_counts(self) -> pd.DataFrame:
+        """
+        :returns: the users and conversions of every distinct path, the empty one included
+        """
+        nodes = np.flatnonzero(self.ending_users)
+        return pd.DataFrame(
+            {
+                "path": self._paths(nodes),
+                "users": self.ending_users[nodes],
+                "conversions": self.ending_conversions[nodes],
+            }
+        )
+
+    def _paths(self, nodes: np.ndarray) -> np.ndarray:
+        # walks up from all nodes at once, prepending one touchpoint per step
+        channels = np.array(self.channels, dtype=object)
+        paths = np.full(len(nodes), "", dtype=object)
+        ancestors = nodes.copy()
+        while (ancestors > 0).any():
+            walking = ancestors > 0
+            touchpoints = channels[self._touchpoints[ancestors[walking]]]
+            paths[walking] = np.where(
+                paths[walking] == "", touchpoints, touchpoints + ">" + paths[walking]
+            )
+            ancestors[walking] = self._parents[ancestors[walking]]
+        return paths
+
+    def transition_counts(self) -> tuple:
+        """
+        users moving between consecutive touchpoints of their paths, where state 0 is the start, state i + 1
+        stands for channels[i], and the last two states are conversion and null (the end of a path without
+        conversion); users with an empty path never leave the start
+        :returns: (from states, to states, users) with one entry per edge or path end of the trie, duplicates
+        included
+        """
+        n_channels = len(self.channels)
+        children = np.arange(1, len(self))
+        # the start state is the root's, i.e., touchpoint -1 shifted to 0
+        from_states = self._touchpoints[self._parents[children]] + 1
+        ends = children[self.ending_users[children] > 0]
+        return (
+            np.concatenate(
+                [from_states, self._touchpoints[ends] + 1, self._touchpoints[ends] + 1]
+            ),
+            np.concatenate(
+                [
+                    self._touchpoints[children] + 1,
+                    np.full(len(ends), n_channels + 1),
+                    np.full(len(ends), n_channels + 2),
+                ]
+            ),
+            np.concatenate(
+                [
+                    self.users[children],
+                    self.ending_conversions[ends],
+                    self.ending_users[ends] - self.ending_conversions[ends],
+                ]
+            ),
+        )
@@ -0,0 +1,63 @@
+"""
+Plots of the results attribution models save, e.g., shapley_values.csv, rendered apart from training, in a
+background process or a separate report step, with matplotlib imported only then and on its non-interactive Agg
+backend
+"""
+import multiprocessing
+import os
+
+import pandas as pd
+
+from next_gen_attribution.utility import logger
+
+log = logger.init("Attribution Report")
+
+
+def plot_rescaled_values(
+    results_fpath: str, value_column: str, max_channels: int = 50
+) -> str:
+    """
+    plots the values of value_column rescaled by their maximum, for the max_channels channels of largest absolute
+    value in their saved order, e.g., out of thousands of campaigns
+    :returns: the path of the plot, saved next to the results as rescaled_<value_column>s.png
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    values = pd.read_csv(results_fpath).set_index("channel")[value_column]
+    rescaled_values = values.abs() / values.max()
+    rescaled_values = rescaled_values[
+        rescaled_values.rank(ascending=False, method="first") <= max_channels
+    ]
+    fig, ax = plt.subplots(figsize=(3.5, 3))
+    ax.bar(rescaled_values.index, rescaled_values.to_numpy())
+    ax.set_xticks(range(len(rescaled_values)))
+    ax.set_xticklabels(
+        ["\n" * (i % 6) + l for i, l in enumerate(rescaled_values.index)]
+    )
+    ax.tick_params(axis="both", which="major", labelsize=14)
+    fig_fpath = os.path.join(
+        os.path.dirname(results_fpath), f"rescaled_{value_column}s.png"
+    )
+    log.info(f"Saving plot of rescaled {value_column}s to {fig_fpath}...")
+    fig.savefig(fig_fpath)
+    plt.close(fig)
+    return fig_fpath
+
+
+def plot_in_background(
+    results_fpath: str, value_column: str, max_channels: int = 50
+) -> multiprocessing.Process:
+    """
+    renders plot_rescaled_values in a child process and returns at once; the process is not a daemon, so that a
+    script exits only once its plots are saved
+    :returns: the started process, to join once the plot is needed
+    """
+    process = multiprocessing.Process(
+        target=plot_rescaled_values,
+        args=(results_fpath, value_column, max_channels),
+    )
+    process.start()
+    return process
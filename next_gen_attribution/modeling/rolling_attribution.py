@@ -0,0 +1,256 @@
+"""
+Rolling-window training of attribution models, e.g., shapley and markov, over the per-day journey counts of a date
+range, that slides the window by adding the counts of the days entering it and subtracting those of the days
+leaving it, so that a trend over many windows takes a single pass over the data
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from next_gen_attribution.modeling.attribution_factory import AttributionFactory
+from next_gen_attribution.utility import logger, well_known_paths
+
+log = logger.init("Rolling Attribution")
+
+
+class RollingAttribution:
+    """trains attribution models on every window of window_days days, sliding by step_days days"""
+
+    def __init__(
+        self,
+        model_types: list,
+        business_unit: str,
+        workflow_mode: str,
+        data_source: str,
+        model_version: str,
+        window_days: int = 7,
+        step_days: int = 1,
+        params: dict = None,
+    ) -> None:
+        if window_days < 1 or step_days < 1:
+            raise RuntimeError("window_days and step_days must be positive.")
+        self._model_types = model_types
+        self._business_unit = business_unit
+        self._workflow_mode = workflow_mode
+        self._data_source = data_source
+        self._model_version = model_version
+        self._window_days = window_days
+        self._step_days = step_days
+        # {model_type: params} overriding each model's defaults
+        self._params = params or {}
+        self._output_dir = os.path.join(
+            well_known_paths["MODEL_OUTPUT_DIR"], model_version
+        )
+
+    def _days(self, daily_journeys: pd.DataFrame) -> pd.DatetimeIndex:
+        # calendar days of the range, including those without data
+        spark_dates = pd.to_datetime(daily_journeys["spark_date"], format="%Y%m%d")
+        return pd.date_range(spark_dates.min(), spark_dates.max(), freq="D")
+
+    def _daily_counts(
+        self, daily_counts: pd.DataFrame, key: str, days: pd.DatetimeIndex
+    ) -> tuple:
+        """
+        indexes the distinct keys, e.g., journeys or paths, of all days and the rows of each calendar day of days
+        :returns: (one row per key with its other columns, e.g., the indicator columns of journeys, key index of
+        each row, [users, conversions] of each row, rows of each calendar day)
+        """
+        spark_dates = pd.to_datetime(daily_counts["spark_date"], format="%Y%m%d")
+        day_index = (spark_dates - days[0]).dt.days.to_numpy()
+        order = np.argsort(day_index, kind="stable")
+        day_rows = np.split(
+            order, np.searchsorted(day_index[order], np.arange(1, len(days)))
+        )
+
+        key_index, _ = pd.factorize(daily_counts[key])
+        first_rows = np.unique(key_index, return_index=True)[1]
+        key_table = (
+            daily_counts.iloc[first_rows]
+            .drop(columns=["spark_date", "n_users", "n_conversions"])
+            .reset_index(drop=True)
+        )
+        counts = daily_counts[["n_users", "n_conversions"]].to_numpy(dtype=np.int64)
+        return key_table, key_index, counts, day_rows
+
+    def _windows(self, days: pd.DatetimeIndex) -> list:
+        # (first day, last day + 1) of every full window, the last one ending on the last day of the range, so that
+        # the first days of the range are left out unless the step lines up with them
+        ends = np.arange(len(days), self._window_days - 1, -self._step_days)[::-1]
+        windows = [(end - self._window_days, end) for end in ends]
+        if windows and windows[0][0] > 0:
+            log.warning(
+                f"Days {days[0].strftime('%Y%m%d')}-{days[windows[0][0] - 1].strftime('%Y%m%d')} precede the first window and are left out"
+            )
+        return windows
+
+    def _window_journeys(
+        self, journey_table: pd.DataFrame, window_counts: np.ndarray
+    ) -> pd.DataFrame:
+        """
+        keeps the journeys observed in the window along with their counts, and drops the touchpoints that
+        were not observed in it, since every touchpoint is a player of the Shapley game
+        :returns: the aggregated journeys of the window, with journey bitmasks rebuilt over its touchpoints
+        """
+        observed = window_counts[:, 0] > 0
+        window_journeys = journey_table.loc[observed]
+        touchpoints = list(window_journeys.filter(regex="^utm_source_"))
+        unobserved = [
+            touchpoint
+            for touchpoint in touchpoints
+            if not window_journeys[touchpoint].any()
+        ]
+        indicators = window_journeys[touchpoints].drop(columns=unobserved)
+        bits = np.left_shift(
+            np.uint64(1), np.arange(indicators.shape[1], dtype=np.uint64)
+        )
+        return window_journeys.drop(columns=unobserved).assign(
+            journey=indicators.to_numpy(dtype=np.uint64) @ bits,
+            n_users=window_counts[observed, 0],
+            n_conversions=window_counts[observed, 1],
+        )
+
+    def _window_paths(
+        self, path_table: pd.DataFrame, window_counts: np.ndarray
+    ) -> pd.DataFrame:
+        # keeps the paths observed in the window along with their counts
+        observed = window_counts[:, 0] > 0
+        return path_table.loc[observed].assign(
+            n_users=window_counts[observed, 0],
+            n_conversions=window_counts[observed, 1],
+        )
+
+    def _attributions(self) -> dict:
+        # the models are built once and trained on every window, without the plot and the credit table, which only
+        # the model of a single date or range is scored with
+        window_params = {
+            "shapley": {"plot": "none", "scoring": {"enabled": False}},
+        }
+        attributions = {
+            model_type: AttributionFactory(
+                model_type,
+                self._business_unit,
+                self._workflow_mode,
+                self._data_source,
+                os.path.join(self._model_version, model_type),
+                {
+                    **window_params.get(model_type, {}),
+                    **self._params.get(model_type, {}),
+                },
+            ).attribution()
+            for model_type in self._model_types
+        }
+        for model_type, attribution in attributions.items():
+            if attribution.path_level() not in [None, "source"]:
+                raise RuntimeError(
+                    f"rolling {model_type} attribution requires touchpoint_level: source."
+                )
+        return attributions
+
+    def _save_trends(self, trends: pd.DataFrame) -> None:
+        if not os.path.exists(self._output_dir):
+            os.makedirs(self._output_dir)
+        output_fpath = os.path.join(self._output_dir, "rolling_attribution.csv")
+        log.info(f"Saving rolling attribution to {output_fpath}...")
+        trends.to_csv(output_fpath, index=False)
+
+    def train(
+        self, daily_journeys: pd.DataFrame, daily_paths: pd.DataFrame
+    ) -> pd.DataFrame:
+        """
+        trains every model on the journey (or path) counts of every window, updated from the previous window's
+        counts
+        :param daily_journeys: users and conversions of every (spark_date, journey), e.g., as returned by
+        PreprocessorFactory.etl_daily
+        :param daily_paths: users and conversions of every (spark_date, path), which path-based models like
+        Markov_Attribution train on
+        :returns: the credit of each channel per (window, model_type), also saved in csv format
+        """
+        days = self._days(daily_journeys)
+        windows = self._windows(days)
+        if not windows:
+            raise RuntimeError(
+                f"The date range spans {len(days)} days, fewer than window_days={self._window_days}."
+            )
+        # (key table, key index, counts, day rows) of the journeys and of the paths
+        daily_counts = {
+            "journeys": self._daily_counts(daily_journeys, "journey", days),
+            "paths": self._daily_counts(daily_paths, "path", days),
+        }
+        log.info(
+            f"Training {self._model_types} on {len(windows)} windows of {self._window_days} days over {len(daily_counts['journeys'][0])} distinct journeys and {len(daily_counts['paths'][0])} distinct paths"
+        )
+
+        attributions = self._attributions()
+        window_counts = {
+            name: np.zeros((len(key_table), 2), dtype=np.int64)
+            for name, (key_table, *_) in daily_counts.items()
+        }
+        # days [first, last) are currently counted in window_counts
+        first, last = 0, 0
+        trends = []
+        for start, end in windows:
+            # slide by adding the days entering the window and subtracting those leaving it
+            for name, (_, key_index, counts, day_rows) in daily_counts.items():
+                for day in range(max(last, start), end):
+                    np.add.at(
+                        window_counts[name],
+                        key_index[day_rows[day]],
+                        counts[day_rows[day]],
+                    )
+                for day in range(first, min(start, last)):
+                    np.subtract.at(
+                        window_counts[name],
+                        key_index[day_rows[day]],
+                        counts[day_rows[day]],
+                    )
+            first, last = start, end
+
+            window = {
+                "window_start": days[start].strftime("%Y%m%d"),
+                "window_end": days[end - 1].strftime("%Y%m%d"),
+            }
+            window_data = {
+                "journeys": self._window_journeys(
+                    daily_counts["journeys"][0], window_counts["journeys"]
+                ),
+                "paths": self._window_paths(
+                    daily_counts["paths"][0], window_counts["paths"]
+                ),
+            }
+            # e.g., a window over days without any dataset, or whose users have no touchpoint at all
+            if not (
+                (window_data["journeys"]["journey"] != 0).any()
+                and (window_data["paths"]["path"] != "").any()
+            ):
+                log.warning(
+                    f"Skipping window {window['window_start']}-{window['window_end']} without any touchpoint"
+                )
+                continue
+            log.info(
+                f"Training on window {window['window_start']}-{window['window_end']}"
+            )
+            for model_type, attribution in attributions.items():
+                # every window has its own model_output/<model_version>/<model_type>/<window_start>-<window_end>/
+                attribution.set_model_version(
+                    os.path.join(
+                        self._model_version,
+                        model_type,
+                        f"{window['window_start']}-{window['window_end']}",
+                    )
+                )
+                results = attribution.train(
+                    data=window_data[
+                        "journeys" if attribution.path_level() is None else "paths"
+                    ]
+                )
+                results.insert(0, "window_start", window["window_start"])
+                results.insert(1, "window_end", window["window_end"])
+                results.insert(2, "model_type", model_type)
+                trends.append(results)
+
+        if not trends:
+            raise RuntimeError("None of the windows has any touchpoint.")
+        trends = pd.concat(trends, ignore_index=True)
+        self._save_trends(trends)
+        return trends
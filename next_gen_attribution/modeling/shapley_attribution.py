@@ -4,10 +4,24 @@ import os
 from ast import literal_eval
 from collections import defaultdict
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from next_gen_attribution.modeling.attribution import Attribution
+from next_gen_attribution.modeling.report import (
+    plot_in_background,
+    plot_rescaled_values,
+)
+from next_gen_attribution.modeling.shapley_engines import (
+    bitmask_coalition_values,
+    bitmask_shapley_values,
+    bootstrap_shapley_values,
+    monte_carlo_shapley_values,
+    sparse_shapley_values,
+)
+from next_gen_attribution.utility.instrumentation import Instrumentation
 
 
 class Shapley_Attribution(Attribution):
@@ -16,6 +30,7 @@ class Shapley_Attribution(Attribution):
         workflow_mode: str = "dev",
         data_source: str = "local",
         model_version: str = "main_20221121",
+        params: dict = None,
     ):
         super().__init__(
             "shapley",
@@ -23,6 +38,7 @@ class Shapley_Attribution(Attribution):
             workflow_mode,
             data_source,
             model_version,
+            params,
         )
 
     def _power_set(self, input_list):
@@ -36,34 +52,125 @@ class Shapley_Attribution(Attribution):
     def _pick_touchpoints(self, data: pd.DataFrame) -> None:
         # (TODO: this is duplicated from pick_touchpoints() in tours preprocessor, refactor)
         self._non_touchpoints = ["_uid", "is_converted"]
+        touchpoint_level = self._touchpoint_level()
+        if touchpoint_level != "source":
+            # campaign-level touchpoints are the tokens of the paths
+            tokens = set(">".join(data["path"].fillna("")).split(">")) - {""}
+            self._touchpoints = [
+                self._touchpoint_prefixes[touchpoint_level] + token
+                for token in sorted(tokens)
+            ]
+            return
         utm_source_columns = list(data.filter(regex="utm_source_"))
         utm_campaign_columns = list(data.filter(regex="utm_campaign_"))
         self._non_touchpoints.extend(utm_campaign_columns)
         self._touchpoints = utm_source_columns
 
     def _journey_vector_conversions(self, data: pd.DataFrame) -> pd.DataFrame:
-        jvector_conversion_df = data.groupby("jvector", as_index=False).agg(
-            {"is_converted": "sum"}
+        # preprocessed data carry a packed "journey" bitmask, older csv data a stringified "jvector" tuple
+        journey_column = "journey" if "journey" in data.columns else "jvector"
+        # aggregated journeys already carry the number of conversions of each (journey, path)
+        conversion_column = (
+            "n_conversions" if "n_conversions" in data.columns else "is_converted"
         )
-        jvector_conversion_df = jvector_conversion_df.rename(
-            columns={"is_converted": "conversions"}
+        # users of each journey, resampled by the bootstrap
+        user_column = (
+            ("n_users", "sum")
+            if "n_users" in data.columns
+            else (conversion_column, "size")
         )
+        jvector_conversion_df = data.groupby(journey_column, as_index=False).agg(
+            conversions=(conversion_column, "sum"), users=user_column
+        )
+        if journey_column == "jvector":
+            jvector_conversion_df["journey"] = self._pack_journey_vectors(
+                jvector_conversion_df["jvector"]
+            )
         return jvector_conversion_df
 
-    def _define_coalition(self, jvector_conversion_df: pd.DataFrame) -> pd.DataFrame:
-        # ensure that the "jvector" column is of type tuple
-        jvector_conversion_df["jvector"] = [
-            literal_eval(x) for x in jvector_conversion_df["jvector"]
+    def _path_coalitions(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        aggregates the conversions and users of every coalition of campaign-level touchpoints, i.e., of the set of
+        touchpoints of every path, whose "members" are sorted indices into self._touchpoints
+        """
+        prefix = self._touchpoint_prefixes[self._touchpoint_level()]
+        touchpoint_index = {
+            touchpoint: i for i, touchpoint in enumerate(self._touchpoints)
+        }
+        path_df = (
+            data.assign(path=data["path"].fillna(""))
+            .groupby("path", as_index=False)[["n_users", "n_conversions"]]
+            .sum()
+        )
+        members = [
+            tuple(
+                sorted(
+                    {
+                        touchpoint_index[prefix + token]
+                        for token in path.split(">")
+                        if token
+                    }
+                )
+            )
+            for path in path_df["path"]
         ]
+        return (
+            path_df.assign(members=members)
+            .groupby("members", as_index=False)
+            .agg(conversions=("n_conversions", "sum"), users=("n_users", "sum"))
+        )
+
+    def _coalition_csr(self, jvector_conversion_df: pd.DataFrame) -> tuple:
+        """
+        CSR layout of the coalition of each row of jvector_conversion_df, given by its journey bitmask or members
+        :returns: (indptr, indices), the members of coalition j are indices[indptr[j]:indptr[j+1]]
+        """
+        if "members" in jvector_conversion_df.columns:
+            sizes = jvector_conversion_df["members"].map(len).to_numpy(dtype=np.int64)
+            indices = np.fromiter(
+                itertools.chain.from_iterable(jvector_conversion_df["members"]),
+                dtype=np.int64,
+                count=sizes.sum(),
+            )
+        else:
+            journeys = jvector_conversion_df["journey"].to_numpy(dtype=np.uint64)
+            memberships = (
+                (
+                    journeys[:, None]
+                    >> np.arange(len(self._touchpoints), dtype=np.uint64)
+                )
+                & np.uint64(1)
+            ).astype(bool)
+            sizes = memberships.sum(axis=1)
+            indices = np.nonzero(memberships)[1]
+        indptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(sizes)
+        return indptr, indices
+
+    def _pack_journey_vectors(self, jvectors: pd.Series) -> np.ndarray:
+        # bit i of a journey bitmask is set iff the journey contains self._touchpoints[i]
+        jvectors = np.array(
+            [literal_eval(x) for x in jvectors], dtype=np.uint64
+        ).reshape(-1, len(self._touchpoints))
+        bits = np.left_shift(
+            np.uint64(1), np.arange(len(self._touchpoints), dtype=np.uint64)
+        )
+        return jvectors @ bits
+
+    def _define_coalition(self, jvector_conversion_df: pd.DataFrame) -> pd.DataFrame:
+        # unpack the journey bitmasks into one membership flag per touchpoint
+        journeys = jvector_conversion_df["journey"].to_numpy(dtype=np.uint64)
+        memberships = (
+            journeys[:, None] >> np.arange(len(self._touchpoints), dtype=np.uint64)
+        ) & np.uint64(1)
         coalition_conversion_df = pd.DataFrame()
         coalition_conversion_df["coalition"] = [
-            tuple(map(lambda x, y: x * y, jvector, tuple(self._touchpoints)))
-            for jvector in jvector_conversion_df["jvector"]
+            ",".join(itertools.compress(self._touchpoints, membership))
+            for membership in memberships
         ]
-        coalition_conversion_df["coalition"] = coalition_conversion_df[
-            "coalition"
-        ].apply(lambda x: ",".join([element for element in x if element]))
-        coalition_conversion_df["conversions"] = jvector_conversion_df["conversions"]
+        coalition_conversion_df["conversions"] = jvector_conversion_df[
+            "conversions"
+        ].to_numpy()
         return coalition_conversion_df
 
     def _construct_coalition_value_dictionary(
@@ -113,40 +220,7 @@ class Shapley_Attribution(Attribution):
             )  # add the term corresponding to the empty set
         return shapley_values
 
-    def _plot_rescaled_shapley_values(self, shapley_values: dict) -> None:
-        rescaled_shapley_values = {
-            k: abs(v) / max(shapley_values.values()) for k, v in shapley_values.items()
-        }
-        fig, ax = plt.subplots(figsize=(3.5, 3))
-        ax.bar(*zip(*rescaled_shapley_values.items()))
-        ax.set_xticklabels(
-            ["\n" * (i % 6) + l for i, l in enumerate(self._touchpoints)]
-        )
-        ax.tick_params(axis="both", which="major", labelsize=14)
-        print(f"Saving plot of rescaled Shapley values...")
-        fig_fpath = os.path.join(
-            self._model_output_dir, self._model_version, "rescaled_shapley_values.png"
-        )
-        plt.savefig(fig_fpath)
-        plt.show()
-        plt.clf()
-        plt.close()
-
-    def train(self) -> None:
-        self._logger.info(f"Getting preprocessed data")
-        data = self._get_data()
-
-        self._logger.info(f"Picking touchpoints from data")
-        self._pick_touchpoints(data)
-
-        self._logger.info(
-            "Computing the observed sum of conversions generated by each journey vector"
-        )
-        jvector_conversion_df = self._journey_vector_conversions(data)
-        self._logger.info(
-            f"{len(jvector_conversion_df.loc[jvector_conversion_df['conversions']>0])} out of {len(jvector_conversion_df)} user journey types have generated some conversions"
-        )
-
+    def _power_set_shapley_values(self, jvector_conversion_df: pd.DataFrame) -> dict:
         self._logger.info(
             "Defining a coalition as the element-wise multiplication of a journey vector and the vector of journey column names"
         )
@@ -173,7 +247,393 @@ class Shapley_Attribution(Attribution):
         )
 
         self._logger.info("Computing Shapley values")
-        shapley_values = self._shapley_values(subset_value_dict)
+        return self._shapley_values(subset_value_dict)
+
+    def _bitmask_shapley_values(self, jvector_conversion_df: pd.DataFrame) -> dict:
+        n = len(self._touchpoints)
+        self._logger.info(
+            f"Constructing the dense array of 2^{n} coalition values indexed by bitmask"
+        )
+        coalition_values = bitmask_coalition_values(
+            jvector_conversion_df["journey"].to_numpy(),
+            jvector_conversion_df["conversions"].to_numpy(),
+            n,
+        )
+        self._logger.info(
+            f"There are {np.count_nonzero(coalition_values)} out of 2^{n} coalitions with non-zero value"
+        )
+
+        self._logger.info("Computing Shapley values")
+        return dict(
+            zip(self._touchpoints, bitmask_shapley_values(coalition_values, n).tolist())
+        )
+
+    def _sparse_shapley_values(self, jvector_conversion_df: pd.DataFrame) -> dict:
+        self._logger.info("Indexing the members of each observed coalition")
+        indptr, indices = self._coalition_csr(jvector_conversion_df)
+        conversions = jvector_conversion_df["conversions"].to_numpy(dtype=np.float64)
+        self._logger.info(
+            f"There are {np.count_nonzero(conversions)} observed coalitions with non-zero value"
+        )
+
+        self._logger.info("Computing Shapley values")
+        return dict(
+            zip(
+                self._touchpoints,
+                sparse_shapley_values(
+                    indptr, indices, conversions, len(self._touchpoints)
+                ).tolist(),
+            )
+        )
+
+    def _monte_carlo_shapley_values(self, jvector_conversion_df: pd.DataFrame) -> dict:
+        self._logger.info("Indexing the members of each observed coalition")
+        indptr, indices = self._coalition_csr(jvector_conversion_df)
+        conversions = jvector_conversion_df["conversions"].to_numpy(dtype=np.float64)
+
+        self._logger.info("Estimating Shapley values from sampled permutations")
+        shapley_values, standard_errors, n_permutations = monte_carlo_shapley_values(
+            indptr,
+            indices,
+            conversions,
+            len(self._touchpoints),
+            **self._params["monte_carlo"],
+        )
+        self._logger.info(
+            f"Drew {n_permutations} permutations, the largest standard error is {standard_errors.max()}"
+        )
+        self._shapley_standard_errors = dict(
+            zip(self._touchpoints, standard_errors.tolist())
+        )
+        for touchpoint, standard_error in self._shapley_standard_errors.items():
+            self._logger.info(f"Standard error of {touchpoint}: {standard_error}")
+        return dict(zip(self._touchpoints, shapley_values.tolist()))
+
+    def _bootstrap_shapley_values(
+        self, jvector_conversion_df: pd.DataFrame, shapley_values: dict
+    ) -> pd.DataFrame:
+        """
+        bootstraps the exact Shapley values by multinomial resampling of the users of each journey
+        :returns: the percentile intervals of each channel's Shapley value and rank (1 for the largest value)
+        """
+        settings = self._params["bootstrap"]
+        n = len(self._touchpoints)
+        indptr, indices = self._coalition_csr(jvector_conversion_df)
+        replicates = bootstrap_shapley_values(
+            indptr,
+            indices,
+            jvector_conversion_df["conversions"].to_numpy(),
+            jvector_conversion_df["users"].to_numpy(),
+            n,
+            n_replicates=settings["n_replicates"],
+            batch_size=settings["batch_size"],
+            n_workers=settings["n_workers"],
+            seed=settings["seed"],
+        )
+        ranks = np.argsort(np.argsort(-replicates, axis=1), axis=1) + 1
+        percentiles = 50 * np.array(
+            [1 - settings["confidence"], 1 + settings["confidence"]]
+        )
+        ci_lower, ci_upper = np.percentile(replicates, percentiles, axis=0)
+        rank_lower, rank_upper = np.percentile(ranks, percentiles, axis=0)
+        point_estimates = np.array(
+            [shapley_values[touchpoint] for touchpoint in self._touchpoints]
+        )
+        return pd.DataFrame(
+            {
+                "channel": self._touchpoints,
+                "ci_lower": ci_lower,
+                "ci_upper": ci_upper,
+                "rank": np.argsort(np.argsort(-point_estimates)) + 1,
+                "rank_lower": rank_lower,
+                "rank_upper": rank_upper,
+            }
+        )
+
+    def _save_bootstrap_intervals(self, interval_df: pd.DataFrame) -> None:
+        output_dir = os.path.join(self._model_output_dir, self._model_version)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        output_fpath = os.path.join(output_dir, "bootstrap_intervals.csv")
+        self._logger.info(f"Saving bootstrap intervals to {output_fpath}...")
+        interval_df.to_csv(output_fpath, index=False)
+
+    def _journey_credits(
+        self, journeys: np.ndarray, shapley_values: dict
+    ) -> np.ndarray:
+        """
+        splits one conversion of each journey bitmask across its touchpoints, in proportion to the positive part of
+        their Shapley values (equally if none of them is positive), so that the credits of all converted users add
+        up to the positive Shapley values when every touchpoint's is positive
+        :returns: float32 array of the credit of each touchpoint (column) of each journey (row)
+        """
+        bits = np.arange(len(self._touchpoints), dtype=np.uint64)
+        members = ((journeys[:, None] >> bits) & np.uint64(1)).astype(np.float64)
+        weights = members * np.maximum(
+            [shapley_values[touchpoint] for touchpoint in self._touchpoints], 0
+        )
+        weights = np.where(weights.sum(axis=1, keepdims=True) > 0, weights, members)
+        totals = weights.sum(axis=1, keepdims=True)
+        # the empty journey gets no credit at all
+        return (weights / np.where(totals > 0, totals, 1)).astype(np.float32)
+
+    def _credit_table(
+        self, jvector_conversion_df: pd.DataFrame, shapley_values: dict
+    ) -> pd.DataFrame:
+        """
+        :returns: the credit of each touchpoint of every observed journey, sorted by journey for score()
+        """
+        journeys = np.sort(jvector_conversion_df["journey"].to_numpy(dtype=np.uint64))
+        credits = pd.DataFrame(
+            self._journey_credits(journeys, shapley_values), columns=self._touchpoints
+        )
+        credits.insert(0, "journey", journeys)
+        return credits
+
+    def _credit_table_fpath(self) -> str:
+        return os.path.join(
+            self._model_output_dir, self._model_version, "credit_table.parquet"
+        )
+
+    def _save_credit_table(self, credit_table: pd.DataFrame) -> None:
+        output_fpath = self._credit_table_fpath()
+        if not os.path.exists(os.path.dirname(output_fpath)):
+            os.makedirs(os.path.dirname(output_fpath))
+        self._logger.info(f"Saving credit table to {output_fpath}...")
+        credit_table.to_parquet(output_fpath, index=False)
+
+    def score(
+        self, users: pd.DataFrame, credit_table: pd.DataFrame = None
+    ) -> pd.DataFrame:
+        """
+        credits the conversion of every user to the touchpoints of its journey, gathering the credits of all users
+        at once from the rows of the credit table found by a binary search on their journey codes
+        :param users: user-level data with "_uid", "journey" and "is_converted" columns (and the utm_source
+        indicator columns if channel_groups is set)
+        :param credit_table: credit table as saved by train, defaults to the one of this model version
+        :returns: "_uid", "journey", "is_converted" and the conversions credited to each touchpoint, left NaN for
+        journeys not observed when training
+        """
+        if credit_table is None:
+            credit_table = pd.read_parquet(self._credit_table_fpath())
+        if self._params.get("channel_groups"):
+            users = self._group_channels(users)
+        table_journeys = credit_table["journey"].to_numpy(dtype=np.uint64)
+        credits = credit_table.drop(columns="journey").to_numpy(dtype=np.float32)
+        journeys = users["journey"].to_numpy(dtype=np.uint64)
+
+        rows = np.minimum(
+            np.searchsorted(table_journeys, journeys), len(table_journeys) - 1
+        )
+        unseen = table_journeys[rows] != journeys
+        if unseen.any():
+            self._logger.warning(
+                f"{unseen.sum()} users have journeys not observed when training, their credits are left NaN"
+            )
+        user_credits = (
+            credits[rows] * users["is_converted"].to_numpy(dtype=np.float32)[:, None]
+        )
+        user_credits[unseen] = np.nan
+        scores = pd.DataFrame(
+            user_credits, columns=credit_table.columns[1:], index=users.index
+        )
+        scores.insert(0, "_uid", users["_uid"])
+        scores.insert(1, "journey", journeys)
+        scores.insert(2, "is_converted", users["is_converted"])
+        return scores.reset_index(drop=True)
+
+    def _user_chunks(self, chunksize: int):
+        # reads only the columns score() needs from the saved user-level data, chunksize users at a time
+        fpath = self._preprocessed_data_fpath("preprocessed")
+        grouped = bool(self._params.get("channel_groups"))
+
+        def is_used(column: str) -> bool:
+            return column in ["_uid", "journey", "is_converted"] or (
+                grouped and column.startswith("utm_source_")
+            )
 
-        self._logger.info("Plotting rescaled Shapley values")
-        self._plot_rescaled_shapley_values(shapley_values)
+        if self._params["data_format"] == "csv":
+            yield from pd.read_csv(fpath, usecols=is_used, chunksize=chunksize)
+        elif self._params["data_format"] == "parquet":
+            parquet_file = pq.ParquetFile(fpath)
+            columns = [
+                name for name in parquet_file.schema_arrow.names if is_used(name)
+            ]
+            for batch in parquet_file.iter_batches(
+                batch_size=chunksize, columns=columns
+            ):
+                yield batch.to_pandas()
+        else:
+            raise RuntimeError("data_format must be one of {'csv', 'parquet'}.")
+
+    def score_users(self, chunksize: int = None) -> str:
+        """
+        scores the saved user-level data of the spark_date and data_tag params (saved when preprocessing with
+        --userLevel) in chunks, appending the credits of every chunk to a parquet file
+        :param chunksize: users read and scored at once, defaults to the "scoring.chunksize" entry of the model params
+        :returns: the path of the user credits
+        """
+        if self._touchpoint_level() != "source":
+            raise RuntimeError("scoring requires touchpoint_level: source.")
+        credit_table = pd.read_parquet(self._credit_table_fpath())
+        output_fpath = os.path.join(
+            self._model_output_dir, self._model_version, "user_credits.parquet"
+        )
+        self._logger.info(f"Saving user credits to {output_fpath}...")
+        writer, n_users = None, 0
+        for users in self._user_chunks(
+            chunksize or self._params["scoring"]["chunksize"]
+        ):
+            table = pa.Table.from_pandas(
+                self.score(users, credit_table), preserve_index=False
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(output_fpath, table.schema)
+            writer.write_table(table)
+            n_users += len(users)
+        if writer is not None:
+            writer.close()
+        self._logger.info(f"Scored {n_users} users")
+        return output_fpath
+
+    def _save_shapley_values(self, shapley_value_df: pd.DataFrame) -> str:
+        output_dir = os.path.join(self._model_output_dir, self._model_version)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        output_fpath = os.path.join(output_dir, "shapley_values.csv")
+        self._logger.info(f"Saving Shapley values to {output_fpath}...")
+        shapley_value_df.to_csv(output_fpath, index=False)
+        return output_fpath
+
+    def train(
+        self,
+        engine: str = None,
+        profile_stage: str = None,
+        data: pd.DataFrame = None,
+        bootstrap: bool = None,
+        plot: str = None,
+    ) -> pd.DataFrame:
+        """
+        trains the Shapley attribution model and saves the metrics of every stage
+        :param engine: one of {power_set, bitmask, sparse, monte_carlo}, defaults to the "engine" entry of the model params
+        :param profile_stage: stage to profile with cProfile, e.g., "bitmask_shapley_values"
+        :param data: in-memory aggregated journeys (or user-level data) to train on instead of the saved ones
+        :param bootstrap: whether to add bootstrap intervals, defaults to the "bootstrap.enabled" entry of the model params
+        :param plot: one of {inline, background, none}, defaults to the "plot" entry of the model params
+        :returns: the Shapley value of each channel (and its standard error with the monte_carlo engine, its
+        bootstrap intervals with bootstrap)
+        """
+        engine = engine or self._params["engine"]
+        plot = plot or self._params["plot"]
+        if plot not in ["inline", "background", "none"]:
+            raise RuntimeError("plot must be one of {'inline', 'background', 'none'}.")
+        if bootstrap is None:
+            bootstrap = self._params["bootstrap"]["enabled"]
+        touchpoint_level = self._touchpoint_level()
+        if touchpoint_level != "source" and engine in ["power_set", "bitmask"]:
+            # hundreds of campaigns are far beyond 2^n coalitions
+            raise RuntimeError(
+                "campaign touchpoint levels require the sparse or monte_carlo engine."
+            )
+        instrumentation = Instrumentation("train", self._logger, profile_stage)
+        stage = instrumentation.run
+
+        if data is None:
+            data = stage(f"Getting preprocessed data", self._get_data)
+        if self._params.get("channel_groups"):
+            data = stage(
+                f"Grouping channels into {list(self._params['channel_groups'])}",
+                self._group_channels,
+                data,
+            )
+
+        stage(f"Picking touchpoints from data", self._pick_touchpoints, data)
+
+        if touchpoint_level == "source":
+            jvector_conversion_df = stage(
+                "Computing the observed sum of conversions generated by each journey vector",
+                self._journey_vector_conversions,
+                data,
+            )
+        else:
+            jvector_conversion_df = stage(
+                f"Computing the observed sum of conversions generated by the {touchpoint_level} touchpoints of each path",
+                self._path_coalitions,
+                data,
+            )
+        self._logger.info(
+            f"{len(jvector_conversion_df.loc[jvector_conversion_df['conversions']>0])} out of {len(jvector_conversion_df)} user journey types have generated some conversions"
+        )
+
+        if engine == "power_set":
+            shapley_value_engine = self._power_set_shapley_values
+        elif engine == "bitmask":
+            shapley_value_engine = self._bitmask_shapley_values
+        elif engine == "sparse":
+            shapley_value_engine = self._sparse_shapley_values
+        elif engine == "monte_carlo":
+            shapley_value_engine = self._monte_carlo_shapley_values
+        else:
+            raise RuntimeError(
+                "engine must be one of {'power_set', 'bitmask', 'sparse', 'monte_carlo'}."
+            )
+        shapley_values = stage(
+            f"Computing Shapley values with the {engine} engine",
+            shapley_value_engine,
+            jvector_conversion_df,
+        )
+
+        if bootstrap:
+            interval_df = stage(
+                f"Bootstrapping {self._params['bootstrap']['n_replicates']} replicates of the Shapley values",
+                self._bootstrap_shapley_values,
+                jvector_conversion_df,
+                shapley_values,
+            )
+            self._save_bootstrap_intervals(interval_df)
+
+        if touchpoint_level == "source" and self._params["scoring"]["enabled"]:
+            credit_table = stage(
+                f"Precomputing the credit table of {len(jvector_conversion_df)} journeys",
+                self._credit_table,
+                jvector_conversion_df,
+                shapley_values,
+            )
+            stage("Saving the credit table", self._save_credit_table, credit_table)
+
+        shapley_value_df = pd.DataFrame(
+            {
+                "channel": list(shapley_values),
+                "shapley_value": list(shapley_values.values()),
+            }
+        )
+        if engine == "monte_carlo":
+            shapley_value_df["standard_error"] = shapley_value_df["channel"].map(
+                self._shapley_standard_errors
+            )
+        if bootstrap:
+            shapley_value_df = shapley_value_df.merge(interval_df, on="channel")
+        if touchpoint_level == "source_campaign":
+            shapley_value_df = self._roll_up_to_sources(
+                shapley_value_df, ["shapley_value"]
+            )
+
+        results_fpath = stage(
+            "Saving Shapley values", self._save_shapley_values, shapley_value_df
+        )
+        if plot == "inline":
+            stage(
+                "Plotting rescaled Shapley values",
+                plot_rescaled_values,
+                results_fpath,
+                "shapley_value",
+                self._params["plot_max_channels"],
+            )
+        elif plot == "background":
+            self._plot_processes.append(
+                plot_in_background(
+                    results_fpath, "shapley_value", self._params["plot_max_channels"]
+                )
+            )
+        self._save_metrics(instrumentation)
+        return shapley_value_df
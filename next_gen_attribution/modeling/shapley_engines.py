@@ -0,0 +1,382 @@
+"""
+Numerical kernels used by Shapley_Attribution to turn coalition values into Shapley values:
+1) bitmask, an exact engine over a dense array of v(S) indexed by integer coalition bitmasks
+2) sparse, an exact closed-form engine that only visits the observed coalitions
+3) monte_carlo, an approximate engine that samples touchpoint permutations in a process pool
+and bootstrap replicates of the exact Shapley values, resampled from the journey counts in a process pool
+"""
+import math
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+
+def shapley_weights(n: int) -> np.ndarray:
+    """
+    precomputes the Shapley weight for every coalition cardinality
+    :returns: array w of length n with w[k] = k!(n-k-1)!/n!, the weight of a coalition S with |S| = k
+    """
+    return np.array([1.0 / (n * math.comb(n - 1, k)) for k in range(n)])
+
+
+def popcounts(n: int) -> np.ndarray:
+    """
+    counts the number of set bits of every bitmask in [0, 2^n)
+    :returns: uint8 array of length 2^n with the cardinality of each coalition
+    """
+    counts = np.zeros(1 << n, dtype=np.uint8)
+    for bit in range(n):
+        # the upper half of [0, 2^(bit+1)) is the lower half with one more bit set
+        counts[1 << bit : 1 << (bit + 1)] = counts[: 1 << bit] + 1
+    return counts
+
+
+def bitmask_coalition_values(
+    journeys: np.ndarray, conversions: np.ndarray, n: int
+) -> np.ndarray:
+    """
+    scatters observed (journey bitmask, conversions) pairs into a dense array of coalition values
+    :returns: float64 array v of length 2^n with v[S] the conversions of coalition S (v[0] is the empty set)
+    """
+    values = np.bincount(
+        journeys.astype(np.int64), weights=conversions, minlength=1 << n
+    ).astype(np.float64)
+    # the empty coalition carries no value by definition
+    values[0] = 0.0
+    return values
+
+
+def bitmask_shapley_values(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    computes exact Shapley values from a dense array of coalition values indexed by bitmask,
+    where bit i of a coalition S is set iff touchpoint i is a member of S
+    :returns: float64 array of length n with the Shapley value of each touchpoint
+    """
+    # the grand coalition never lacks a touchpoint, so its weight is padded with a zero
+    weights = np.append(shapley_weights(n), 0.0)[popcounts(n)]
+    shapley_values = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        # view [0, 2^n) as (high bits, bit i, low bits) so that [:, 0, :] are the coalitions S without i
+        # and [:, 1, :] the matching coalitions S U {i}
+        v = values.reshape(-1, 2, 1 << i)
+        w = weights.reshape(-1, 2, 1 << i)[:, 0, :]
+        # sum over S not containing i of |S|!(n-|S|-1)!/n! * (v(S U {i}) - v(S))
+        shapley_values[i] = np.sum(w * (v[:, 1, :] - v[:, 0, :]))
+    return shapley_values
+
+
+def _log_shapley_weight(cardinality: np.ndarray, n: int) -> np.ndarray:
+    """
+    log of the Shapley weight |S|!(n-|S|-1)!/n!, computed through lgamma so that it stays finite for large n
+    :returns: float64 array of log-weights, -inf where |S| = n
+    """
+    lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+    cardinality = np.asarray(cardinality, dtype=np.float64)
+    log_weight = np.full(cardinality.shape, -np.inf)
+    proper = cardinality < n
+    log_weight[proper] = (
+        lgamma(cardinality[proper] + 1)
+        + lgamma(n - cardinality[proper])
+        - math.lgamma(n + 1)
+    )
+    return log_weight
+
+
+def _closed_form_weights(sizes: np.ndarray, n: int) -> tuple:
+    """
+    weights of the closed form of sparse_shapley_values for observed coalitions of the given sizes
+    :returns: (member gain + non-member loss, non-member loss), both 0 for the empty coalition
+    """
+    # the empty coalition carries no value by definition
+    observed = sizes > 0
+    member_gain = np.zeros(len(sizes))
+    non_member_loss = np.zeros(len(sizes))
+    member_gain[observed] = np.exp(_log_shapley_weight(sizes[observed] - 1, n))
+    non_member_loss[observed] = np.exp(_log_shapley_weight(sizes[observed], n))
+    return member_gain + non_member_loss, non_member_loss
+
+
+def sparse_shapley_values(
+    indptr: np.ndarray, indices: np.ndarray, conversions: np.ndarray, n: int
+) -> np.ndarray:
+    """
+    computes exact Shapley values of the game in which v(S) is the number of conversions observed for
+    exactly the coalition S, given the observed coalitions in CSR form, i.e., the members of coalition j
+    are indices[indptr[j]:indptr[j+1]] and its value is conversions[j]
+
+    the game is a sum over observed coalitions T of v(T) * [S == T], whose Shapley values have a closed form:
+    a member i of T gains (|T|-1)!(n-|T|)!/n! (as the last to join T), a non-member loses |T|!(n-|T|-1)!/n!
+    (as the one to leave T), hence the cost is linear in the total size of the observed coalitions
+    :returns: float64 array of length n with the Shapley value of each touchpoint
+    """
+    sizes = np.diff(indptr)
+    conversions = np.asarray(conversions, dtype=np.float64)
+    member_weight, non_member_loss = _closed_form_weights(sizes, n)
+    # every touchpoint is charged the loss, members get it back on top of their gain
+    shapley_values = np.bincount(
+        indices,
+        weights=np.repeat(conversions * member_weight, sizes),
+        minlength=n,
+    )
+    return shapley_values - np.sum(conversions * non_member_loss)
+
+
+def _coalition_hashes(
+    indptr: np.ndarray, indices: np.ndarray, keys: np.ndarray
+) -> np.ndarray:
+    """
+    hashes each coalition of a CSR layout as the XOR of the random keys of its members (Zobrist hashing),
+    which lets prefixes of a permutation be hashed incrementally with a cumulative XOR
+    :returns: uint64 array with one hash per coalition (0 for the empty coalition)
+    """
+    hashes = np.zeros(len(indptr) - 1, dtype=np.uint64)
+    sizes = np.diff(indptr)
+    observed = sizes > 0
+    hashes[observed] = np.bitwise_xor.reduceat(keys[indices], indptr[:-1][observed])
+    return hashes
+
+
+def _lookup_values(
+    hashes: np.ndarray, values: np.ndarray, queries: np.ndarray
+) -> np.ndarray:
+    """
+    looks up v(S) for hashed coalitions S in the sorted table of observed coalition hashes
+    :returns: float64 array shaped like queries, 0 for coalitions that were never observed
+    """
+    position = np.minimum(np.searchsorted(hashes, queries), len(hashes) - 1)
+    return np.where(hashes[position] == queries, values[position], 0.0)
+
+
+def _permutation_batch(args: tuple) -> tuple:
+    """
+    draws one batch of touchpoint permutations and accumulates the marginal contributions they yield;
+    module-level so that it can be shipped to worker processes
+    :returns: (sums, sums of squares) of the marginal contributions, shaped (n,) or (n, n) if stratified
+    """
+    hashes, values, keys, batch_size, stratified, seed_sequence = args
+    n = len(keys)
+    rng = np.random.default_rng(seed_sequence)
+    rows = np.arange(batch_size)[:, None]
+    if not stratified:
+        permutations = rng.permuted(np.tile(np.arange(n), (batch_size, 1)), axis=1)
+        # prefix_hashes[:, k] hashes the first k touchpoints of each permutation
+        prefix_hashes = np.zeros((batch_size, n + 1), dtype=np.uint64)
+        prefix_hashes[:, 1:] = np.bitwise_xor.accumulate(keys[permutations], axis=1)
+        marginals = np.empty((batch_size, n))
+        marginals[rows, permutations] = _lookup_values(
+            hashes, values, prefix_hashes[:, 1:]
+        ) - _lookup_values(hashes, values, prefix_hashes[:, :-1])
+        return marginals.sum(axis=0), np.square(marginals).sum(axis=0)
+
+    # stratum k holds the coalitions S of size k without touchpoint i; dropping i from a uniform permutation
+    # leaves a uniform permutation of the others, whose first k touchpoints are a uniform draw of S
+    sums = np.zeros((n, n))
+    sums_of_squares = np.zeros((n, n))
+    for k in range(n):
+        permutations = rng.permuted(np.tile(np.arange(n), (batch_size, 1)), axis=1)
+        positions = np.empty_like(permutations)
+        positions[rows, permutations] = np.arange(n)
+        prefix_hashes = np.zeros((batch_size, n + 1), dtype=np.uint64)
+        prefix_hashes[:, 1:] = np.bitwise_xor.accumulate(keys[permutations], axis=1)
+        without = np.where(
+            positions < k,
+            prefix_hashes[:, [min(k + 1, n)]] ^ keys,
+            prefix_hashes[:, [k]],
+        )
+        marginals = _lookup_values(hashes, values, without ^ keys) - _lookup_values(
+            hashes, values, without
+        )
+        sums[k] = marginals.sum(axis=0)
+        sums_of_squares[k] = np.square(marginals).sum(axis=0)
+    return sums, sums_of_squares
+
+
+def monte_carlo_shapley_values(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    conversions: np.ndarray,
+    n: int,
+    seed: int = 0,
+    batch_size: int = 1000,
+    n_workers: int = 1,
+    tolerance: float = None,
+    relative_tolerance: float = None,
+    max_permutations: int = 1000000,
+    time_budget: float = None,
+    stratified: bool = False,
+) -> tuple:
+    """
+    estimates Shapley values of the game in which v(S) is the number of conversions observed for exactly
+    the coalition S, given the observed coalitions in CSR form (see sparse_shapley_values), by sampling
+    touchpoint permutations in batches, optionally stratified by the size of the coalition a touchpoint joins
+
+    batch b is always drawn from the seed sequence (seed, b), and batches are accumulated and checked against
+    the stopping rules in batch order, so that for a given seed the estimates do not depend on n_workers and
+    are deterministic unless a time budget cuts the run short
+    :param batch_size: permutations per batch (per coalition size and batch if stratified)
+    :param n_workers: number of worker processes, each running one of the next n_workers batches
+    :param tolerance: stop once the largest standard error drops below this value
+    :param relative_tolerance: stop once the largest standard error drops below this share of the largest
+    absolute Shapley value, e.g., 0.01 whatever the scale of the conversions
+    :param max_permutations: stop once this many permutations (per coalition size if stratified) are drawn
+    :param time_budget: stop once this many seconds have elapsed
+    :returns: (Shapley values, standard errors, permutations drawn), the first two as float64 arrays of length n
+    """
+    keys = np.random.default_rng(np.random.SeedSequence(seed)).integers(
+        1, np.iinfo(np.uint64).max, size=n, dtype=np.uint64, endpoint=True
+    )
+    hashes = _coalition_hashes(indptr, indices, keys)
+    observed = np.diff(indptr) > 0
+    order = np.argsort(hashes[observed])
+    hashes = hashes[observed][order]
+    values = np.asarray(conversions, dtype=np.float64)[observed][order]
+    if len(hashes) == 0:
+        return np.zeros(n), np.zeros(n), 0
+
+    start_time = time.monotonic()
+    shape = (n, n) if stratified else (n,)
+    sums, sums_of_squares = np.zeros(shape), np.zeros(shape)
+    max_batches = max(-(-max_permutations // batch_size), 1)
+
+    def batch(b: int) -> tuple:
+        return (
+            hashes,
+            values,
+            keys,
+            batch_size,
+            stratified,
+            np.random.SeedSequence(seed, spawn_key=(b,)),
+        )
+
+    executor = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    # batches submitted ahead of the one being accumulated, so that every worker stays busy
+    pending = deque()
+    try:
+        for n_batches in range(1, max_batches + 1):
+            if executor:
+                while (
+                    len(pending) < n_workers and n_batches + len(pending) <= max_batches
+                ):
+                    pending.append(
+                        executor.submit(
+                            _permutation_batch, batch(n_batches - 1 + len(pending))
+                        )
+                    )
+                batch_sums, batch_sums_of_squares = pending.popleft().result()
+            else:
+                batch_sums, batch_sums_of_squares = _permutation_batch(
+                    batch(n_batches - 1)
+                )
+            sums += batch_sums
+            sums_of_squares += batch_sums_of_squares
+
+            n_permutations = n_batches * batch_size
+            means = sums / n_permutations
+            variances = np.maximum(
+                sums_of_squares / n_permutations - np.square(means), 0.0
+            ) * (n_permutations / max(n_permutations - 1, 1))
+            if stratified:
+                # phi_i is the average over coalition sizes of the per-stratum mean marginal contribution
+                shapley_values = means.mean(axis=0)
+                standard_errors = np.sqrt(variances.sum(axis=0) / n_permutations) / n
+            else:
+                shapley_values = means
+                standard_errors = np.sqrt(variances / n_permutations)
+
+            if (
+                (tolerance is not None and standard_errors.max() <= tolerance)
+                or (
+                    relative_tolerance is not None
+                    and standard_errors.max()
+                    <= relative_tolerance * np.abs(shapley_values).max()
+                )
+                or n_batches == max_batches
+                or (
+                    time_budget is not None
+                    and time.monotonic() - start_time >= time_budget
+                )
+            ):
+                return shapley_values, standard_errors, n_permutations
+    finally:
+        if executor:
+            # batches submitted past the one that met a stopping rule are discarded
+            executor.shutdown(cancel_futures=True)
+
+
+def _bootstrap_batch(args: tuple) -> np.ndarray:
+    """
+    draws one batch of bootstrap replicates of the users and computes their exact Shapley values, all at once;
+    module-level so that it can be shipped to worker processes
+    :returns: float64 array of shape (batch_size, n) with the Shapley values of each replicate
+    """
+    (
+        memberships,
+        member_weight,
+        non_member_loss,
+        users,
+        conversions,
+        batch_size,
+        seed_sequence,
+    ) = args
+    rng = np.random.default_rng(seed_sequence)
+    # users fall into one (coalition, converted) cell each, so resampling users with replacement is a
+    # multinomial draw over the cells, of which only the converted ones carry value
+    cells = np.concatenate([conversions, users - conversions])
+    replicate_conversions = rng.multinomial(
+        cells.sum(), cells / cells.sum(), size=batch_size
+    )[:, : len(conversions)]
+    # Shapley values are linear in the coalition values, i.e., the closed form of sparse_shapley_values
+    # is a (sparse) matrix product over the whole batch
+    return (memberships.T @ (replicate_conversions * member_weight).T).T - (
+        replicate_conversions @ non_member_loss
+    )[:, None]
+
+
+def bootstrap_shapley_values(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    conversions: np.ndarray,
+    users: np.ndarray,
+    n: int,
+    n_replicates: int = 1000,
+    batch_size: int = 100,
+    n_workers: int = 1,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    bootstraps the exact Shapley values of the game in which v(S) is the number of conversions observed for
+    exactly the coalition S, given the observed coalitions in CSR form (see sparse_shapley_values) along with their
+    users, by resampling the users of the count table with multinomial draws instead of resampling user rows
+
+    batch b is always drawn from the seed sequence (seed, b), so that the replicates do not depend on n_workers
+    :param n_replicates: number of bootstrap replicates
+    :param batch_size: replicates drawn and evaluated at once
+    :param n_workers: number of worker processes
+    :returns: float64 array of shape (n_replicates, n) with the Shapley values of each replicate
+    """
+    sizes = np.diff(indptr)
+    memberships = sparse.csr_matrix(
+        (np.ones(len(indices)), indices, indptr), shape=(len(sizes), n)
+    )
+    member_weight, non_member_loss = _closed_form_weights(sizes, n)
+    batches = [
+        (
+            memberships,
+            member_weight,
+            non_member_loss,
+            np.asarray(users, dtype=np.int64),
+            np.asarray(conversions, dtype=np.int64),
+            min(batch_size, n_replicates - start),
+            np.random.SeedSequence(seed, spawn_key=(b,)),
+        )
+        for b, start in enumerate(range(0, n_replicates, batch_size))
+    ]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            replicates = list(executor.map(_bootstrap_batch, batches))
+    else:
+        replicates = [_bootstrap_batch(batch) for batch in batches]
+    return np.concatenate(replicates)
@@ -1,16 +1,53 @@
+import glob
+import hashlib
 import os
+import shutil
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Union
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from next_gen_attribution.utility import logger, well_known_paths
+from next_gen_attribution.utility import logger, object_store_settings, well_known_paths
+from next_gen_attribution.utility.artifact_cache import ArtifactCache
+from next_gen_attribution.utility.instrumentation import Instrumentation
+from next_gen_attribution.utility.object_store import object_store_reader
 
 log = logger.init("Preprocessing on Dataset")
 
 
+@contextmanager
+def _atomic_output(fpath: str):
+    """
+    yields a temporary path to write fpath to, which then replaces fpath instead of being written through,
+    so that hard links to a previous version of fpath (e.g., in the artifact cache) are left untouched; a failed
+    write leaves fpath as it was, without the temporary file
+    """
+    # directories are created only once something is written to them, e.g., not on a cache hit
+    if not os.path.exists(os.path.dirname(fpath)):
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    tmp_fpath = f"{fpath}.tmp"
+    try:
+        yield tmp_fpath
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+
+
 class Preprocessor(ABC):
     """abstract class for BU-specific preprocessors"""
 
+    # bump whenever a change to the preprocessing logic invalidates the saved journey-count snapshots
+    _logic_version = "2"
+    # touchpoint levels whose path counts are saved as journeys_<level> with campaign_level, next to the path
+    # counts of the source level (journeys_source) and the journeys
+    _campaign_touchpoint_levels = ("campaign", "source_campaign")
+
     def __init__(
         self,
         business_unit: str,
@@ -18,6 +55,7 @@ class Preprocessor(ABC):
         data_source: str,
         spark_date: str,
         data_tag: str,
+        data_format: str = "csv",
     ) -> None:
         self._business_unit = business_unit
         self._workflow_mode = workflow_mode
@@ -26,42 +64,448 @@ class Preprocessor(ABC):
         self._spark_date = spark_date
         # data tag to store train/val/test/scoring processed splits under
         self._data_tag = data_tag
+        # one of {csv, parquet}, the format the preprocessed data are saved in
+        self._data_format = data_format
         self._logger = logger.init(f"{business_unit}_preprocessor")
+        # local paths of the input data fetched from the object store, see _input_fpaths
+        self._s3_input_fpaths = None
+        # {spark date: key of the inputs its snapshot was preprocessed from}, see _snapshot_key
+        self._snapshot_keys = {}
         self._output_dir = os.path.join(
             well_known_paths["PREPROCESSED_DATA_DIR"], self._spark_date, self._data_tag
         )
-        self._output_fpath = os.path.join(self._output_dir, "preprocessed.csv")
-        if not os.path.exists(self._output_dir):
-            os.makedirs(self._output_dir)
+        self._output_fpath = os.path.join(
+            self._output_dir, f"preprocessed.{self._data_format}"
+        )
+        self._journeys_output_fpath = os.path.join(
+            self._output_dir, f"journeys.{self._data_format}"
+        )
+        # per-spark-date journey counts, which do not depend on the data tag nor format
+        self._snapshot_dir = os.path.join(
+            well_known_paths["PREPROCESSED_DATA_DIR"],
+            "snapshots",
+            self._business_unit,
+            f"v{self._logic_version}",
+        )
+
+    def _input_fnames(self, spark_date: str = None) -> dict:
+        """
+        :returns: the paths of the input data of spark_date (this preprocessor's by default) relative to the
+        datasets directory (or object store prefix)
+        """
+        spark_date = spark_date or self._spark_date
+        return {
+            "lytics": f"{spark_date}/lytics_web_data_last_5_expanded.csv",
+            "id": f"{spark_date}/lytics_cleaned.csv",
+            "conversion": f"{spark_date}/conversion.csv",
+        }
+
+    def _input_versions(self, spark_date: str = None) -> list:
+        """
+        :returns: the path, size and modification time (ETag with data_source s3) of every input of spark_date,
+        which identify the inputs without reading or downloading them
+        """
+        input_fnames = self._input_fnames(spark_date).values()
+        if self._data_source == "s3":
+            s3_paths = [
+                object_store_settings["DATASETS_URL"] + fname for fname in input_fnames
+            ]
+            heads = object_store_reader().head_all(s3_paths)
+            return [
+                f"{s3_path}:{size}:{etag}" for s3_path, (size, etag) in heads.items()
+            ]
+        versions = []
+        for fname in input_fnames:
+            stat = os.stat(os.path.join(well_known_paths["DATASETS_DIR"], fname))
+            versions.append(f"{fname}:{stat.st_size}:{stat.st_mtime_ns}")
+        return versions
+
+    def _input_fpaths(self) -> dict:
+        """
+        :returns: the local paths of the input data, downloaded to the object store cache first with
+        data_source s3
+        """
+        input_fnames = self._input_fnames()
+        if self._data_source == "local":
+            return {
+                name: os.path.join(well_known_paths["DATASETS_DIR"], fname)
+                for name, fname in input_fnames.items()
+            }
+        elif self._data_source == "s3":
+            if self._s3_input_fpaths is None:
+                s3_paths = {
+                    name: object_store_settings["DATASETS_URL"] + fname
+                    for name, fname in input_fnames.items()
+                }
+                local_fpaths = object_store_reader().fetch_all(list(s3_paths.values()))
+                self._s3_input_fpaths = {
+                    name: local_fpaths[s3_path] for name, s3_path in s3_paths.items()
+                }
+            return self._s3_input_fpaths
+        else:
+            raise RuntimeError("data_source must be one of {'local', 's3'}.")
 
     def _get_data(self):
-        lytics_data_fpath = os.path.join(
-            well_known_paths["DATASETS_DIR"],
-            f"{self._spark_date}/lytics_web_data_last_5_expanded.csv",
+        input_fpaths = self._input_fpaths()
+        lytics_data = pd.read_csv(input_fpaths["lytics"], low_memory=False)
+        id_data = pd.read_csv(input_fpaths["id"], low_memory=False)
+        conversion_data = pd.read_csv(input_fpaths["conversion"], low_memory=False)
+        return lytics_data, id_data, conversion_data
+
+    def _get_columns(
+        self, name: str, usecols: list, dtype: dict, chunksize: int = None
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """
+        reads only the given columns of one of {lytics, id, conversion} data with explicit dtypes
+        :returns: the data, or an iterator over chunks of at most chunksize rows if chunksize is given
+        """
+        return pd.read_csv(
+            self._input_fpaths()[name],
+            usecols=usecols,
+            dtype=dtype,
+            chunksize=chunksize,
+        )
+
+    def _to_dense(self, preprocessed_data: pd.DataFrame) -> pd.DataFrame:
+        """
+        converts the sparse indicator columns of preprocessed data to dense ones right before writing, which
+        parquet requires and csv does much faster
+        """
+        sparse_columns = [
+            column
+            for column in preprocessed_data.columns
+            if isinstance(preprocessed_data[column].dtype, pd.SparseDtype)
+        ]
+        if not sparse_columns:
+            return preprocessed_data
+        return preprocessed_data.assign(
+            **{
+                column: preprocessed_data[column].sparse.to_dense()
+                for column in sparse_columns
+            }
         )
-        id_data_fpath = os.path.join(
-            well_known_paths["DATASETS_DIR"],
-            f"{self._spark_date}/lytics_cleaned.csv",
+
+    def _to_columnar(self, preprocessed_data: pd.DataFrame) -> pd.DataFrame:
+        """
+        casts the columns of preprocessed data to the dtypes they are saved with, whatever their in-memory dtype
+        plan: dense uint8 indicator and conversion columns, and plain strings instead of categoricals
+        """
+        dtypes = {
+            column: np.uint8
+            for column in preprocessed_data.columns
+            if column.startswith("utm_") or column == "is_converted"
+        }
+        for column, dtype in preprocessed_data.dtypes.items():
+            if isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype)):
+                dtypes[column] = object
+        return self._to_dense(preprocessed_data).astype(dtypes)
+
+    def _memory_report(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        logs the in-memory footprint of data per dtype and saves it per column to metrics/memory_report.csv
+        :returns: the dtype, megabytes (strings included) and bytes per row of every column of data
+        """
+        memory = data.memory_usage(deep=True, index=False)
+        report = pd.DataFrame(
+            {
+                "column": memory.index,
+                "dtype": data.dtypes.astype(str).to_numpy(),
+                "memory_mb": memory.to_numpy() / 2**20,
+                "bytes_per_row": memory.to_numpy() / max(len(data), 1),
+            }
         )
-        conversion_data_fpath = os.path.join(
-            well_known_paths["DATASETS_DIR"],
-            f"{self._spark_date}/conversion.csv",
+        for dtype, dtype_report in report.groupby("dtype"):
+            self._logger.info(
+                f"{len(dtype_report)} {dtype} columns take {dtype_report['memory_mb'].sum():.1f}MB, {dtype_report['bytes_per_row'].sum():.1f} bytes per row"
+            )
+        self._logger.info(
+            f"{len(data)} rows take {report['memory_mb'].sum():.1f}MB, {report['bytes_per_row'].sum():.1f} bytes per row"
         )
-        lytics_data = pd.read_csv(lytics_data_fpath, low_memory=False)
-        id_data = pd.read_csv(id_data_fpath, low_memory=False)
-        conversion_data = pd.read_csv(conversion_data_fpath, low_memory=False)
-        return lytics_data, id_data, conversion_data
+        metrics_dir = os.path.join(self._output_dir, "metrics")
+        if not os.path.exists(metrics_dir):
+            os.makedirs(metrics_dir, exist_ok=True)
+        report.to_csv(os.path.join(metrics_dir, "memory_report.csv"), index=False)
+        return report
+
+    def _load_preprocessed(
+        self,
+        spark_date: str,
+        data_fname: str = "preprocessed",
+        keep_default_na: bool = True,
+    ) -> pd.DataFrame:
+        """
+        loads the preprocessed data (or the aggregated journeys if data_fname is "journeys") saved for another
+        spark date under the same data tag and format
+        :param keep_default_na: whether csv values like "" or "null" are read as NaN, see pandas.read_csv
+        """
+        preprocessed_data_fpath = os.path.join(
+            well_known_paths["PREPROCESSED_DATA_DIR"],
+            spark_date,
+            self._data_tag,
+            f"{data_fname}.{self._data_format}",
+        )
+        if self._data_format == "csv":
+            return pd.read_csv(preprocessed_data_fpath, keep_default_na=keep_default_na)
+        elif self._data_format == "parquet":
+            return pd.read_parquet(preprocessed_data_fpath)
+        else:
+            raise RuntimeError("data_format must be one of {'csv', 'parquet'}.")
+
+    def _snapshot_tables(
+        self, user_level: bool = False, campaign_level: bool = False
+    ) -> tuple:
+        # the journey counts and source-level path counts, along with the campaign-level path counts and the
+        # user-level data of the modes that need them
+        data_fnames = (
+            "journeys",
+            *(
+                f"journeys_{touchpoint_level}"
+                for touchpoint_level in self._path_touchpoint_levels(campaign_level)
+            ),
+        )
+        if user_level:
+            return (*data_fnames, "preprocessed")
+        return data_fnames
+
+    def _snapshot_key(self, spark_date: str) -> str:
+        """
+        :returns: the hex digest of the inputs of spark_date, so that snapshots of changed inputs are not reused
+        """
+        if spark_date not in self._snapshot_keys:
+            digest = hashlib.sha256()
+            for version in self._input_versions(spark_date):
+                digest.update(version.encode())
+            self._snapshot_keys[spark_date] = digest.hexdigest()[:16]
+        return self._snapshot_keys[spark_date]
+
+    def _snapshot_fpath(self, spark_date: str, data_fname: str = "journeys") -> str:
+        # counts are saved in parquet format, the user-level data are linked in the format they were saved in
+        extension = self._data_format if data_fname == "preprocessed" else "parquet"
+        return os.path.join(
+            self._snapshot_dir,
+            data_fname,
+            f"{spark_date}.{self._snapshot_key(spark_date)}.{extension}",
+        )
+
+    def _remove_stale_snapshots(self, data_fname: str) -> None:
+        # snapshots of this preprocessor's spark date preprocessed from other inputs
+        for snapshot_fpath in glob.glob(
+            os.path.join(self._snapshot_dir, data_fname, f"{self._spark_date}.*")
+        ):
+            if snapshot_fpath.split(".")[-2] != self._snapshot_key(self._spark_date):
+                os.remove(snapshot_fpath)
+
+    def has_snapshot(
+        self, spark_date: str, user_level: bool = False, campaign_level: bool = False
+    ) -> bool:
+        """
+        whether the snapshot of spark_date was saved from its current inputs with the current preprocessing
+        logic, with every table user_level and campaign_level require
+        """
+        return all(
+            os.path.exists(self._snapshot_fpath(spark_date, data_fname))
+            for data_fname in self._snapshot_tables(user_level, campaign_level)
+        )
+
+    def _save_snapshot(
+        self,
+        journey_aggregate: pd.DataFrame,
+        path_aggregates: dict,
+        user_level: bool = False,
+    ):
+        """
+        saves the snapshot of this preprocessor's spark date, i.e., its journey counts and the path counts of
+        every touchpoint level of path_aggregates, along with its saved user-level data if user_level
+        """
+        tables = {"journeys": journey_aggregate}
+        for touchpoint_level, path_aggregate in path_aggregates.items():
+            tables[f"journeys_{touchpoint_level}"] = path_aggregate
+        for data_fname, data in tables.items():
+            snapshot_fpath = self._snapshot_fpath(self._spark_date, data_fname)
+            log.info(f"Saving journey-count snapshot to {snapshot_fpath}...")
+            with _atomic_output(snapshot_fpath) as tmp_fpath:
+                self._to_columnar(data).to_parquet(tmp_fpath, index=False)
+            self._remove_stale_snapshots(data_fname)
+        if user_level:
+            snapshot_fpath = self._snapshot_fpath(self._spark_date, "preprocessed")
+            log.info(f"Linking user-level data snapshot to {snapshot_fpath}...")
+            with _atomic_output(snapshot_fpath) as tmp_fpath:
+                # outputs are replaced instead of written through, so that a hard link stays intact
+                try:
+                    os.link(self._output_fpath, tmp_fpath)
+                except OSError:
+                    shutil.copy2(self._output_fpath, tmp_fpath)
+            self._remove_stale_snapshots("preprocessed")
+
+    def _load_snapshot(
+        self, spark_date: str, data_fname: str = "journeys"
+    ) -> pd.DataFrame:
+        snapshot_fpath = self._snapshot_fpath(spark_date, data_fname)
+        if snapshot_fpath.endswith(".csv"):
+            return pd.read_csv(snapshot_fpath)
+        return pd.read_parquet(snapshot_fpath)
+
+    def _write(self, data: pd.DataFrame, fpath: str):
+        with _atomic_output(fpath) as tmp_fpath:
+            if self._data_format == "csv":
+                self._to_columnar(data).to_csv(tmp_fpath, index=False)
+            elif self._data_format == "parquet":
+                self._to_columnar(data).to_parquet(tmp_fpath, index=False)
+            else:
+                raise RuntimeError("data_format must be one of {'csv', 'parquet'}.")
+
+    def _path_touchpoint_levels(self, campaign_level: bool) -> tuple:
+        # the source-level path counts are always saved, e.g., for path-based models like Markov_Attribution
+        if campaign_level:
+            return ("source", *self._campaign_touchpoint_levels)
+        return ("source",)
+
+    def _journeys_fpath(self, touchpoint_level: str = None) -> str:
+        if touchpoint_level is None:
+            return self._journeys_output_fpath
+        return os.path.join(
+            self._output_dir, f"journeys_{touchpoint_level}.{self._data_format}"
+        )
+
+    def _save_journeys_to_local(
+        self, journey_aggregate: pd.DataFrame, touchpoint_level: str = None
+    ):
+        """
+        saves aggregated journeys (or the path counts of touchpoint_level if given) to local
+        """
+        journeys_fpath = self._journeys_fpath(touchpoint_level)
+        log.info(f"Saving aggregated journeys to {journeys_fpath}...")
+        self._write(journey_aggregate, journeys_fpath)
 
     def _save_to_local(self, preprocessed_data: pd.DataFrame):
         """
         saves preprocessed data to local
         """
         log.info(f"Saving preprocessed data to {self._output_fpath}...")
-        preprocessed_data.to_csv(self._output_fpath, index=False)
+        self._write(preprocessed_data, self._output_fpath)
+
+    def _save_chunks_to_local(self, preprocessed_chunks: Iterable[pd.DataFrame]):
+        """
+        saves preprocessed data to local chunk by chunk, so that only one chunk is held in memory at a time
+        (all chunks must share the same columns)
+        """
+        log.info(f"Saving preprocessed data chunks to {self._output_fpath}...")
+        writer = None
+        with _atomic_output(self._output_fpath) as tmp_fpath:
+            for i, preprocessed_chunk in enumerate(preprocessed_chunks):
+                if self._data_format == "csv":
+                    self._to_columnar(preprocessed_chunk).to_csv(
+                        tmp_fpath,
+                        index=False,
+                        mode="a" if i else "w",
+                        header=not i,
+                    )
+                elif self._data_format == "parquet":
+                    table = pa.Table.from_pandas(
+                        self._to_columnar(preprocessed_chunk), preserve_index=False
+                    )
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_fpath, table.schema)
+                    writer.write_table(table)
+                else:
+                    raise RuntimeError("data_format must be one of {'csv', 'parquet'}.")
+            if writer is not None:
+                writer.close()
+
+    def _save_metrics(self, instrumentation: Instrumentation) -> None:
+        """
+        saves the stage metrics of a run to the metrics/ directory next to the preprocessed data
+        """
+        instrumentation.save(os.path.join(self._output_dir, "metrics"))
+
+    def load_journeys(self, path_level: str = None) -> pd.DataFrame:
+        """
+        :returns: the aggregated journeys saved by this preprocessor, or the path counts of path_level if given
+        """
+        if path_level is None:
+            return self._load_preprocessed(self._spark_date, "journeys")
+        # paths are read as is, e.g., "" for no touchpoint or the path of a single "null" campaign
+        return self._load_preprocessed(
+            self._spark_date, f"journeys_{path_level}", keep_default_na=False
+        )
+
+    def cached_etl(self, cache: ArtifactCache, **kwargs) -> pd.DataFrame:
+        """
+        links the artifacts of a previous etl(**kwargs) on the same inputs, preprocessor class and logic version
+        from the cache, or runs etl(**kwargs) and caches its artifacts
+        :returns: the aggregated journeys, or the path counts of the path_level argument if given
+        """
+        artifacts = {
+            os.path.basename(self._journeys_output_fpath): self._journeys_output_fpath
+        }
+        if kwargs.get("user_level"):
+            artifacts[os.path.basename(self._output_fpath)] = self._output_fpath
+        for touchpoint_level in self._path_touchpoint_levels(
+            kwargs.get("campaign_level", False)
+        ):
+            journeys_fpath = self._journeys_fpath(touchpoint_level)
+            artifacts[os.path.basename(journeys_fpath)] = journeys_fpath
+        snapshot_tables = self._snapshot_tables(
+            kwargs.get("user_level", False), kwargs.get("campaign_level", False)
+        )
+        if kwargs.get("snapshot"):
+            for data_fname in snapshot_tables:
+                artifacts[f"snapshot_{data_fname}"] = self._snapshot_fpath(
+                    self._spark_date, data_fname
+                )
+        if self._data_source == "s3":
+            # keyed by the ETags of the inputs, which are downloaded only on a cache miss
+            input_fpaths, input_versions = [], self._input_versions()
+        else:
+            input_fpaths, input_versions = list(self._input_fpaths().values()), []
+        key = cache.key(
+            input_fpaths,
+            *input_versions,
+            type(self).__name__,
+            self._logic_version,
+            *sorted(artifacts),
+        )
+        if cache.restore(key, artifacts):
+            log.info(f"Linked cached preprocessed data to {self._output_dir}")
+            if kwargs.get("snapshot"):
+                for data_fname in snapshot_tables:
+                    self._remove_stale_snapshots(data_fname)
+            return self.load_journeys(kwargs.get("path_level"))
+        journey_aggregate = self.etl(**kwargs)
+        cache.store(key, artifacts)
+        return journey_aggregate
+
+    @abstractmethod
+    def etl(self) -> pd.DataFrame:
+        """
+        implements BU-specific ETL to generate the aggregated journeys and path counts (and, on request, the
+        user-level preprocessed data) used in subsequent modeling
+        :returns: the aggregated journeys, or the path counts of the path_level argument if given (which are also
+        saved in the data_format of the preprocessor unless persist=False)
+        """
+
+    @abstractmethod
+    def merge(
+        self, spark_dates: list, user_level: bool = False, campaign_level: bool = False
+    ) -> pd.DataFrame:
+        """
+        implements BU-specific merging of data preprocessed for several spark dates into this preprocessor's output
+        :returns: the merged aggregated journeys (which are also saved in the data_format of the preprocessor)
+        """
+
+    @abstractmethod
+    def merge_snapshots(
+        self, spark_dates: list, user_level: bool = False, campaign_level: bool = False
+    ) -> pd.DataFrame:
+        """
+        implements BU-specific merging of the snapshots of several spark dates, like merge
+        :returns: the aggregated journeys (which are also saved in the data_format of the preprocessor, along with the path counts)
+        """
 
     @abstractmethod
-    def etl(self) -> None:
+    def daily_snapshots(self, spark_dates: list) -> pd.DataFrame:
         """
-        implements BU-specific ETL to generate preprocessed data used in subsequent modeling
-        :returns: None (the preprocessed data output are saved in csv format)
+        implements BU-specific loading of the journey-count snapshots of several spark dates, aligned across them
+        but not merged
+        :returns: (the users and conversions of every (spark_date, journey), those of every (spark_date, path))
         """
@@ -5,8 +5,32 @@ Preprocessor object factory with member functions that are overridden by the fol
 __author__ = "HB"
 
 import importlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import pandas as pd
 
 from next_gen_attribution.preprocessing.preprocessor import Preprocessor
+from next_gen_attribution.utility import (
+    filter_data_files_with_date_range,
+    logger,
+    object_store_settings,
+    well_known_paths,
+)
+from next_gen_attribution.utility.artifact_cache import ArtifactCache
+from next_gen_attribution.utility.object_store import object_store_reader
+
+log = logger.init("Preprocessor Factory")
+
+
+def _etl(factory: "PreprocessorFactory", kwargs: dict) -> None:
+    """
+    runs the ETL of a factory, module-level so that it can be shipped to worker processes (the aggregated journeys
+    are saved, hence not shipped back)
+    """
+    factory.etl(**kwargs)
 
 
 class PreprocessorFactory:
@@ -19,12 +43,14 @@ class PreprocessorFactory:
         data_source: str,
         spark_date: str,
         data_tag: str,
+        data_format: str = "csv",
     ):
         self._business_unit = business_unit
         self._workflow_mode = workflow_mode
         self._data_source = data_source
         self._spark_date = spark_date
         self._data_tag = data_tag
+        self._data_format = data_format
 
     def _preprocessor_factory(self) -> Preprocessor:
         """
@@ -44,11 +70,168 @@ class PreprocessorFactory:
             self._data_source,
             self._spark_date,
             self._data_tag,
+            self._data_format,
         )
 
-    def etl(self, **kwargs) -> None:
+    def etl(self, cache: ArtifactCache = None, **kwargs) -> pd.DataFrame:
         """
         public member function that is overridden by BU-specific ETL
-        :returns: None (the preprocessed data output are saved in csv format)
+        :param cache: if given, artifacts of unchanged inputs are linked from the cache instead of preprocessed again
+        (only when the artifacts are persisted)
+        :returns: the aggregated journeys (or the path counts of the path_level argument, e.g., "source" for
+        Markov_Attribution), which can be handed straight to the train() of an attribution model
         """
+        if cache is not None and kwargs.get("persist", True):
+            return self._preprocessor_factory().cached_etl(cache, **kwargs)
         return self._preprocessor_factory().etl(**kwargs)
+
+    def _available_spark_dates(self, date_range: str) -> list:
+        """
+        non-public member function that finds the dated dataset directories within a date range
+        :returns: the sorted list of spark dates, e.g., ["20221101", "20221102", ...]
+        """
+        if self._data_source == "s3":
+            dataset_dirs = object_store_reader().list_prefixes(
+                object_store_settings["DATASETS_URL"]
+            )
+        else:
+            dataset_dirs = [
+                d
+                for d in os.listdir(well_known_paths["DATASETS_DIR"])
+                if os.path.isdir(os.path.join(well_known_paths["DATASETS_DIR"], d))
+            ]
+        dataset_dirs = [d for d in dataset_dirs if re.fullmatch(r"\d{8}", d)]
+        spark_dates = sorted(
+            set(filter_data_files_with_date_range(dataset_dirs, date_range))
+        )
+        if not spark_dates:
+            raise RuntimeError(f"No dataset directories found within {date_range}.")
+        return spark_dates
+
+    def etl_date_range(
+        self, date_range: str, n_workers: int = None, **kwargs
+    ) -> pd.DataFrame:
+        """
+        public member function that runs the BU-specific ETL on every spark date within date_range in a pool of
+        n_workers processes, then merges the results into one dataset tagged with the date range as spark date
+        :returns: the merged aggregated journeys (which are also saved in the data_format of the preprocessor)
+        """
+        spark_dates = self._available_spark_dates(date_range)
+        log.info(
+            f"Preprocessing {len(spark_dates)} spark dates within {date_range} with {n_workers or os.cpu_count()} workers"
+        )
+        factories = [
+            PreprocessorFactory(
+                self._business_unit,
+                self._workflow_mode,
+                self._data_source,
+                spark_date,
+                self._data_tag,
+                self._data_format,
+            )
+            for spark_date in spark_dates
+        ]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # the merge reads back what each spark date saved
+            list(executor.map(_etl, factories, repeat({**kwargs, "persist": True})))
+
+        log.info(f"Merging preprocessed data of {len(spark_dates)} spark dates")
+        return (
+            PreprocessorFactory(
+                self._business_unit,
+                self._workflow_mode,
+                self._data_source,
+                date_range,
+                self._data_tag,
+                self._data_format,
+            )
+            ._preprocessor_factory()
+            .merge(
+                spark_dates,
+                kwargs.get("user_level", False),
+                kwargs.get("campaign_level", False),
+            )
+        )
+
+    def _etl_snapshots(
+        self, date_range: str, n_workers: int, rebuild: bool, kwargs: dict
+    ) -> tuple:
+        """
+        non-public member function that runs the BU-specific ETL only on the spark dates within date_range that
+        have no snapshot of their current inputs with the tables the user_level and campaign_level arguments ask
+        for yet (or all of them if rebuild), in a pool of n_workers processes
+        :returns: (spark dates within date_range, preprocessor tagged with the date range as spark date)
+        """
+        spark_dates = self._available_spark_dates(date_range)
+        if rebuild:
+            # a cached snapshot would be linked back instead of rebuilt
+            kwargs.pop("cache", None)
+        merged_preprocessor = PreprocessorFactory(
+            self._business_unit,
+            self._workflow_mode,
+            self._data_source,
+            date_range,
+            self._data_tag,
+            self._data_format,
+        )._preprocessor_factory()
+        new_spark_dates = [
+            spark_date
+            for spark_date in spark_dates
+            if rebuild
+            or not merged_preprocessor.has_snapshot(
+                spark_date,
+                kwargs.get("user_level", False),
+                kwargs.get("campaign_level", False),
+            )
+        ]
+        log.info(
+            f"Preprocessing {len(new_spark_dates)} out of {len(spark_dates)} spark dates within {date_range} that have no journey-count snapshot"
+        )
+        factories = [
+            PreprocessorFactory(
+                self._business_unit,
+                self._workflow_mode,
+                self._data_source,
+                spark_date,
+                self._data_tag,
+                self._data_format,
+            )
+            for spark_date in new_spark_dates
+        ]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(_etl, factories, repeat({**kwargs, "snapshot": True})))
+        return spark_dates, merged_preprocessor
+
+    def etl_incremental(
+        self, date_range: str, n_workers: int = None, rebuild: bool = False, **kwargs
+    ) -> pd.DataFrame:
+        """
+        public member function that runs the BU-specific ETL only on the spark dates within date_range that have
+        no journey-count snapshot yet (or all of them if rebuild), in a pool of n_workers processes, then merges
+        the snapshots of the whole range into aggregated journeys tagged with the date range as spark date
+        :returns: the aggregated journeys (which are also saved in the data_format of the preprocessor)
+        """
+        spark_dates, merged_preprocessor = self._etl_snapshots(
+            date_range, n_workers, rebuild, kwargs
+        )
+        log.info(f"Merging journey-count snapshots of {len(spark_dates)} spark dates")
+        return merged_preprocessor.merge_snapshots(
+            spark_dates,
+            kwargs.get("user_level", False),
+            kwargs.get("campaign_level", False),
+        )
+
+    def etl_daily(
+        self, date_range: str, n_workers: int = None, rebuild: bool = False, **kwargs
+    ) -> tuple:
+        """
+        public member function that, like etl_incremental, preprocesses the spark dates within date_range that
+        have no journey-count snapshot yet, but keeps the snapshots apart instead of merging them
+        :returns: (the users and conversions of every (spark_date, journey), those of every (spark_date, path)),
+        e.g., for RollingAttribution
+        """
+        spark_dates, merged_preprocessor = self._etl_snapshots(
+            date_range, n_workers, rebuild, kwargs
+        )
+        log.info(f"Loading journey-count snapshots of {len(spark_dates)} spark dates")
+        return merged_preprocessor.daily_snapshots(spark_dates)
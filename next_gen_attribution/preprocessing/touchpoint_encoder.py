@@ -0,0 +1,98 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class TouchpointEncoder:
+    """
+    shared categorical vocabulary that encodes the (unified, hence duplicated) touchpoint columns of each family,
+    e.g., the 15 {ea,et,legacy} x {0..4} "utm_source" columns, into per-user counts of every touchpoint value
+    """
+
+    def __init__(self, families: Iterable[str] = ("utm_campaign", "utm_source")):
+        self._families = list(families)
+        self._vocabulary = {family: [] for family in self._families}
+
+    def fit(self, data: pd.DataFrame) -> "TouchpointEncoder":
+        """
+        adds the touchpoint values found in data to the vocabulary, so that it can be fit chunk by chunk
+        :returns: the encoder itself
+        """
+        for family in self._families:
+            values = pd.unique(data.loc[:, data.columns == family].to_numpy().ravel())
+            values = [value for value in values if not pd.isna(value)]
+            self._vocabulary[family] = sorted(
+                set(self._vocabulary[family]).union(values),
+                key=lambda value: f"{family}_{value}",
+            )
+        return self
+
+    @property
+    def columns(self) -> list:
+        """
+        names of the indicator columns, in the same order as the vocabulary
+        """
+        return [
+            f"{family}_{value}"
+            for family in self._families
+            for value in self._vocabulary[family]
+        ]
+
+    def transform_sparse(self, data: pd.DataFrame) -> sparse.csr_matrix:
+        """
+        maps every touchpoint value to its integer code in the vocabulary and scatters the codes into a sparse
+        matrix of counts, so that memory stays linear in rows x channels (unknown values are ignored)
+        :returns: uint8 csr matrix of shape (len(data), len(self.columns))
+        """
+        offset = 0
+        rows, codes = [], []
+        for family in self._families:
+            values = data.loc[:, data.columns == family].to_numpy()
+            family_codes = pd.Categorical(
+                values.ravel(), categories=self._vocabulary[family]
+            ).codes.reshape(values.shape)
+            row, position = np.nonzero(family_codes >= 0)
+            rows.append(row)
+            codes.append(family_codes[row, position].astype(np.int64) + offset)
+            offset += len(self._vocabulary[family])
+        rows, codes = np.concatenate(rows), np.concatenate(codes)
+        # duplicate (row, code) entries, i.e., repeated touchpoints, are summed into counts
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.uint8), (rows, codes)),
+            shape=(len(data), offset),
+        )
+
+    def transform(
+        self, data: pd.DataFrame, sparse_families: Iterable[str] = ()
+    ) -> pd.DataFrame:
+        """
+        :param sparse_families: families whose columns are kept sparse, e.g., the hundreds of "utm_campaign" ones,
+        so that their memory grows with the touchpoints users actually have
+        :returns: uint8 frame of per-user touchpoint counts indexed like data, one column per vocabulary entry
+        """
+        counts = self.transform_sparse(data).tocsc()
+        is_sparse = np.array(
+            [
+                family in sparse_families
+                for family in self._families
+                for _ in self._vocabulary[family]
+            ],
+            dtype=bool,
+        )
+        columns = np.array(self.columns, dtype=object)
+        frames = [
+            pd.DataFrame(
+                counts[:, ~is_sparse].toarray(),
+                index=data.index,
+                columns=columns[~is_sparse],
+            )
+        ]
+        if is_sparse.any():
+            frames.append(
+                pd.DataFrame.sparse.from_spmatrix(
+                    counts[:, is_sparse], index=data.index, columns=columns[is_sparse]
+                )
+            )
+        return pd.concat(frames, axis=1)[self.columns]
@@ -1,9 +1,15 @@
+import tracemalloc
 from datetime import date
-from typing import Tuple
+from typing import Callable, Iterator
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 from next_gen_attribution.preprocessing.preprocessor import Preprocessor
+from next_gen_attribution.preprocessing.touchpoint_encoder import TouchpointEncoder
+from next_gen_attribution.utility.instrumentation import Instrumentation
 
 curr_date = date.today().strftime("%Y%m%d")
 
@@ -11,111 +17,204 @@ curr_date = date.today().strftime("%Y%m%d")
 class ToursPreprocessor(Preprocessor):
     """implementation of a BU-specific preprocessor for Tours"""
 
+    _lytics_columns = [
+        "_uid",
+        "ea_utm_source_0",
+        "ea_utm_source_1",
+        "ea_utm_source_2",
+        "ea_utm_source_3",
+        "ea_utm_source_4",
+        "ea_utm_campaign_0",
+        "ea_utm_campaign_1",
+        "ea_utm_campaign_2",
+        "ea_utm_campaign_3",
+        "ea_utm_campaign_4",
+        "et_utm_source_0",
+        "et_utm_source_1",
+        "et_utm_source_2",
+        "et_utm_source_3",
+        "et_utm_source_4",
+        "et_utm_campaign_0",
+        "et_utm_campaign_1",
+        "et_utm_campaign_2",
+        "et_utm_campaign_3",
+        "et_utm_campaign_4",
+        "utm_source_0",
+        "utm_source_1",
+        "utm_source_2",
+        "utm_source_3",
+        "utm_source_4",
+        "utm_campaign_0",
+        "utm_campaign_1",
+        "utm_campaign_2",
+        "utm_campaign_3",
+        "utm_campaign_4",
+    ]
+    # dtype plan of lytics data, where touchpoint values are read as categoricals, i.e., one small code per value
+    # instead of one Python string, and _uid as an arrow-backed string; ordered paths are categoricals as well,
+    # indicator columns uint8 (bit-packed into the uint64 "journey") and conversions a boolean flag, see
+    # Preprocessor._to_columnar for the dtypes they are saved with
+    _lytics_dtypes = {
+        "_uid": "string[pyarrow]",
+        **{column: "category" for column in _lytics_columns[1:]},
+    }
+    # rows of lytics data used to size chunks in streaming mode
+    _sample_rows = 10000
+    # ordered path column of each touchpoint level, e.g., "google>email" at the source level, "camp1>camp7" at
+    # the campaign level and "google/camp1>email/(not set)" at the source_campaign level
+    _path_columns = {
+        "source": "path",
+        "campaign": "campaign_path",
+        "source_campaign": "source_campaign_path",
+    }
+
     def __init__(
         self,
         workflow_mode: str = "dev",
         data_source: str = "local",
         spark_date: str = "20221116",
         data_tag: str = f"generated_{curr_date}",
+        data_format: str = "csv",
     ) -> None:
-        super().__init__("tours", workflow_mode, data_source, spark_date, data_tag)
+        super().__init__(
+            "tours", workflow_mode, data_source, spark_date, data_tag, data_format
+        )
         self._curr_date = curr_date
 
     def _pick_touchpoints(self, data: pd.DataFrame) -> None:
-        self._non_touchpoints = ["_uid", "is_converted"]
+        self._non_touchpoints = ["_uid", "is_converted", *self._path_columns.values()]
         utm_source_columns = list(data.filter(regex="utm_source_"))
         utm_campaign_columns = list(data.filter(regex="utm_campaign_"))
         self._non_touchpoints.extend(utm_campaign_columns)
         self._touchpoints = utm_source_columns
 
+    def _get_data(self):
+        # reads only the needed columns of lytics data with the dtype plan, and of id and conversion data
+        lytics_data = self._get_columns(
+            "lytics", self._lytics_columns, self._lytics_dtypes
+        )
+        return (lytics_data, *self._get_id_and_conversion_data())
+
+    def _get_id_and_conversion_data(self) -> tuple:
+        id_data = self._get_columns(
+            "id",
+            ["_uid", "individual_id"],
+            {"_uid": "string[pyarrow]", "individual_id": float},
+        )
+        conversion_data = self._get_columns(
+            "conversion", ["Individual_id"], {"Individual_id": float}
+        )
+        return id_data, conversion_data
+
     def _pick_columns(
         self,
         data: pd.DataFrame,
     ) -> pd.DataFrame:
-        columns_to_keep = [
-            "_uid",
-            "ea_utm_source_0",
-            "ea_utm_source_1",
-            "ea_utm_source_2",
-            "ea_utm_source_3",
-            "ea_utm_source_4",
-            "ea_utm_campaign_0",
-            "ea_utm_campaign_1",
-            "ea_utm_campaign_2",
-            "ea_utm_campaign_3",
-            "ea_utm_campaign_4",
-            "et_utm_source_0",
-            "et_utm_source_1",
-            "et_utm_source_2",
-            "et_utm_source_3",
-            "et_utm_source_4",
-            "et_utm_campaign_0",
-            "et_utm_campaign_1",
-            "et_utm_campaign_2",
-            "et_utm_campaign_3",
-            "et_utm_campaign_4",
-            "utm_source_0",
-            "utm_source_1",
-            "utm_source_2",
-            "utm_source_3",
-            "utm_source_4",
-            "utm_campaign_0",
-            "utm_campaign_1",
-            "utm_campaign_2",
-            "utm_campaign_3",
-            "utm_campaign_4",
-        ]
-        return data[columns_to_keep]
+        return data[self._lytics_columns].astype(self._lytics_dtypes)
+
+    def _build_ordered_paths(
+        self, data: pd.DataFrame, campaign_level: bool = False
+    ) -> pd.DataFrame:
+        """
+        builds the ordered paths of the users, joined as e.g. "google>email>facebook", where position k is the k-th
+        source touchpoint (position 0 the earliest) of the first of {ea,et,legacy} that tracked one at position k;
+        the utm_source indicator columns count the touchpoints of every tracker instead, so that for users seen by
+        more than one tracker, path-based models like Markov_Attribution and Shapley_Attribution may attribute over
+        different channels
+        """
+        touchpoint_levels = list(self._path_columns) if campaign_level else ["source"]
+        paths = {
+            touchpoint_level: pd.Series("", index=data.index)
+            for touchpoint_level in touchpoint_levels
+        }
+        for position in range(5):
+            # the categoricals of each tracker have categories of their own, so their values are combined as strings
+            values = {
+                f"{tracker}utm_{family}": data[
+                    f"{tracker}utm_{family}_{position}"
+                ].astype(object)
+                for tracker in ["ea_", "et_", ""]
+                for family in ["source", "campaign"]
+            }
+            trackers = [
+                values[f"{tracker}utm_source"].notna() for tracker in ["ea_", "et_"]
+            ]
+            source = (
+                values["ea_utm_source"]
+                .fillna(values["et_utm_source"])
+                .fillna(values["utm_source"])
+            )
+            # same as the email-adobe fix below, adobe and email are one and the same
+            source = source.replace("adobe", "email")
+            tokens = {"source": source}
+            if campaign_level:
+                # the campaign of the touchpoint is tracked by the same one of {ea,et,legacy} as its source
+                campaign = values["ea_utm_campaign"].where(
+                    trackers[0],
+                    values["et_utm_campaign"].where(
+                        trackers[1], values["utm_campaign"]
+                    ),
+                )
+                tokens["campaign"] = campaign.where(source.notna())
+                tokens["source_campaign"] = (
+                    source.astype(str) + "/" + campaign.fillna("(not set)").astype(str)
+                ).where(source.notna())
+            for touchpoint_level, token in tokens.items():
+                paths[touchpoint_level] += (token.astype(str) + ">").where(
+                    token.notna(), ""
+                )
+        return data.assign(
+            **{
+                self._path_columns[touchpoint_level]: path.str[:-1].astype("category")
+                for touchpoint_level, path in paths.items()
+            }
+        )
 
     def _unify_column_names(self, data: pd.DataFrame) -> pd.DataFrame:
         for substring in ["ea_", "et_", "_1", "_2", "_0", "_3", "_4"]:
             data.columns = data.columns.str.replace(substring, "")
         return data
 
-    def _column_split(
-        self, data: pd.DataFrame, non_categorical_columns: list
-    ) -> Tuple[list, list]:
-        categorical_columns = data.columns.tolist()
-        for column in non_categorical_columns:
-            categorical_columns.remove(column)
-        return categorical_columns
-
     def _generate_touchpoint_indicator_columns(
-        self, data: pd.DataFrame
+        self, data: pd.DataFrame, encoder: TouchpointEncoder = None
     ) -> pd.DataFrame:
-        categorical_columns = self._column_split(data, non_categorical_columns=["_uid"])
-        data = pd.get_dummies(data, columns=categorical_columns)
-        data = data.groupby(level=0, axis=1).sum()
-        categorical_columns = self._column_split(data, non_categorical_columns=["_uid"])
-        # HB (Alex, what did the hardcoded 15 here correspond to again? Was it the 3 different {ea,et,legacy} multiplied by the 5 touchpoints each?)
-        data[categorical_columns] /= 15
-        data[categorical_columns] = data[categorical_columns].astype(int)
-        return data
+        # count the occurrences of every source/campaign value across the 15 {ea,et,legacy} x {0..4} columns
+        if encoder is None:
+            encoder = TouchpointEncoder().fit(data)
+        # hundreds of campaigns would make dense indicator columns dominate memory
+        return pd.concat(
+            [
+                data[["_uid", *data.columns.intersection(self._path_columns.values())]],
+                encoder.transform(data, sparse_families=["utm_campaign"]),
+            ],
+            axis=1,
+        )
 
     def _extract_converted_individual_ids(
         self, id_data: pd.DataFrame, conversion_data: pd.DataFrame
-    ) -> pd.DataFrame:
-        # build map between _uid and individual_id of the form (_uid, individual_id)
-        id_data["individual_id"] = id_data["individual_id"].fillna(0).astype(int)
-        # build map between conversions and individual_id of the form (individual_id, single_conversion_event)
-        conversion_data = conversion_data.rename(
-            columns={"Individual_id": "individual_id"}
-        )
-        conversion_data = conversion_data.groupby("individual_id", as_index=False).agg(
-            {"SourceCode": "first"}
-        )
-        # build converted individuals of the form (_uid, is_converted) from an inner join
-        converted_individuals = pd.merge(
-            id_data, conversion_data, on="individual_id", how="inner"
+    ) -> pa.Array:
+        """
+        semi-joins id data with conversion data through the vectorized membership of every integer individual_id
+        in those of conversions, instead of merging the two tables
+        :returns: the distinct _uids with at least one conversion, as an arrow array to look _uids up in
+        """
+        # individual_ids missing from id data are 0, those missing from conversion data match no one
+        is_converted = np.isin(
+            id_data["individual_id"].fillna(0).to_numpy(dtype=np.int64),
+            conversion_data["Individual_id"].dropna().to_numpy(dtype=np.int64),
         )
-        converted_individuals["is_converted"] = 1
-        return converted_individuals[["_uid", "is_converted"]]
+        uids = pa.array(id_data["_uid"], type=pa.string())
+        return pc.unique(uids.filter(pa.array(is_converted)))
 
     def _merge_in_converted_individual_ids(
-        self, data: pd.DataFrame, converted_individuals: pd.DataFrame
+        self, data: pd.DataFrame, converted_individuals: pa.Array
     ) -> pd.DataFrame:
-        data = pd.merge(data, converted_individuals, on="_uid", how="left")
-        data["is_converted"] = data["is_converted"].fillna(0).astype(int)
+        # hashed membership of every _uid in the converted _uids, on arrow strings instead of Python objects
+        data["is_converted"] = (
+            pc.is_in(pa.array(data["_uid"], type=pa.string()), converted_individuals)
+            .to_pandas()
+            .to_numpy(dtype=bool)
+        )
         return data
 
     def _email_adobe_fix(self, data: pd.DataFrame) -> pd.DataFrame:
@@ -131,50 +230,575 @@ class ToursPreprocessor(Preprocessor):
         return data
 
     def _build_journey_vector(self, data: pd.DataFrame) -> pd.DataFrame:
-        data["jvector"] = data.drop(columns=self._non_touchpoints).apply(tuple, axis=1)
+        """
+        packs the clipped touchpoint columns into a uint64 "journey" bitmask with a single matrix-dot, where
+        bit i is set iff the user has touchpoint self._touchpoints[i], see self._journey_channels
+        """
+        if len(self._touchpoints) > 64:
+            raise RuntimeError("a journey bitmask holds at most 64 touchpoints.")
+        self._journey_channels = dict(enumerate(self._touchpoints))
+        bits = np.left_shift(
+            np.uint64(1), np.arange(len(self._touchpoints), dtype=np.uint64)
+        )
+        data["journey"] = data[self._touchpoints].to_numpy(dtype=np.uint64) @ bits
         return data
 
-    def etl(self) -> None:
+    def _read_converted_individual_ids(self) -> pa.Array:
+        return self._extract_converted_individual_ids(
+            *self._get_id_and_conversion_data()
+        )
+
+    def _get_lytics_chunks(self, chunksize: int) -> Iterator[pd.DataFrame]:
+        return self._get_columns(
+            "lytics",
+            self._lytics_columns,
+            self._lytics_dtypes,
+            chunksize,
+        )
+
+    def _fit_touchpoint_encoder(self, chunksize: int) -> TouchpointEncoder:
+        # shared vocabulary of touchpoint values, so that every chunk yields the same indicator columns
+        encoder = TouchpointEncoder()
+        for chunk in self._get_lytics_chunks(chunksize):
+            encoder.fit(self._unify_column_names(self._pick_columns(chunk)))
+        return encoder
+
+    def _etl_chunk(
+        self,
+        chunk: pd.DataFrame,
+        converted_individuals: pa.Array,
+        encoder: TouchpointEncoder,
+        campaign_level: bool = False,
+    ) -> pd.DataFrame:
+        data = self._pick_columns(chunk)
+        data = self._build_ordered_paths(data, campaign_level)
+        data = self._unify_column_names(data)
+        data = self._generate_touchpoint_indicator_columns(data, encoder)
+        data = self._merge_in_converted_individual_ids(data, converted_individuals)
+        data = self._email_adobe_fix(data)
+        self._pick_touchpoints(data)
+        data = self._remove_touchpoint_repetition(data)
+        return self._build_journey_vector(data)
+
+    def _etl_chunk_size(
+        self,
+        sample: pd.DataFrame,
+        converted_individuals: pa.Array,
+        encoder: TouchpointEncoder,
+        memory_budget_mb: float,
+        campaign_level: bool,
+    ) -> int:
+        # measure the peak allocations of preprocessing a sample, intermediate frames included
+        tracemalloc.start()
+        try:
+            self._etl_chunk(
+                sample.copy(), converted_individuals, encoder, campaign_level
+            )
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return max(int(memory_budget_mb * 2**20 * len(sample) / peak_bytes), 1)
+
+    def _preprocessed_chunks(
+        self,
+        chunksize: int,
+        converted_individuals: pa.Array,
+        encoder: TouchpointEncoder,
+        campaign_level: bool,
+        memory_report: bool,
+    ) -> Iterator[pd.DataFrame]:
+        self._journey_aggregates = []
+        self._path_aggregates = []
+        for i, chunk in enumerate(self._get_lytics_chunks(chunksize)):
+            self._logger.info(f"Preprocessing chunk {i} of {len(chunk)} rows")
+            data = self._etl_chunk(
+                chunk, converted_individuals, encoder, campaign_level
+            )
+            if i == 0 and memory_report:
+                self._memory_report(data)
+            self._journey_aggregates.append(self._aggregate_journeys(data))
+            self._path_aggregates.append(self._aggregate_paths(data, campaign_level))
+            yield data
+
+    def _read_sample(self) -> pd.DataFrame:
+        return next(iter(self._get_lytics_chunks(self._sample_rows)))
+
+    def _drain_chunks(self, preprocessed_chunks: Iterator[pd.DataFrame]) -> None:
+        # only the journey counts collected along the way are kept
+        for _ in preprocessed_chunks:
+            pass
+
+    def _streaming_etl(
+        self,
+        memory_budget_mb: float,
+        snapshot: bool,
+        user_level: bool,
+        persist: bool,
+        campaign_level: bool,
+        memory_report: bool,
+        instrumentation: Instrumentation,
+    ) -> tuple:
         """
-        Performs preprocessing and saves to local
+        Performs preprocessing chunk by chunk, keeping only the journey and path counts of each chunk (and saving
+        the chunk to local as soon as it is done if user_level), reading only the needed columns with explicit
+        dtypes, so that peak memory is set by memory_budget_mb
+        :returns: (the aggregated journeys, {touchpoint level: path counts})
         """
-        self._logger.info(f"Getting lytics, id, and conversion data")
-        lytics_data, id_data, conversion_data = self._get_data()
+        stage = instrumentation.run
+        converted_individuals = stage(
+            "Extracting converted individuals from a semi-join of id and conversion data",
+            self._read_converted_individual_ids,
+        )
 
-        self._logger.info(f"Picking columns from lytics data")
-        data = self._pick_columns(lytics_data)
+        sample = stage(
+            f"Sizing chunks to a memory budget of {memory_budget_mb}MB",
+            self._read_sample,
+        )
+        raw_bytes_per_row = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+        vocabulary_chunksize = max(
+            int(memory_budget_mb * 2**20 / raw_bytes_per_row), 1
+        )
+
+        encoder = stage(
+            "Fitting the touchpoint vocabulary across all chunks",
+            self._fit_touchpoint_encoder,
+            vocabulary_chunksize,
+        )
 
+        chunksize = stage(
+            "Profiling the preprocessing of a sample",
+            self._etl_chunk_size,
+            sample,
+            converted_individuals,
+            encoder,
+            memory_budget_mb,
+            campaign_level,
+        )
+        preprocessed_chunks = self._preprocessed_chunks(
+            chunksize, converted_individuals, encoder, campaign_level, memory_report
+        )
+        stage(
+            f"Preprocessing lytics data in chunks of {chunksize} rows",
+            self._save_chunks_to_local
+            if user_level and persist
+            else self._drain_chunks,
+            preprocessed_chunks,
+        )
+        journey_aggregate = stage(
+            "Aggregating users and conversions of each journey across chunks",
+            self._aggregate_journeys,
+            pd.concat(self._journey_aggregates, ignore_index=True),
+        )
         self._logger.info(
-            "Unifying column names across EA, ET, Legacy and 0-4 touchpoints"
+            f"There are {journey_aggregate['journey'].nunique()} unique user journeys in this dataset"
         )
-        data = self._unify_column_names(data)
 
-        self._logger.info("Generating touchpoint indicator columns")
-        data = self._generate_touchpoint_indicator_columns(data)
+        path_aggregates = stage(
+            "Aggregating users and conversions of each path across chunks",
+            self._merge_paths,
+            self._path_aggregates,
+        )
 
+        if persist:
+            stage(
+                "Saving aggregated journeys",
+                self._save_journeys_to_local,
+                journey_aggregate,
+            )
+            stage("Saving path counts", self._save_paths_to_local, path_aggregates)
+        if snapshot:
+            stage(
+                "Saving journey-count snapshot",
+                self._save_snapshot,
+                journey_aggregate,
+                path_aggregates,
+                user_level,
+            )
+        return journey_aggregate, path_aggregates
+
+    def _etl_output(
+        self, journey_aggregate: pd.DataFrame, path_aggregates: dict, path_level: str
+    ) -> pd.DataFrame:
+        if path_level is None:
+            return journey_aggregate
+        if path_level not in path_aggregates:
+            raise RuntimeError(
+                f"path_level must be one of {set(path_aggregates)}, campaign levels require campaign_level."
+            )
+        return path_aggregates[path_level]
+
+    def etl(
+        self,
+        streaming: bool = False,
+        memory_budget_mb: float = 1024,
+        snapshot: bool = False,
+        user_level: bool = False,
+        profile_stage: str = None,
+        persist: bool = True,
+        campaign_level: bool = False,
+        enforce_memory_budget: bool = False,
+        memory_report: bool = False,
+        path_level: str = None,
+    ) -> pd.DataFrame:
+        """
+        Performs preprocessing and saves the aggregated journeys and the source-level path counts to local, along
+        with the metrics of every stage
+        :param streaming: whether to preprocess lytics data chunk by chunk within memory_budget_mb
+        :param memory_budget_mb: memory budget of the streaming mode, in megabytes
+        :param snapshot: whether to also save the snapshot of this spark date, with the path counts (and
+        user-level data) user_level and campaign_level ask for
+        :param user_level: whether to also save the user-level preprocessed data
+        :param profile_stage: stage to profile with cProfile, e.g., "generate_touchpoint_indicator_columns"
+        :param persist: whether to save the aggregated journeys (and user-level data) to local, e.g., not when
+        they are handed straight to training
+        :param campaign_level: whether to also save the users and conversions of every ordered path of campaign
+        and source/campaign touchpoints, as journeys_campaign and journeys_source_campaign, next to those of the
+        source touchpoints in journeys_source
+        :param enforce_memory_budget: whether to fail as soon as the output of a stage, e.g., the user-level data,
+        takes more than memory_budget_mb in memory
+        :param memory_report: whether to record the in-memory size of every stage output, and to report the
+        memory of the user-level data (of the first chunk if streaming) per column
+        :param path_level: touchpoint level whose path counts are returned instead of the aggregated journeys,
+        e.g., "source" for path-based models like Markov_Attribution
+        :returns: the aggregated journeys, or the path counts of path_level
+        """
+        instrumentation = Instrumentation(
+            "etl",
+            self._logger,
+            profile_stage,
+            track_memory=memory_report,
+            memory_budget_mb=memory_budget_mb if enforce_memory_budget else None,
+        )
+        if snapshot and user_level and not persist:
+            raise RuntimeError("user-level snapshots require persist.")
+        if streaming:
+            journey_aggregate, path_aggregates = self._streaming_etl(
+                memory_budget_mb,
+                snapshot,
+                user_level,
+                persist,
+                campaign_level,
+                memory_report,
+                instrumentation,
+            )
+            self._save_metrics(instrumentation)
+            return self._etl_output(journey_aggregate, path_aggregates, path_level)
+
+        stage = instrumentation.run
+        lytics_data, id_data, conversion_data = stage(
+            "Getting lytics, id, and conversion data", self._get_data
+        )
+
+        data = stage(
+            "Picking columns from lytics data", self._pick_columns, lytics_data
+        )
+
+        data = stage(
+            "Building ordered touchpoint paths from positional columns",
+            self._build_ordered_paths,
+            data,
+            campaign_level,
+        )
+
+        data = stage(
+            "Unifying column names across EA, ET, Legacy and 0-4 touchpoints",
+            self._unify_column_names,
+            data,
+        )
+
+        data = stage(
+            "Generating touchpoint indicator columns",
+            self._generate_touchpoint_indicator_columns,
+            data,
+        )
+
+        converted_individuals = stage(
+            "Extracting converted individuals from a semi-join of id and conversion data",
+            self._extract_converted_individual_ids,
+            id_data,
+            conversion_data,
+        )
+
+        data = stage(
+            "Merging in converted individuals to the data",
+            self._merge_in_converted_individual_ids,
+            data,
+            converted_individuals,
+        )
+
+        data = stage("Running Vivek's email-adobe fix", self._email_adobe_fix, data)
+
+        stage(f"Picking touchpoints from data", self._pick_touchpoints, data)
+
+        data = stage(
+            "Disregarding repeated occurences of the same touchpoint",
+            self._remove_touchpoint_repetition,
+            data,
+        )
+
+        data = stage("Building user journey bitmasks", self._build_journey_vector, data)
+        self._logger.info(f"Journey bits stand for {self._journey_channels}")
         self._logger.info(
-            "Extracting converted individuals from an inner join of id and conversion data"
+            f"There are {data['journey'].nunique()} unique user journeys in this dataset"
         )
-        converted_individuals = self._extract_converted_individual_ids(
-            id_data, conversion_data
+        if memory_report:
+            stage("Reporting the memory of user-level data", self._memory_report, data)
+
+        journey_aggregate = stage(
+            "Aggregating users and conversions of each journey",
+            self._aggregate_journeys,
+            data,
         )
+        path_aggregates = stage(
+            "Aggregating users and conversions of each path",
+            self._aggregate_paths,
+            data,
+            campaign_level,
+        )
+        if persist:
+            stage(
+                "Saving aggregated journeys",
+                self._save_journeys_to_local,
+                journey_aggregate,
+            )
+            stage("Saving path counts", self._save_paths_to_local, path_aggregates)
+            if user_level:
+                stage("Saving user-level preprocessed data", self._save_to_local, data)
+        if snapshot:
+            stage(
+                "Saving journey-count snapshot",
+                self._save_snapshot,
+                journey_aggregate,
+                path_aggregates,
+                user_level,
+            )
+        self._save_metrics(instrumentation)
+        return self._etl_output(journey_aggregate, path_aggregates, path_level)
 
-        self._logger.info("Merging in converted individuals to the data")
-        data = self._merge_in_converted_individual_ids(data, converted_individuals)
+    def _align_touchpoint_columns(self, data: pd.DataFrame) -> pd.DataFrame:
+        # touchpoints missing on some spark dates were not observed there
+        indicator_columns = sorted(data.filter(regex="^utm_").columns)
+        data[indicator_columns] = data[indicator_columns].fillna(0).astype(np.uint8)
+        if "path" in data.columns:
+            data["path"] = data["path"].fillna("")
+        other_columns = [
+            column
+            for column in data.columns
+            if column not in indicator_columns + ["_uid", "path", "journey"]
+        ]
+        return data[
+            [column for column in ["_uid", "path"] if column in data.columns]
+            + indicator_columns
+            + other_columns
+        ]
 
-        self._logger.info("Running Vivek's email-adobe fix")
-        data = self._email_adobe_fix(data)
+    def _aggregate_journeys(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        aggregates user-level (or already aggregated) data into the number of users and conversions of every
+        journey, along with the utm_source indicator columns each journey bitmask stands for, so that there are
+        at most 2^n rows whatever the number of users (the ordered paths are counted by _aggregate_paths)
+        """
+        if "n_users" not in data.columns:
+            data = data.assign(n_users=1, n_conversions=data["is_converted"])
+        journey_aggregate = data.groupby("journey", as_index=False)[
+            ["n_users", "n_conversions"]
+        ].sum()
+        memberships = (
+            journey_aggregate["journey"].to_numpy(dtype=np.uint64)[:, None]
+            >> np.arange(len(self._touchpoints), dtype=np.uint64)
+        ) & np.uint64(1)
+        return pd.concat(
+            [
+                journey_aggregate[["journey"]],
+                pd.DataFrame(memberships.astype(np.uint8), columns=self._touchpoints),
+                journey_aggregate[["n_users", "n_conversions"]],
+            ],
+            axis=1,
+        )
+
+    def _aggregate_paths(self, data: pd.DataFrame, campaign_level: bool) -> dict:
+        """
+        aggregates user-level data into the number of users and conversions of every ordered path of the source
+        touchpoints (and of each campaign touchpoint level if campaign_level, whose touchpoints are only ever
+        stored as paths instead of indicator columns)
+        :returns: {touchpoint level: frame with "path", "n_users" and "n_conversions" columns}
+        """
+        data = data.assign(n_users=1, n_conversions=data["is_converted"])
+        return {
+            touchpoint_level: data.groupby(
+                self._path_columns[touchpoint_level], as_index=False, observed=True
+            )[["n_users", "n_conversions"]]
+            .sum()
+            .rename(columns={self._path_columns[touchpoint_level]: "path"})
+            .astype({"path": object})
+            .sort_values("path", ignore_index=True)
+            for touchpoint_level in self._path_touchpoint_levels(campaign_level)
+        }
+
+    def _merge_paths(self, path_aggregates: list) -> dict:
+        # path_aggregates holds the output of _aggregate_paths for each chunk or spark date
+        return {
+            touchpoint_level: pd.concat(
+                [aggregates[touchpoint_level] for aggregates in path_aggregates],
+                ignore_index=True,
+            )
+            .groupby("path", as_index=False)[["n_users", "n_conversions"]]
+            .sum()
+            for touchpoint_level in path_aggregates[0]
+        }
+
+    def _save_paths_to_local(self, path_aggregates: dict) -> None:
+        for touchpoint_level, path_aggregate in path_aggregates.items():
+            self._save_journeys_to_local(path_aggregate, touchpoint_level)
+
+    def _merge_journeys(self, data: pd.DataFrame) -> pd.DataFrame:
+        self._logger.info("Aligning touchpoint indicator columns across spark dates")
+        data = self._align_touchpoint_columns(data)
 
         self._logger.info(f"Picking touchpoints from data")
         self._pick_touchpoints(data)
 
-        self._logger.info("Disregarding repeated occurences of the same touchpoint")
-        data = self._remove_touchpoint_repetition(data)
+        self._logger.info("Rebuilding journey bitmasks over the merged touchpoints")
+        data = self._build_journey_vector(data)
+        self._logger.info(f"Journey bits stand for {self._journey_channels}")
+
+        self._logger.info("Aggregating users and conversions of each journey")
+        data = self._aggregate_journeys(data)
+        self._logger.info(
+            f"There are {data['journey'].nunique()} unique user journeys in this dataset"
+        )
+        return data
+
+    def merge_snapshots(
+        self, spark_dates: list, user_level: bool = False, campaign_level: bool = False
+    ) -> pd.DataFrame:
+        """
+        Merges the snapshots of spark_dates into the same outputs as merge, without reading the preprocessed data
+        of every spark date
+        :returns: the aggregated journeys
+        """
+        self._logger.info(
+            f"Loading journey-count snapshots of {len(spark_dates)} spark dates"
+        )
+        return self._merge_tables(
+            spark_dates, self._load_snapshot, user_level, campaign_level
+        )
 
-        self._logger.info("Building user journey vectors")
+    def daily_snapshots(self, spark_dates: list) -> tuple:
+        """
+        Loads the journey-count snapshots of spark_dates, with journey bitmasks rebuilt over the touchpoints of
+        all of them and a "spark_date" column
+        :returns: (the users and conversions of every (spark_date, journey), those of every (spark_date, path))
+        """
+        self._logger.info(
+            f"Loading journey-count snapshots of {len(spark_dates)} spark dates"
+        )
+        data = pd.concat(
+            [
+                self._load_snapshot(spark_date).assign(spark_date=spark_date)
+                for spark_date in spark_dates
+            ],
+            ignore_index=True,
+        )
+
+        self._logger.info("Aligning touchpoint indicator columns across spark dates")
+        data = self._align_touchpoint_columns(data)
+
+        self._logger.info(f"Picking touchpoints from data")
+        self._pick_touchpoints(data)
+
+        self._logger.info("Rebuilding journey bitmasks over the merged touchpoints")
         data = self._build_journey_vector(data)
+        self._logger.info(f"Journey bits stand for {self._journey_channels}")
+        daily_paths = pd.concat(
+            [
+                self._load_snapshot(spark_date, "journeys_source").assign(
+                    spark_date=spark_date
+                )
+                for spark_date in spark_dates
+            ],
+            ignore_index=True,
+        )
+        return data, daily_paths
+
+    def merge(
+        self, spark_dates: list, user_level: bool = False, campaign_level: bool = False
+    ) -> pd.DataFrame:
+        """
+        Merges the aggregated journeys and source-level path counts (and the user-level data if user_level, the
+        campaign-level path counts if campaign_level) preprocessed for each of spark_dates and saves to local
+        :returns: the aggregated journeys
+        """
+        self._logger.info(
+            f"Loading aggregated journeys of {len(spark_dates)} spark dates"
+        )
+
+        def load(spark_date: str, data_fname: str) -> pd.DataFrame:
+            # paths are read as is, e.g., "" for no touchpoint
+            return self._load_preprocessed(
+                spark_date,
+                data_fname,
+                keep_default_na=not data_fname.startswith("journeys_"),
+            )
+
+        return self._merge_tables(spark_dates, load, user_level, campaign_level)
+
+    def _merge_tables(
+        self,
+        spark_dates: list,
+        load: Callable[[str, str], pd.DataFrame],
+        user_level: bool,
+        campaign_level: bool,
+    ) -> pd.DataFrame:
+        """
+        merges the tables that load(spark_date, data_fname) returns for each of spark_dates, e.g., their saved
+        outputs or their snapshots, and saves them to local
+        :returns: the aggregated journeys
+        """
+        data = pd.concat(
+            [load(spark_date, "journeys") for spark_date in spark_dates],
+            ignore_index=True,
+        )
+        journey_aggregate = self._merge_journeys(data)
+        self._save_journeys_to_local(journey_aggregate)
+        self._logger.info(f"Merging path counts of {len(spark_dates)} spark dates")
+        self._save_paths_to_local(
+            self._merge_paths(
+                [
+                    {
+                        touchpoint_level: load(
+                            spark_date, f"journeys_{touchpoint_level}"
+                        )
+                        for touchpoint_level in self._path_touchpoint_levels(
+                            campaign_level
+                        )
+                    }
+                    for spark_date in spark_dates
+                ]
+            )
+        )
+        if not user_level:
+            return journey_aggregate
+
         self._logger.info(
-            f"There are {len(data['jvector'].value_counts())} unique user journeys in this dataset"
+            f"Loading preprocessed data of {len(spark_dates)} spark dates"
         )
+        data = pd.concat(
+            [load(spark_date, "preprocessed") for spark_date in spark_dates],
+            ignore_index=True,
+        )
+
+        self._logger.info("Aligning touchpoint indicator columns across spark dates")
+        data = self._align_touchpoint_columns(data)
+
+        self._logger.info(f"Picking touchpoints from data")
+        self._pick_touchpoints(data)
+
+        self._logger.info(
+            "Rebuilding user journey bitmasks over the merged touchpoints"
+        )
+        data = self._build_journey_vector(data)
+        self._logger.info(f"Journey bits stand for {self._journey_channels}")
 
         self._save_to_local(data)
+        return journey_aggregate
@@ -26,8 +26,34 @@ well_known_paths = {
     "HADOOP_SECRETS_DIR": "/tmp/secrets/",
     "DATASETS_DIR": os.path.join(_ROOT, "datasets/"),
     "PREPROCESSED_DATA_DIR": os.path.join(_ROOT, "preprocessed_data/"),
+    "PREPROCESSED_CACHE_DIR": os.path.join(_ROOT, "preprocessed_data/cache/"),
     "MODEL_OUTPUT_DIR": os.path.join(_ROOT, "model_output/"),
+    "BENCHMARK_OUTPUT_DIR": os.path.join(_ROOT, "benchmark_output/"),
     "PARAMS_DIR": os.path.join(_ROOT, "next_gen_attribution/modeling/params/"),
+    "OBJECT_STORE_CACHE_DIR": os.path.join(_ROOT, "object_store_cache/"),
+}
+
+# object store read with --dataSource=s3: the locations mirroring DATASETS_DIR and PREPROCESSED_DATA_DIR, the
+# backend, one of {s3, local}, that reads them (from an optional S3 endpoint, e.g., a stub server, or from a local
+# directory whose subdirectories stand for buckets), and the size of the local disk cache of downloaded objects
+object_store_settings = {
+    "DATASETS_URL": os.environ.get(
+        "NGA_DATASETS_URL", "s3://next-gen-attribution/datasets/"
+    ),
+    "PREPROCESSED_DATA_URL": os.environ.get(
+        "NGA_PREPROCESSED_DATA_URL", "s3://next-gen-attribution/preprocessed_data/"
+    ),
+    "BACKEND": os.environ.get("NGA_OBJECT_STORE_BACKEND", "s3"),
+    "ENDPOINT_URL": os.environ.get("NGA_S3_ENDPOINT_URL"),
+    "LOCAL_ROOT_DIR": os.environ.get("NGA_OBJECT_STORE_ROOT_DIR"),
+    "CACHE_MAX_GB": float(os.environ.get("NGA_OBJECT_STORE_CACHE_MAX_GB", 50)),
+    # cached objects used more recently are never evicted, since other processes may still be reading them
+    "CACHE_MIN_AGE_SECONDS": float(
+        os.environ.get("NGA_OBJECT_STORE_CACHE_MIN_AGE_SECONDS", 3600)
+    ),
+    # bytes of every ranged read, and ranged reads in flight
+    "PART_MB": float(os.environ.get("NGA_OBJECT_STORE_PART_MB", 8)),
+    "N_WORKERS": int(os.environ.get("NGA_OBJECT_STORE_N_WORKERS", 16)),
 }
 
 
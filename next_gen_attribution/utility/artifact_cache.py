@@ -0,0 +1,125 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+from next_gen_attribution.utility import logger, well_known_paths
+
+log = logger.init("Artifact Cache")
+
+
+class ArtifactCache:
+    """
+    content-addressed cache of preprocessed artifacts, keyed by a hash of the input files, the preprocessor class
+    and its logic version, with least-recently-used eviction beyond max_entries or max_bytes
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        max_entries: int = 20,
+        max_bytes: float = 50 * 2**30,
+        content_hash: bool = False,
+    ) -> None:
+        self._cache_dir = cache_dir or well_known_paths["PREPROCESSED_CACHE_DIR"]
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        # hash input contents instead of their size and modification time (slower but robust to touched files)
+        self._content_hash = content_hash
+        if not os.path.exists(self._cache_dir):
+            os.makedirs(self._cache_dir, exist_ok=True)
+
+    def _fingerprint(self, fpath: str) -> str:
+        if not self._content_hash:
+            stat = os.stat(fpath)
+            return f"{os.path.abspath(fpath)}:{stat.st_size}:{stat.st_mtime_ns}"
+        digest = hashlib.sha256()
+        with open(fpath, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def key(self, input_fpaths: list, *versions: str) -> str:
+        """
+        :returns: the hex digest identifying the artifacts produced from input_fpaths by the given versions,
+        e.g., the preprocessor class, its logic version and output format
+        """
+        digest = hashlib.sha256()
+        for fingerprint in [self._fingerprint(fpath) for fpath in input_fpaths]:
+            digest.update(fingerprint.encode())
+        for version in versions:
+            digest.update(str(version).encode())
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key)
+
+    def _touch(self, key: str) -> None:
+        with open(os.path.join(self._entry_dir(key), ".last_used"), "w") as f:
+            f.write(str(time.time()))
+
+    def _link(self, src_fpath: str, dst_fpath: str) -> None:
+        # hard links cost no extra disk space, fall back to copies across file systems
+        if os.path.exists(dst_fpath):
+            os.remove(dst_fpath)
+        dst_dir = os.path.dirname(dst_fpath)
+        if dst_dir and not os.path.exists(dst_dir):
+            os.makedirs(dst_dir, exist_ok=True)
+        try:
+            os.link(src_fpath, dst_fpath)
+        except OSError:
+            shutil.copy2(src_fpath, dst_fpath)
+
+    def restore(self, key: str, artifacts: dict) -> bool:
+        """
+        links the cached artifacts of key to their destinations, given as {artifact name: destination path}
+        :returns: whether key was a cache hit
+        """
+        entry_dir = self._entry_dir(key)
+        if not all(os.path.exists(os.path.join(entry_dir, name)) for name in artifacts):
+            return False
+        log.info(f"Cache hit for {key}, linking cached artifacts...")
+        for name, dst_fpath in artifacts.items():
+            self._link(os.path.join(entry_dir, name), dst_fpath)
+        self._touch(key)
+        return True
+
+    def store(self, key: str, artifacts: dict) -> None:
+        """
+        adds artifacts, given as {artifact name: source path}, to the cache under key and evicts old entries
+        """
+        # stage the entry under a unique name and rename it, so that concurrent readers never see a partial entry
+        staging_dir = os.path.join(self._cache_dir, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(staging_dir)
+        for name, src_fpath in artifacts.items():
+            self._link(src_fpath, os.path.join(staging_dir, name))
+        if os.path.exists(self._entry_dir(key)):
+            shutil.rmtree(self._entry_dir(key))
+        os.replace(staging_dir, self._entry_dir(key))
+        self._touch(key)
+        log.info(f"Cached artifacts under {key}")
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        removes the least recently used entries until at most max_entries entries of at most max_bytes remain
+        """
+        entries = []
+        for key in os.listdir(self._cache_dir):
+            entry_dir = self._entry_dir(key)
+            last_used_fpath = os.path.join(entry_dir, ".last_used")
+            if key.startswith(".") or not os.path.exists(last_used_fpath):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, name))
+                for name in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(last_used_fpath), size, key))
+        entries.sort(reverse=True)
+        total_bytes = 0
+        for i, (_, size, key) in enumerate(entries):
+            total_bytes += size
+            if i >= self._max_entries or total_bytes > self._max_bytes:
+                log.info(f"Evicting cached artifacts of {key}")
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
@@ -0,0 +1,139 @@
+import cProfile
+import json
+import os
+import resource
+import time
+from datetime import datetime
+from logging import Logger
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def _shapes(obj) -> list:
+    """
+    :returns: [rows, columns] of every frame or 2-d array in obj (or in obj's items if it is a tuple or list)
+    """
+    if isinstance(obj, (tuple, list)):
+        return [shape for item in obj for shape in _shapes(item)]
+    if isinstance(obj, (pd.DataFrame, np.ndarray)) or sparse.issparse(obj):
+        return [list(obj.shape) + [1] * (2 - obj.ndim)] if obj.ndim <= 2 else []
+    if isinstance(obj, pd.Series):
+        return [[len(obj), 1]]
+    return []
+
+
+def _memory_mb(obj) -> float:
+    """
+    :returns: in-memory megabytes (strings included) of every frame or series in obj (or in obj's items if it is
+    a tuple or list)
+    """
+    if isinstance(obj, (tuple, list)):
+        return sum(_memory_mb(item) for item in obj)
+    if isinstance(obj, pd.DataFrame):
+        return obj.memory_usage(deep=True).sum() / 2**20
+    if isinstance(obj, pd.Series):
+        return obj.memory_usage(deep=True) / 2**20
+    return 0.0
+
+
+class Instrumentation:
+    """
+    records the wall time, CPU time, peak RSS delta and input/output shapes of the named stages of a run,
+    optionally the in-memory size of their outputs, and optionally profiles one of them with cProfile
+    """
+
+    def __init__(
+        self,
+        run_name: str,
+        logger: Logger,
+        profile_stage: str = None,
+        track_memory: bool = False,
+        memory_budget_mb: float = None,
+    ):
+        self._run_name = run_name
+        self._logger = logger
+        # stage to profile, named after the function it runs without leading underscores, e.g., "pick_columns"
+        self._profile_stage = profile_stage
+        self._profile = None
+        # whether to record the in-memory size of stage outputs, and the size none of them may exceed if any
+        self._track_memory = track_memory or memory_budget_mb is not None
+        self._memory_budget_mb = memory_budget_mb
+        self._stages = []
+        self._started_at = datetime.now()
+        self._start_wall_time = time.perf_counter()
+        self._start_cpu_time = time.process_time()
+
+    def run(self, description: str, function, *args):
+        """
+        logs description, then runs function(*args) as the stage named after function
+        :returns: what function returns
+        """
+        self._logger.info(description)
+        stage = function.__name__.lstrip("_")
+        profile = cProfile.Profile() if stage == self._profile_stage else None
+        start_peak_rss_mb = _peak_rss_mb()
+        start_wall_time, start_cpu_time = time.perf_counter(), time.process_time()
+        if profile:
+            result = profile.runcall(function, *args)
+            self._profile = profile
+        else:
+            result = function(*args)
+        metrics = {
+            "stage": stage,
+            "description": description,
+            "wall_time_s": time.perf_counter() - start_wall_time,
+            "cpu_time_s": time.process_time() - start_cpu_time,
+            # growth of the process' peak resident set size, 0 if the stage stayed below an earlier peak
+            "peak_rss_delta_mb": _peak_rss_mb() - start_peak_rss_mb,
+            "input_shapes": _shapes(args),
+            "output_shapes": _shapes(result),
+        }
+        self._stages.append(metrics)
+        if self._track_memory:
+            metrics["output_memory_mb"] = _memory_mb(result)
+            if (
+                self._memory_budget_mb is not None
+                and metrics["output_memory_mb"] > self._memory_budget_mb
+            ):
+                raise RuntimeError(
+                    f"The output of stage {stage} takes {metrics['output_memory_mb']:.2f}MB, over the memory budget of {self._memory_budget_mb}MB."
+                )
+        return result
+
+    def save(self, output_dir: str) -> str:
+        """
+        saves the stage metrics of the run, and the profile of the chosen stage if it ran, to output_dir
+        :returns: path of the metrics file
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        fname = f"{self._run_name}_{self._started_at.strftime('%Y%m%d_%H%M%S_%f')}"
+        metrics = {
+            "run": self._run_name,
+            "started_at": self._started_at.isoformat(timespec="seconds"),
+            "wall_time_s": time.perf_counter() - self._start_wall_time,
+            "cpu_time_s": time.process_time() - self._start_cpu_time,
+            "peak_rss_mb": _peak_rss_mb(),
+            "stages": self._stages,
+        }
+        if self._profile is not None:
+            profile_fpath = os.path.join(
+                output_dir, f"{fname}_{self._profile_stage}.prof"
+            )
+            self._profile.dump_stats(profile_fpath)
+            metrics["profile"] = profile_fpath
+            self._logger.info(
+                f"Saved cProfile stats of {self._profile_stage} to {profile_fpath}"
+            )
+        metrics_fpath = os.path.join(output_dir, f"{fname}.json")
+        with open(metrics_fpath, "w") as f:
+            json.dump(metrics, f, indent=2)
+        self._logger.info(f"Saved stage metrics to {metrics_fpath}")
+        return metrics_fpath
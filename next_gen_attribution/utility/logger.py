@@ -4,6 +4,9 @@ import logging
 def init(log_name, level=logging.INFO):
     logger = logging.getLogger(log_name)
     logger.setLevel(level)
+    # loggers are shared by name, so only the first init of a name adds a handler
+    if logger.handlers:
+        return logger
 
     # stream handler
     ch = logging.StreamHandler()
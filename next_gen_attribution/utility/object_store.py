@@ -0,0 +1,302 @@
+"""
+Reads objects of an object store, e.g., the input data and preprocessed artifacts of the --dataSource=s3 mode,
+through a size-bounded local disk cache keyed by their ETag, downloading every object in concurrent ranged reads;
+the store is a pluggable backend, e.g., S3, a stub S3 server or a local directory for tests
+"""
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from next_gen_attribution.utility import (
+    absolute_s3_path_to_relative,
+    logger,
+    object_store_settings,
+    well_known_paths,
+)
+
+log = logger.init("Object Store")
+
+
+class ObjectStore(ABC):
+    """abstract backend of an object store, whose objects are addressed by bucket and key"""
+
+    @abstractmethod
+    def head(self, bucket: str, key: str) -> tuple:
+        """
+        :returns: (size in bytes, ETag) of the object
+        """
+
+    @abstractmethod
+    def get_range(
+        self, bucket: str, key: str, etag: str, start: int, end: int
+    ) -> bytes:
+        """
+        :returns: bytes [start, end) of the object, failing if it no longer has the given ETag
+        """
+
+    @abstractmethod
+    def list_prefixes(self, bucket: str, prefix: str) -> list:
+        """
+        :returns: the names of the "directories" right under prefix, e.g., the spark dates under datasets/
+        """
+
+
+class LocalObjectStore(ObjectStore):
+    """object store whose buckets are the subdirectories of root_dir, e.g., a local copy of a bucket for tests"""
+
+    def __init__(self, root_dir: str) -> None:
+        self._root_dir = root_dir
+
+    def _fpath(self, bucket: str, key: str) -> str:
+        return os.path.join(self._root_dir, bucket, key)
+
+    def head(self, bucket: str, key: str) -> tuple:
+        stat = os.stat(self._fpath(bucket, key))
+        etag = hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        return stat.st_size, etag
+
+    def get_range(
+        self, bucket: str, key: str, etag: str, start: int, end: int
+    ) -> bytes:
+        if self.head(bucket, key)[1] != etag:
+            raise RuntimeError(f"{bucket}/{key} changed while being read.")
+        with open(self._fpath(bucket, key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def list_prefixes(self, bucket: str, prefix: str) -> list:
+        prefix_dir = self._fpath(bucket, prefix)
+        return sorted(
+            name
+            for name in os.listdir(prefix_dir)
+            if os.path.isdir(os.path.join(prefix_dir, name))
+        )
+
+
+class S3ObjectStore(ObjectStore):
+    """object store of S3, or of an S3-compatible server at endpoint_url, e.g., a stub server for tests"""
+
+    def __init__(self, endpoint_url: str = None) -> None:
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError(
+                "data_source s3 requires boto3, e.g., pip install boto3."
+            )
+        # boto3 clients are thread-safe, so that one client serves all ranged reads
+        self._client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def head(self, bucket: str, key: str) -> tuple:
+        response = self._client.head_object(Bucket=bucket, Key=key)
+        return response["ContentLength"], response["ETag"].strip('"')
+
+    def get_range(
+        self, bucket: str, key: str, etag: str, start: int, end: int
+    ) -> bytes:
+        response = self._client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}", IfMatch=etag
+        )
+        return response["Body"].read()
+
+    def list_prefixes(self, bucket: str, prefix: str) -> list:
+        names = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+            for common_prefix in page.get("CommonPrefixes", []):
+                names.append(common_prefix["Prefix"][len(prefix) :].rstrip("/"))
+        return sorted(names)
+
+
+class ObjectStoreReader:
+    """
+    downloads objects of an object store to a local disk cache, where each object is kept under its s3 path and
+    ETag until it is evicted, least recently used first, beyond max_bytes; objects used within the last
+    min_age_seconds are kept, so that the cache may exceed max_bytes while concurrent processes read them
+    """
+
+    def __init__(
+        self,
+        store: ObjectStore,
+        cache_dir: str = None,
+        max_bytes: float = 50 * 2**30,
+        part_bytes: int = 8 * 2**20,
+        n_workers: int = 16,
+        min_age_seconds: float = 3600,
+    ) -> None:
+        self._store = store
+        self._cache_dir = cache_dir or well_known_paths["OBJECT_STORE_CACHE_DIR"]
+        self._max_bytes = max_bytes
+        self._part_bytes = part_bytes
+        self._n_workers = n_workers
+        self._min_age_seconds = min_age_seconds
+        if not os.path.exists(self._cache_dir):
+            os.makedirs(self._cache_dir, exist_ok=True)
+
+    def _entry_dir(self, s3_path: str, etag: str) -> str:
+        return os.path.join(
+            self._cache_dir, hashlib.sha256(f"{s3_path}:{etag}".encode()).hexdigest()
+        )
+
+    def _touch(self, entry_dir: str) -> None:
+        with open(os.path.join(entry_dir, ".last_used"), "w") as f:
+            f.write(str(time.time()))
+
+    def _start_download(
+        self, executor: ThreadPoolExecutor, s3_path: str, size: int, etag: str
+    ) -> tuple:
+        """
+        submits the ranged reads of the object, each writing into a staging file of the object's size at its offset
+        :returns: (staging directory, file descriptor of the staging file, futures of the ranged reads)
+        """
+        location = absolute_s3_path_to_relative(s3_path)
+        bucket, key = location["bucket"], location["relative_path"]
+        staging_dir = os.path.join(self._cache_dir, f".{uuid.uuid4().hex}")
+        os.makedirs(staging_dir)
+        fd = os.open(
+            os.path.join(staging_dir, os.path.basename(key)), os.O_CREAT | os.O_WRONLY
+        )
+        os.ftruncate(fd, size)
+
+        def download_part(start: int) -> None:
+            end = min(start + self._part_bytes, size)
+            os.pwrite(fd, self._store.get_range(bucket, key, etag, start, end), start)
+
+        futures = [
+            executor.submit(download_part, start)
+            for start in range(0, size, self._part_bytes)
+        ]
+        return staging_dir, fd, futures
+
+    def head_all(self, s3_paths: list) -> dict:
+        """
+        looks the objects up concurrently, without downloading them
+        :returns: {s3 path: (size in bytes, ETag)}
+        """
+        locations = [absolute_s3_path_to_relative(s3_path) for s3_path in s3_paths]
+        with ThreadPoolExecutor(max_workers=self._n_workers) as executor:
+            heads = executor.map(
+                lambda location: self._store.head(
+                    location["bucket"], location["relative_path"]
+                ),
+                locations,
+            )
+            return dict(zip(s3_paths, heads))
+
+    def fetch_all(self, s3_paths: list) -> dict:
+        """
+        downloads the objects missing from the cache, with the ranged reads of all of them in flight at once
+        :returns: {s3 path: local path of the cached object}
+        """
+        heads = self.head_all(s3_paths)
+        local_fpaths, entry_dirs, downloads = {}, [], []
+        try:
+            with ThreadPoolExecutor(max_workers=self._n_workers) as executor:
+                for s3_path, (size, etag) in heads.items():
+                    location = absolute_s3_path_to_relative(s3_path)
+                    entry_dir = self._entry_dir(s3_path, etag)
+                    local_fpaths[s3_path] = os.path.join(
+                        entry_dir, os.path.basename(location["relative_path"])
+                    )
+                    entry_dirs.append(entry_dir)
+                    if os.path.exists(entry_dir):
+                        log.info(f"Cache hit for {s3_path}")
+                    else:
+                        log.info(f"Downloading {s3_path} ({size / 2**20:.1f}MB)...")
+                        downloads.append(
+                            (
+                                entry_dir,
+                                *self._start_download(executor, s3_path, size, etag),
+                            )
+                        )
+                for entry_dir, staging_dir, fd, futures in downloads:
+                    # raises the first failed ranged read
+                    for future in futures:
+                        future.result()
+                    # another process may have cached the same object in the meantime
+                    try:
+                        os.rename(staging_dir, entry_dir)
+                    except OSError:
+                        if not os.path.exists(entry_dir):
+                            raise
+        finally:
+            # every ranged read is done once the executor is shut down, and staging directories are left only
+            # by failed downloads
+            for _, staging_dir, fd, _ in downloads:
+                os.close(fd)
+                shutil.rmtree(staging_dir, ignore_errors=True)
+        for entry_dir in entry_dirs:
+            self._touch(entry_dir)
+        self.evict(keep=entry_dirs)
+        return local_fpaths
+
+    def fetch(self, s3_path: str) -> str:
+        """
+        :returns: the local path of the cached object, downloaded if missing from the cache
+        """
+        return self.fetch_all([s3_path])[s3_path]
+
+    def list_prefixes(self, s3_path: str) -> list:
+        """
+        :returns: the names of the "directories" right under s3_path, e.g., the spark dates of the datasets
+        """
+        location = absolute_s3_path_to_relative(s3_path)
+        prefix = location["relative_path"]
+        return self._store.list_prefixes(
+            location["bucket"], f"{prefix}/" if prefix else prefix
+        )
+
+    def evict(self, keep: list = ()) -> None:
+        """
+        removes the least recently used objects until at most max_bytes remain, except for the entries in keep
+        and those used within the last min_age_seconds
+        """
+        entries = []
+        for name in os.listdir(self._cache_dir):
+            entry_dir = os.path.join(self._cache_dir, name)
+            last_used_fpath = os.path.join(entry_dir, ".last_used")
+            if name.startswith(".") or not os.path.exists(last_used_fpath):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, fname))
+                for fname in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(last_used_fpath), size, entry_dir))
+        entries.sort(reverse=True)
+        min_last_used = time.time() - self._min_age_seconds
+        total_bytes = 0
+        for last_used, size, entry_dir in entries:
+            total_bytes += size
+            if (
+                total_bytes > self._max_bytes
+                and last_used < min_last_used
+                and entry_dir not in keep
+            ):
+                log.info(f"Evicting cached object {os.path.basename(entry_dir)}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def object_store_reader() -> ObjectStoreReader:
+    """
+    :returns: the reader of the object store of object_store_settings
+    """
+    if object_store_settings["BACKEND"] == "s3":
+        store = S3ObjectStore(object_store_settings["ENDPOINT_URL"])
+    elif object_store_settings["BACKEND"] == "local":
+        if not object_store_settings["LOCAL_ROOT_DIR"]:
+            raise RuntimeError(
+                "the local object store requires NGA_OBJECT_STORE_ROOT_DIR."
+            )
+        store = LocalObjectStore(object_store_settings["LOCAL_ROOT_DIR"])
+    else:
+        raise RuntimeError("the object store backend must be one of {'s3', 'local'}.")
+    return ObjectStoreReader(
+        store,
+        max_bytes=object_store_settings["CACHE_MAX_GB"] * 2**30,
+        part_bytes=int(object_store_settings["PART_MB"] * 2**20),
+        n_workers=object_store_settings["N_WORKERS"],
+        min_age_seconds=object_store_settings["CACHE_MIN_AGE_SECONDS"],
+    )
@@ -20,6 +20,8 @@ setup(
         "matplotlib==3.6.2",
         "pandas==1.5.1",
         "scikit-learn==1.1.3",
+        "pyarrow==10.0.1",
+        "scipy==1.9.3",
         "pytest==7.2.0",
         "pytest-runner==6.0.0",
         "pre-commit==2.20.0",
@@ -0,0 +1,33 @@
+import pytest
+
+from next_gen_attribution.benchmarking.synthetic_data import generate_tours_datasets
+from next_gen_attribution.utility import well_known_paths
+
+SPARK_DATES = ["20221101", "20221102", "20221103"]
+
+
+@pytest.fixture
+def local_dirs(tmp_path, monkeypatch):
+    """
+    points the datasets, preprocessed data, model output and cache directories to a temporary directory
+    """
+    for name in [
+        "DATASETS_DIR",
+        "PREPROCESSED_DATA_DIR",
+        "PREPROCESSED_CACHE_DIR",
+        "MODEL_OUTPUT_DIR",
+        "OBJECT_STORE_CACHE_DIR",
+    ]:
+        monkeypatch.setitem(well_known_paths, name, str(tmp_path / name.lower()))
+    return tmp_path
+
+
+@pytest.fixture
+def tours_datasets(local_dirs):
+    """
+    writes small synthetic Tours datasets for every spark date of SPARK_DATES
+    :returns: the spark dates
+    """
+    for seed, spark_date in enumerate(SPARK_DATES):
+        generate_tours_datasets(spark_date, n_users=1500, n_channels=6, seed=seed)
+    return SPARK_DATES
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from next_gen_attribution.modeling.markov_attribution import Markov_Attribution
+
+CHANNELS = ["email", "google", "facebook", "bing"]
+
+
+@pytest.fixture
+def path_counts():
+    """
+    random path counts of ordered paths of up to 4 touchpoints, along with users without any touchpoint
+    :returns: frame with "path", "n_users" and "n_conversions" columns, like journeys_source
+    """
+    rng = np.random.default_rng(0)
+    paths = {""}
+    while len(paths) < 40:
+        paths.add(">".join(rng.choice(CHANNELS, size=rng.integers(1, 5))))
+    n_users = rng.integers(1, 100, size=len(paths))
+    return pd.DataFrame(
+        {
+            "path": sorted(paths),
+            "n_users": n_users,
+            "n_conversions": rng.binomial(n_users, 0.3),
+        }
+    )
+
+
+def brute_force_removal_effects(path_counts):
+    # dense transition matrix over start, channels, conversion and null, built path by path
+    states = ["(start)", *CHANNELS, "(conversion)", "(null)"]
+    counts = np.zeros((len(states), len(states)))
+    for path, n_users, n_conversions in path_counts.itertuples(index=False):
+        if not path:
+            continue
+        touchpoints = [states.index(channel) for channel in path.split(">")]
+        for from_state, to_state in zip([0, *touchpoints], touchpoints):
+            counts[from_state, to_state] += n_users
+        counts[touchpoints[-1], -2] += n_conversions
+        counts[touchpoints[-1], -1] += n_users - n_conversions
+    transition_matrix = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+
+    def conversion_probability(transition_matrix):
+        # absorption probability into conversion from start, over the transient states
+        n_transient = len(CHANNELS) + 1
+        transient = transition_matrix[:n_transient, :n_transient]
+        return np.linalg.solve(
+            np.eye(n_transient) - transient, transition_matrix[:n_transient, -2]
+        )[0]
+
+    base = conversion_probability(transition_matrix)
+    removal_effects = {}
+    for j, channel in enumerate(CHANNELS, start=1):
+        # removing a channel sends every user reaching it to null
+        without = transition_matrix.copy()
+        without[j] = 0
+        without[j, -1] = 1
+        removal_effects[channel] = 1 - conversion_probability(without) / base
+    return pd.Series(removal_effects)
+
+
+def test_removal_effects_match_brute_force(local_dirs, path_counts):
+    results = Markov_Attribution(model_version="test").train(data=path_counts)
+    removal_effects = results.set_index("channel")["removal_effect"]
+    expected = brute_force_removal_effects(path_counts)
+    np.testing.assert_allclose(
+        removal_effects.loc[[f"utm_source_{channel}" for channel in expected.index]],
+        expected.to_numpy(),
+    )
+    # the conversions of users without any touchpoint are not attributed
+    np.testing.assert_allclose(
+        results["attributed_conversions"].sum(),
+        path_counts.loc[path_counts["path"] != "", "n_conversions"].sum(),
+    )
+
+
+def test_path_counts_match_user_level_data(local_dirs, path_counts):
+    # user-level data with the same paths give the same results as their counts
+    users = path_counts.loc[path_counts.index.repeat(path_counts["n_users"])]
+    users = users.assign(
+        is_converted=(
+            users.groupby(level=0).cumcount() < users["n_conversions"]
+        ).astype(int)
+    )[["path", "is_converted"]]
+    pd.testing.assert_frame_equal(
+        Markov_Attribution(model_version="users").train(data=users),
+        Markov_Attribution(model_version="paths").train(data=path_counts),
+    )
+
+
+def test_zero_conversions_give_zero_credit(local_dirs, path_counts, caplog):
+    results = Markov_Attribution(model_version="test").train(
+        data=path_counts.assign(n_conversions=0)
+    )
+    assert len(results) == len(CHANNELS)
+    assert (results["removal_effect"] == 0).all()
+    assert (results["attributed_conversions"] == 0).all()
+    assert "no conversions" in caplog.text
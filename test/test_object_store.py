@@ -0,0 +1,156 @@
+import hashlib
+import io
+import os
+import sys
+import types
+
+import pytest
+
+from next_gen_attribution.utility.object_store import (
+    LocalObjectStore,
+    ObjectStoreReader,
+    S3ObjectStore,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    """
+    local object store with a 3000-byte object under bucket/datasets/<spark_date>/ for three spark dates
+    """
+    for i, spark_date in enumerate(["20221101", "20221102", "20221103"]):
+        dataset_dir = tmp_path / "store" / "bucket" / "datasets" / spark_date
+        dataset_dir.mkdir(parents=True)
+        (dataset_dir / "conversion.csv").write_bytes(
+            bytes(range(250)) * 12 + bytes([i])
+        )
+    return LocalObjectStore(str(tmp_path / "store"))
+
+
+def test_round_trip_in_ranged_reads(store, tmp_path):
+    reader = ObjectStoreReader(store, str(tmp_path / "cache"), part_bytes=512)
+    s3_path = "s3://bucket/datasets/20221101/conversion.csv"
+    local_fpath = reader.fetch(s3_path)
+    with open(local_fpath, "rb") as f:
+        assert f.read() == bytes(range(250)) * 12 + bytes([0])
+    assert os.path.basename(local_fpath) == "conversion.csv"
+    assert reader.list_prefixes("s3://bucket/datasets") == [
+        "20221101",
+        "20221102",
+        "20221103",
+    ]
+
+
+def test_cache_hit_and_changed_object(store, tmp_path, monkeypatch):
+    reader = ObjectStoreReader(store, str(tmp_path / "cache"), part_bytes=512)
+    s3_path = "s3://bucket/datasets/20221101/conversion.csv"
+    local_fpath = reader.fetch(s3_path)
+
+    def get_range(*args):
+        raise AssertionError("a cache hit must not download again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(store, "get_range", get_range)
+        assert reader.fetch(s3_path) == local_fpath
+
+    # a changed object has another ETag, hence another cache entry
+    object_fpath = (
+        tmp_path / "store" / "bucket" / "datasets" / "20221101" / "conversion.csv"
+    )
+    object_fpath.write_bytes(b"changed")
+    os.utime(object_fpath, ns=(0, 0))
+    changed_fpath = reader.fetch(s3_path)
+    assert changed_fpath != local_fpath
+    with open(changed_fpath, "rb") as f:
+        assert f.read() == b"changed"
+
+
+def test_eviction_least_recently_used_first(store, tmp_path):
+    s3_paths = [
+        f"s3://bucket/datasets/{spark_date}/conversion.csv"
+        for spark_date in ["20221101", "20221102", "20221103"]
+    ]
+    # room for two objects, every object past the grace period may be evicted
+    reader = ObjectStoreReader(
+        store, str(tmp_path / "cache"), max_bytes=7000, min_age_seconds=0
+    )
+    local_fpaths = [reader.fetch(s3_path) for s3_path in s3_paths[:2]]
+    # the first object is used again, so that the second one is the least recently used
+    reader.fetch(s3_paths[0])
+    os.utime(os.path.join(os.path.dirname(local_fpaths[1]), ".last_used"), (0, 0))
+    reader.fetch(s3_paths[2])
+    assert os.path.exists(local_fpaths[0])
+    assert not os.path.exists(local_fpaths[1])
+
+    # objects used within the grace period are kept beyond max_bytes
+    reader = ObjectStoreReader(
+        store, str(tmp_path / "cache"), max_bytes=0, min_age_seconds=3600
+    )
+    reader.evict()
+    assert os.path.exists(local_fpaths[0])
+
+
+class FakeS3Client:
+    """
+    boto3 s3 client over a dict of objects, which checks the Range and IfMatch of every get_object and lists keys
+    in pages of one common prefix each
+    """
+
+    def __init__(self, objects: dict) -> None:
+        self.objects = objects
+        self.ranges = []
+
+    def _etag(self, body: bytes) -> str:
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def head_object(self, Bucket, Key):
+        body = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(body), "ETag": self._etag(body)}
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        body = self.objects[(Bucket, Key)]
+        assert self._etag(body).strip('"') == IfMatch
+        start, end = map(int, Range[len("bytes=") :].split("-"))
+        self.ranges.append((start, end))
+        return {"Body": io.BytesIO(body[start : end + 1])}
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_objects_v2"
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix, Delimiter):
+                prefixes = sorted(
+                    {
+                        Prefix + key[len(Prefix) :].split(Delimiter)[0] + Delimiter
+                        for bucket, key in client.objects
+                        if bucket == Bucket and key.startswith(Prefix)
+                    }
+                )
+                for prefix in prefixes:
+                    yield {"CommonPrefixes": [{"Prefix": prefix}]}
+
+        return Paginator()
+
+
+def test_s3_store_on_a_stubbed_client(tmp_path, monkeypatch):
+    body = bytes(range(250)) * 12
+    client = FakeS3Client(
+        {
+            ("bucket", f"datasets/{spark_date}/conversion.csv"): body
+            for spark_date in ["20221101", "20221102"]
+        }
+    )
+    boto3 = types.ModuleType("boto3")
+    boto3.client = lambda service_name, endpoint_url=None: client
+    monkeypatch.setitem(sys.modules, "boto3", boto3)
+
+    reader = ObjectStoreReader(S3ObjectStore(), str(tmp_path / "cache"), part_bytes=512)
+    local_fpath = reader.fetch("s3://bucket/datasets/20221101/conversion.csv")
+    with open(local_fpath, "rb") as f:
+        assert f.read() == body
+    # inclusive ranges of part_bytes each, the last one cut at the end of the object
+    assert sorted(client.ranges) == [
+        (start, min(start + 512, len(body)) - 1) for start in range(0, len(body), 512)
+    ]
+    assert reader.list_prefixes("s3://bucket/datasets") == ["20221101", "20221102"]
@@ -0,0 +1,115 @@
+import os
+
+import pandas as pd
+
+from next_gen_attribution.modeling.attribution_factory import AttributionFactory
+from next_gen_attribution.modeling.rolling_attribution import RollingAttribution
+from next_gen_attribution.preprocessing.tours_preprocessor import ToursPreprocessor
+from next_gen_attribution.utility import well_known_paths
+
+MODEL_TYPES = ["shapley", "markov"]
+
+
+def test_every_window_matches_a_fresh_train(tours_datasets):
+    date_range = f"{tours_datasets[0]}-{tours_datasets[-1]}"
+    for spark_date in tours_datasets:
+        ToursPreprocessor(spark_date=spark_date, data_tag="test").etl(snapshot=True)
+    daily_journeys, daily_paths = ToursPreprocessor(
+        spark_date=date_range, data_tag="test"
+    ).daily_snapshots(tours_datasets)
+
+    trends = RollingAttribution(
+        MODEL_TYPES, "tours", "dev", "local", "rolling", window_days=2, step_days=1
+    ).train(daily_journeys, daily_paths)
+
+    windows = list(zip(tours_datasets[:-1], tours_datasets[1:]))
+    assert (
+        list(
+            trends[["window_start", "window_end"]]
+            .drop_duplicates()
+            .itertuples(index=False, name=None)
+        )
+        == windows
+    )
+    for window_start, window_end in windows:
+        # a fresh train on the merged snapshots of the days of the window
+        window_name = f"{window_start}-{window_end}"
+        ToursPreprocessor(spark_date=window_name, data_tag="test").merge_snapshots(
+            [window_start, window_end]
+        )
+        for model_type in MODEL_TYPES:
+            expected = AttributionFactory(
+                model_type,
+                "tours",
+                "dev",
+                "local",
+                window_name,
+                {
+                    "spark_date": window_name,
+                    "data_tag": "test",
+                    "plot": "none",
+                    "scoring": {"enabled": False},
+                },
+            ).train()
+            # the trends hold the result columns of every model type
+            results = (
+                trends.loc[
+                    (trends["window_start"] == window_start)
+                    & (trends["model_type"] == model_type)
+                ]
+                .drop(columns=["window_start", "window_end", "model_type"])
+                .dropna(axis=1, how="all")
+            )
+            pd.testing.assert_frame_equal(
+                results.set_index("channel").sort_index(),
+                expected.set_index("channel").sort_index(),
+                check_exact=False,
+            )
+
+            # every window keeps its own outputs, without a credit table
+            window_dir = os.path.join(
+                well_known_paths["MODEL_OUTPUT_DIR"], "rolling", model_type, window_name
+            )
+            assert os.path.isdir(window_dir)
+            assert not os.path.exists(os.path.join(window_dir, "credit_table.parquet"))
+
+
+def test_windows_without_users_are_skipped(tours_datasets):
+    # the middle day of the range has no dataset
+    spark_dates = [tours_datasets[0], tours_datasets[2]]
+    for spark_date in spark_dates:
+        ToursPreprocessor(spark_date=spark_date, data_tag="test").etl(snapshot=True)
+    daily_journeys, daily_paths = ToursPreprocessor(
+        spark_date=f"{spark_dates[0]}-{spark_dates[1]}", data_tag="test"
+    ).daily_snapshots(spark_dates)
+
+    trends = RollingAttribution(
+        MODEL_TYPES, "tours", "dev", "local", "rolling", window_days=1, step_days=1
+    ).train(daily_journeys, daily_paths)
+    assert sorted(trends["window_start"].unique()) == spark_dates
+
+
+def test_windows_without_touchpoints_are_skipped(local_dirs):
+    # on 20221102 every user has an empty journey and path, 20221103 has no data at all
+    daily_journeys = pd.DataFrame(
+        {
+            "spark_date": ["20221101", "20221101", "20221102", "20221104"],
+            "journey": [1, 3, 0, 2],
+            "utm_source_email": [1, 1, 0, 0],
+            "utm_source_google": [0, 1, 0, 1],
+            "n_users": [10, 5, 7, 4],
+            "n_conversions": [3, 2, 1, 1],
+        }
+    )
+    daily_paths = pd.DataFrame(
+        {
+            "spark_date": ["20221101", "20221101", "20221102", "20221104"],
+            "path": ["email", "google>email", "", "google"],
+            "n_users": [10, 5, 7, 4],
+            "n_conversions": [3, 2, 1, 1],
+        }
+    )
+    trends = RollingAttribution(
+        MODEL_TYPES, "tours", "dev", "local", "rolling", window_days=1, step_days=1
+    ).train(daily_journeys, daily_paths)
+    assert sorted(trends["window_start"].unique()) == ["20221101", "20221104"]
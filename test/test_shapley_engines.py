@@ -0,0 +1,158 @@
+import os
+from itertools import permutations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from next_gen_attribution.modeling.attribution_factory import AttributionFactory
+from next_gen_attribution.modeling.shapley_engines import (
+    bitmask_coalition_values,
+    bitmask_shapley_values,
+    monte_carlo_shapley_values,
+    sparse_shapley_values,
+)
+from next_gen_attribution.preprocessing.tours_preprocessor import ToursPreprocessor
+from next_gen_attribution.utility import well_known_paths
+
+N = 5
+
+
+@pytest.fixture
+def game():
+    """
+    random game over N touchpoints in which v(S) is the number of conversions observed for exactly the coalition S
+    :returns: (journey bitmasks, conversions), with some journeys repeated and the empty journey included
+    """
+    rng = np.random.default_rng(0)
+    journeys = np.concatenate([[0], rng.integers(1, 1 << N, size=40)]).astype(np.uint64)
+    conversions = rng.integers(0, 50, size=len(journeys)).astype(np.float64)
+    return journeys, conversions
+
+
+def brute_force_shapley_values(journeys, conversions):
+    # average marginal contribution of each touchpoint over all N! orderings
+    values = bitmask_coalition_values(journeys, conversions, N)
+    shapley_values = np.zeros(N)
+    orderings = list(permutations(range(N)))
+    for ordering in orderings:
+        coalition = 0
+        for touchpoint in ordering:
+            shapley_values[touchpoint] += (
+                values[coalition | 1 << touchpoint] - values[coalition]
+            )
+            coalition |= 1 << touchpoint
+    return shapley_values / len(orderings)
+
+
+def coalition_csr(journeys, conversions):
+    # merges repeated journeys, then lists the members of each coalition in CSR form
+    unique_journeys, inverse = np.unique(journeys, return_inverse=True)
+    unique_conversions = np.bincount(inverse, weights=conversions)
+    members = (unique_journeys[:, None] >> np.arange(N, dtype=np.uint64)) & np.uint64(1)
+    rows, indices = np.nonzero(members)
+    indptr = np.searchsorted(rows, np.arange(len(unique_journeys) + 1))
+    return indptr, indices, unique_conversions
+
+
+def test_bitmask_matches_brute_force(game):
+    journeys, conversions = game
+    np.testing.assert_allclose(
+        bitmask_shapley_values(bitmask_coalition_values(journeys, conversions, N), N),
+        brute_force_shapley_values(journeys, conversions),
+    )
+
+
+def test_sparse_matches_brute_force(game):
+    journeys, conversions = game
+    np.testing.assert_allclose(
+        sparse_shapley_values(*coalition_csr(journeys, conversions), N),
+        brute_force_shapley_values(journeys, conversions),
+    )
+
+
+@pytest.mark.parametrize("stratified", [False, True])
+def test_monte_carlo_within_tolerance(game, stratified):
+    journeys, conversions = game
+    exact = sparse_shapley_values(*coalition_csr(journeys, conversions), N)
+    shapley_values, standard_errors, n_permutations = monte_carlo_shapley_values(
+        *coalition_csr(journeys, conversions),
+        N,
+        batch_size=500,
+        tolerance=0.5,
+        max_permutations=200000,
+        stratified=stratified,
+    )
+    assert standard_errors.max() <= 0.5
+    assert n_permutations < 200000
+    # well within 5 standard errors of the exact values
+    assert np.all(np.abs(shapley_values - exact) <= 5 * standard_errors + 1e-9)
+
+
+def test_monte_carlo_within_relative_tolerance(game):
+    journeys, conversions = game
+    shapley_values, standard_errors, _ = monte_carlo_shapley_values(
+        *coalition_csr(journeys, conversions),
+        N,
+        batch_size=500,
+        relative_tolerance=0.01,
+        max_permutations=1000000,
+    )
+    assert standard_errors.max() <= 0.01 * np.abs(shapley_values).max()
+
+
+def test_monte_carlo_does_not_depend_on_n_workers(game):
+    journeys, conversions = game
+    settings = dict(seed=3, batch_size=200, tolerance=0.5, max_permutations=20000)
+    estimates = [
+        monte_carlo_shapley_values(
+            *coalition_csr(journeys, conversions), N, n_workers=n_workers, **settings
+        )
+        for n_workers in [1, 3]
+    ]
+    np.testing.assert_array_equal(estimates[0][0], estimates[1][0])
+    np.testing.assert_array_equal(estimates[0][1], estimates[1][1])
+    assert estimates[0][2] == estimates[1][2]
+
+
+def test_exact_engines_agree_on_preprocessed_journeys(tours_datasets):
+    spark_date = tours_datasets[0]
+    ToursPreprocessor(spark_date=spark_date, data_tag="test").etl()
+    params = {
+        "spark_date": spark_date,
+        "data_tag": "test",
+        "plot": "none",
+        "scoring": {"enabled": False},
+    }
+    results = {
+        engine: AttributionFactory(
+            "shapley", "tours", "dev", "local", engine, params
+        ).train(engine=engine)
+        for engine in ["power_set", "bitmask", "sparse"]
+    }
+    for engine in ["bitmask", "sparse"]:
+        pd.testing.assert_series_equal(
+            results[engine].set_index("channel")["shapley_value"],
+            results["power_set"].set_index("channel")["shapley_value"],
+            check_exact=False,
+        )
+
+
+def test_background_plot_is_joined(tours_datasets):
+    spark_date = tours_datasets[0]
+    ToursPreprocessor(spark_date=spark_date, data_tag="test").etl()
+    attribution = AttributionFactory(
+        "shapley",
+        "tours",
+        "dev",
+        "local",
+        "plot",
+        {"spark_date": spark_date, "data_tag": "test", "scoring": {"enabled": False}},
+    ).attribution()
+    attribution.train(engine="bitmask", plot="background")
+    attribution.join_plots()
+    assert os.path.exists(
+        os.path.join(
+            well_known_paths["MODEL_OUTPUT_DIR"], "plot", "rescaled_shapley_values.png"
+        )
+    )
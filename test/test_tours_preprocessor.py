@@ -0,0 +1,179 @@
+import os
+
+import pytest
+
+from next_gen_attribution.preprocessing.preprocessor import _atomic_output
+from next_gen_attribution.preprocessing.preprocessor_factory import PreprocessorFactory
+from next_gen_attribution.preprocessing.tours_preprocessor import ToursPreprocessor
+from next_gen_attribution.utility import object_store_settings, well_known_paths
+from next_gen_attribution.utility.artifact_cache import ArtifactCache
+from next_gen_attribution.utility.object_store import ObjectStoreReader
+
+OUTPUT_FNAMES = [
+    "journeys.csv",
+    "journeys_source.csv",
+    "journeys_campaign.csv",
+    "journeys_source_campaign.csv",
+    "preprocessed.csv",
+]
+
+
+def read_outputs(spark_date: str, data_tag: str, fnames: list = OUTPUT_FNAMES) -> dict:
+    output_dir = os.path.join(
+        well_known_paths["PREPROCESSED_DATA_DIR"], spark_date, data_tag
+    )
+    outputs = {}
+    for fname in fnames:
+        with open(os.path.join(output_dir, fname), "rb") as f:
+            outputs[fname] = f.read()
+    return outputs
+
+
+def test_streaming_matches_in_memory(tours_datasets, monkeypatch):
+    spark_date = tours_datasets[0]
+    etl_kwargs = dict(user_level=True, campaign_level=True)
+    ToursPreprocessor(spark_date=spark_date, data_tag="in_memory").etl(**etl_kwargs)
+
+    # a tiny memory budget splits the lytics data into many chunks
+    etl_chunk = ToursPreprocessor._etl_chunk
+    n_chunks = []
+
+    def counting_etl_chunk(self, *args, **kwargs):
+        n_chunks.append(1)
+        return etl_chunk(self, *args, **kwargs)
+
+    monkeypatch.setattr(ToursPreprocessor, "_etl_chunk", counting_etl_chunk)
+    ToursPreprocessor(spark_date=spark_date, data_tag="streaming").etl(
+        streaming=True, memory_budget_mb=0.05, **etl_kwargs
+    )
+    assert len(n_chunks) > 2
+    assert read_outputs(spark_date, "streaming") == read_outputs(
+        spark_date, "in_memory"
+    )
+
+
+def test_journeys_are_aggregated_by_journey(tours_datasets):
+    preprocessor = ToursPreprocessor(spark_date=tours_datasets[0], data_tag="test")
+    journeys = preprocessor.etl()
+    paths = preprocessor.load_journeys("source")
+    assert journeys["journey"].is_unique
+    assert len(journeys) <= 2 ** len(journeys.filter(regex="^utm_source_").columns)
+    assert paths["path"].is_unique
+    assert journeys["n_users"].sum() == paths["n_users"].sum()
+    assert journeys["n_conversions"].sum() == paths["n_conversions"].sum()
+
+
+def test_cache_hit_relinks_the_same_outputs(tours_datasets, monkeypatch):
+    spark_date = tours_datasets[0]
+    factory = PreprocessorFactory("tours", "dev", "local", spark_date, "test")
+    cache = ArtifactCache()
+    etl_kwargs = dict(user_level=True, campaign_level=True, snapshot=True)
+    factory.etl(cache=cache, **etl_kwargs)
+    outputs = read_outputs(spark_date, "test")
+
+    preprocessor = ToursPreprocessor(spark_date=spark_date, data_tag="test")
+    for fname in OUTPUT_FNAMES:
+        os.remove(
+            os.path.join(
+                well_known_paths["PREPROCESSED_DATA_DIR"], spark_date, "test", fname
+            )
+        )
+    for data_fname in preprocessor._snapshot_tables(True, True):
+        os.remove(preprocessor._snapshot_fpath(spark_date, data_fname))
+    assert not preprocessor.has_snapshot(spark_date)
+
+    def etl(self, **kwargs):
+        raise AssertionError("a cache hit must not preprocess again")
+
+    monkeypatch.setattr(ToursPreprocessor, "etl", etl)
+    journeys = factory.etl(cache=cache, **etl_kwargs)
+    assert read_outputs(spark_date, "test") == outputs
+    assert preprocessor.has_snapshot(spark_date, True, True)
+    assert journeys["journey"].is_unique
+
+
+@pytest.mark.parametrize("data_format", ["csv", "parquet"])
+def test_incremental_matches_date_range(tours_datasets, data_format):
+    # merging the snapshots gives the same outputs as merging the preprocessed data of every date, in every mode
+    date_range = f"{tours_datasets[0]}-{tours_datasets[-1]}"
+    etl_kwargs = dict(user_level=True, campaign_level=True)
+    for spark_date in tours_datasets:
+        ToursPreprocessor(
+            spark_date=spark_date, data_tag="test", data_format=data_format
+        ).etl(snapshot=True, **etl_kwargs)
+    ToursPreprocessor(
+        spark_date=date_range, data_tag="test", data_format=data_format
+    ).merge(tours_datasets, **etl_kwargs)
+    ToursPreprocessor(
+        spark_date=date_range, data_tag="incremental", data_format=data_format
+    ).merge_snapshots(tours_datasets, **etl_kwargs)
+    fnames = [fname.replace(".csv", f".{data_format}") for fname in OUTPUT_FNAMES]
+    assert read_outputs(date_range, "incremental", fnames) == read_outputs(
+        date_range, "test", fnames
+    )
+
+
+def test_snapshots_follow_the_inputs_and_mode(tours_datasets):
+    spark_date = tours_datasets[0]
+    preprocessor = ToursPreprocessor(spark_date=spark_date, data_tag="test")
+    preprocessor.etl(snapshot=True)
+    assert preprocessor.has_snapshot(spark_date)
+    # the campaign-level path counts and user-level data are only snapshotted on request
+    assert not preprocessor.has_snapshot(spark_date, campaign_level=True)
+    assert not preprocessor.has_snapshot(spark_date, user_level=True)
+
+    # a changed input invalidates the snapshot, whose stale tables go once it is saved again
+    conversion_fpath = os.path.join(
+        well_known_paths["DATASETS_DIR"], spark_date, "conversion.csv"
+    )
+    stale_fpath = preprocessor._snapshot_fpath(spark_date)
+    os.utime(conversion_fpath, ns=(0, 0))
+    preprocessor = ToursPreprocessor(spark_date=spark_date, data_tag="test")
+    assert not preprocessor.has_snapshot(spark_date)
+    preprocessor.etl(snapshot=True, campaign_level=True)
+    assert preprocessor.has_snapshot(spark_date, campaign_level=True)
+    assert not os.path.exists(stale_fpath)
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path):
+    fpath = tmp_path / "journeys.csv"
+    fpath.write_text("previous")
+    with pytest.raises(ValueError):
+        with _atomic_output(str(fpath)) as tmp_fpath:
+            with open(tmp_fpath, "w") as f:
+                f.write("partial")
+            raise ValueError("write failed")
+    assert fpath.read_text() == "previous"
+    assert os.listdir(tmp_path) == ["journeys.csv"]
+
+
+def test_s3_cache_hit_downloads_nothing(tours_datasets, tmp_path, monkeypatch):
+    # a local object store whose bucket holds the datasets
+    (tmp_path / "store" / "bucket").mkdir(parents=True)
+    os.symlink(
+        well_known_paths["DATASETS_DIR"], tmp_path / "store" / "bucket" / "datasets"
+    )
+    monkeypatch.setitem(object_store_settings, "BACKEND", "local")
+    monkeypatch.setitem(
+        object_store_settings, "LOCAL_ROOT_DIR", str(tmp_path / "store")
+    )
+    monkeypatch.setitem(object_store_settings, "DATASETS_URL", "s3://bucket/datasets/")
+    spark_date = tours_datasets[0]
+    cache = ArtifactCache()
+    PreprocessorFactory("tours", "dev", "s3", spark_date, "first").etl(cache=cache)
+
+    def fetch_all(*args):
+        raise AssertionError("a cache hit must not download the inputs")
+
+    monkeypatch.setattr(ObjectStoreReader, "fetch_all", fetch_all)
+    # instantiating a preprocessor creates no directory, the cache hit creates the one it links to
+    output_dir = os.path.join(
+        well_known_paths["PREPROCESSED_DATA_DIR"], spark_date, "second"
+    )
+    ToursPreprocessor(spark_date=spark_date, data_tag="second", data_source="s3")
+    assert not os.path.exists(output_dir)
+    journeys = PreprocessorFactory("tours", "dev", "s3", spark_date, "second").etl(
+        cache=cache
+    )
+    assert os.path.exists(os.path.join(output_dir, "journeys.csv"))
+    assert journeys["journey"].is_unique
@@ -0,0 +1,106 @@
+# HB: local invocation
+# python benchmark.py --nUsers=1000,10000,100000 --nChannels=5,10,15
+"""
+Benchmark preprocessing and Shapley attribution training on synthetic datasets.
+"""
+
+import argparse
+
+from next_gen_attribution.benchmarking.benchmark import run_benchmarks
+from next_gen_attribution.utility import logger
+
+log = logger.init("benchmark")
+
+#############################################
+# benchmark
+#############################################
+def main(
+    n_users: str,
+    n_channels: str,
+    conversion_rate: float,
+    repeats: int,
+    engine: str,
+    seed: int,
+    output_fpath: str,
+    keep_data: bool,
+) -> None:
+    run_benchmarks(
+        [int(n) for n in n_users.split(",")],
+        [int(n) for n in n_channels.split(",")],
+        conversion_rate,
+        repeats,
+        engine,
+        seed,
+        output_fpath,
+        keep_data,
+    )
+    log.info(f"Successfully completed benchmarks!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark attribution preprocessing and training"
+    )
+    parser.add_argument(
+        "--nUsers",
+        action="store",
+        default="1000,10000,100000",
+        dest="n_users",
+        help="comma-separated grid of user counts",
+    )
+    parser.add_argument(
+        "--nChannels",
+        action="store",
+        default="5,10,15",
+        dest="n_channels",
+        help="comma-separated grid of channel counts",
+    )
+    parser.add_argument(
+        "--conversionRate",
+        action="store",
+        default=0.2,
+        type=float,
+        dest="conversion_rate",
+        help="expected share of users that convert",
+    )
+    parser.add_argument(
+        "--repeats",
+        action="store",
+        default=3,
+        type=int,
+        dest="repeats",
+        help="number of measurements of each grid point",
+    )
+    parser.add_argument(
+        "--engine",
+        action="store",
+        default="bitmask",
+        dest="engine",
+        choices=["power_set", "bitmask", "sparse", "monte_carlo"],
+        help="Shapley engine to benchmark",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        default=0,
+        type=int,
+        dest="seed",
+        help="seed of the synthetic data generator",
+    )
+    parser.add_argument(
+        "--outputFpath",
+        action="store",
+        default=None,
+        dest="output_fpath",
+        help="JSON file to write the results to, defaults to benchmark_output/benchmark_<timestamp>.json",
+    )
+    parser.add_argument(
+        "--keepData",
+        action="store_true",
+        dest="keep_data",
+        help="keep the synthetic datasets, preprocessed data and model outputs",
+    )
+
+    args = parser.parse_args()
+    print(vars(args))
+    main(**vars(args))
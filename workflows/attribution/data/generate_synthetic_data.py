@@ -0,0 +1,85 @@
+# HB: local invocation
+# python generate_synthetic_data.py --sparkDate=20221116 --nUsers=5000 --nChannels=8
+"""
+Create synthetic lytics, id and conversion datasets for use in preprocessing.
+"""
+
+import argparse
+
+from next_gen_attribution.benchmarking.synthetic_data import generate_tours_datasets
+from next_gen_attribution.utility import logger
+
+log = logger.init("generate_synthetic_data")
+
+#############################################
+# synthetic data
+#############################################
+def main(
+    spark_date: str,
+    n_users: int,
+    n_channels: int,
+    conversion_rate: float,
+    n_campaigns: int,
+    seed: int,
+) -> None:
+    output_dir = generate_tours_datasets(
+        spark_date, n_users, n_channels, conversion_rate, n_campaigns, seed
+    )
+    log.info(f"Successfully generated synthetic datasets in {output_dir}!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic datasets for attribution preprocessing"
+    )
+    parser.add_argument(
+        "--sparkDate",
+        action="store",
+        default="20221116",
+        dest="spark_date",
+        help="string that names the datasets/<sparkDate>/ directory to write to",
+    )
+    parser.add_argument(
+        "--nUsers",
+        action="store",
+        default=5000,
+        type=int,
+        dest="n_users",
+        help="number of users",
+    )
+    parser.add_argument(
+        "--nChannels",
+        action="store",
+        default=8,
+        type=int,
+        dest="n_channels",
+        help="number of source channels, at least 2 (email and adobe)",
+    )
+    parser.add_argument(
+        "--conversionRate",
+        action="store",
+        default=0.2,
+        type=float,
+        dest="conversion_rate",
+        help="expected share of users that convert",
+    )
+    parser.add_argument(
+        "--nCampaigns",
+        action="store",
+        default=30,
+        type=int,
+        dest="n_campaigns",
+        help="number of campaigns",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        default=0,
+        type=int,
+        dest="seed",
+        help="seed of the random generator",
+    )
+
+    args = parser.parse_args()
+    print(vars(args))
+    main(**vars(args))
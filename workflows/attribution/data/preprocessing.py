@@ -9,6 +9,7 @@ from datetime import date
 
 from next_gen_attribution.preprocessing.preprocessor_factory import PreprocessorFactory
 from next_gen_attribution.utility import logger
+from next_gen_attribution.utility.artifact_cache import ArtifactCache
 
 log = logger.init("preprocessing")
 curr_date = date.today().strftime("%Y%m%d")
@@ -22,6 +23,22 @@ def main(
     data_source: str,
     spark_date: str,
     data_tag: str,
+    data_format: str,
+    user_level: bool,
+    campaign_level: bool,
+    streaming: bool,
+    memory_budget_mb: float,
+    enforce_memory_budget: bool,
+    memory_report: bool,
+    date_range: str,
+    n_workers: int,
+    incremental: bool,
+    rebuild_snapshots: bool,
+    use_cache: bool,
+    cache_max_entries: int,
+    cache_max_gb: float,
+    cache_content_hash: bool,
+    profile_stage: str,
 ) -> None:
     preprocessor = PreprocessorFactory(
         business_unit,
@@ -29,8 +46,34 @@ def main(
         data_source,
         spark_date,
         data_tag,
+        data_format,
     )
-    preprocessor.etl()
+    etl_kwargs = {
+        "streaming": streaming,
+        "memory_budget_mb": memory_budget_mb,
+        "enforce_memory_budget": enforce_memory_budget,
+        "memory_report": memory_report,
+        "user_level": user_level,
+        "campaign_level": campaign_level,
+        "profile_stage": profile_stage,
+    }
+    if use_cache:
+        etl_kwargs["cache"] = ArtifactCache(
+            max_entries=cache_max_entries,
+            max_bytes=cache_max_gb * 2**30,
+            content_hash=cache_content_hash,
+        )
+    if date_range and incremental:
+        preprocessor.etl_incremental(
+            date_range,
+            n_workers,
+            rebuild_snapshots,
+            **etl_kwargs,
+        )
+    elif date_range:
+        preprocessor.etl_date_range(date_range, n_workers, **etl_kwargs)
+    else:
+        preprocessor.etl(**etl_kwargs)
     log.info(f"Successfully completed preprocessing data!")
 
 
@@ -74,6 +117,114 @@ if __name__ == "__main__":
         dest="data_tag",
         help="string that tags the data, e.g., a date",
     )
+    parser.add_argument(
+        "--dataFormat",
+        default="csv",
+        action="store",
+        dest="data_format",
+        choices=["csv", "parquet"],
+        help="one of {csv, parquet}, the format the preprocessed data are saved in",
+    )
+    parser.add_argument(
+        "--userLevel",
+        action="store_true",
+        dest="user_level",
+        help="also save the user-level preprocessed data next to the aggregated journeys",
+    )
+    parser.add_argument(
+        "--campaignLevel",
+        action="store_true",
+        dest="campaign_level",
+        help="also save the path counts of campaign and source/campaign touchpoints for campaign-level attribution",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        dest="streaming",
+        help="preprocess lytics data chunk by chunk within --memoryBudgetMB",
+    )
+    parser.add_argument(
+        "--memoryBudgetMB",
+        action="store",
+        default=1024,
+        type=float,
+        dest="memory_budget_mb",
+        help="memory budget of the streaming mode (and of every stage with --enforceMemoryBudget), in megabytes",
+    )
+    parser.add_argument(
+        "--enforceMemoryBudget",
+        action="store_true",
+        dest="enforce_memory_budget",
+        help="fail as soon as the output of an ETL stage takes more than --memoryBudgetMB in memory",
+    )
+    parser.add_argument(
+        "--memoryReport",
+        action="store_true",
+        dest="memory_report",
+        help="record the in-memory size of every ETL stage output and report the memory of the user-level data per column",
+    )
+    parser.add_argument(
+        "--dateRange",
+        action="store",
+        default=None,
+        dest="date_range",
+        help="date range like 20221101-20221130, preprocesses every spark date within it and merges the results (overrides --sparkDate)",
+    )
+    parser.add_argument(
+        "--nWorkers",
+        action="store",
+        default=None,
+        type=int,
+        dest="n_workers",
+        help="number of worker processes of the --dateRange mode, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help="with --dateRange, only preprocess spark dates without a journey-count snapshot and save aggregated journeys",
+    )
+    parser.add_argument(
+        "--rebuildSnapshots",
+        action="store_true",
+        dest="rebuild_snapshots",
+        help="with --incremental, preprocess every spark date again and overwrite its snapshot",
+    )
+    parser.add_argument(
+        "--useCache",
+        action="store_true",
+        dest="use_cache",
+        help="link preprocessed data from the artifact cache when the input data and preprocessing logic are unchanged",
+    )
+    parser.add_argument(
+        "--cacheMaxEntries",
+        action="store",
+        default=20,
+        type=int,
+        dest="cache_max_entries",
+        help="number of entries the artifact cache keeps before evicting the least recently used ones",
+    )
+    parser.add_argument(
+        "--cacheMaxGB",
+        action="store",
+        default=50,
+        type=float,
+        dest="cache_max_gb",
+        help="size in gigabytes the artifact cache keeps before evicting the least recently used entries",
+    )
+    parser.add_argument(
+        "--cacheContentHash",
+        action="store_true",
+        dest="cache_content_hash",
+        help="key the artifact cache by a hash of the input contents instead of their size and modification time",
+    )
+    parser.add_argument(
+        "--profileStage",
+        action="store",
+        default=None,
+        dest="profile_stage",
+        help="ETL stage to profile with cProfile, e.g., generate_touchpoint_indicator_columns",
+    )
 
     args = parser.parse_args()
     print(vars(args))
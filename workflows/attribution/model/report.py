@@ -0,0 +1,62 @@
+# HB: local invocation
+# python report.py --modelVersion=20221121
+"""
+Plot the saved results of the attribution models of a model version, apart from their training.
+"""
+import argparse
+import os
+from datetime import date
+
+from next_gen_attribution.modeling.report import plot_rescaled_values
+from next_gen_attribution.utility import logger, well_known_paths
+
+log = logger.init("report")
+
+curr_date = date.today().strftime("%Y%m%d")
+
+# results file and plotted column of each model type
+results = {
+    "shapley": ("shapley_values.csv", "shapley_value"),
+    "markov": ("removal_effects.csv", "removal_effect"),
+}
+
+#############################################
+# reporting
+#############################################
+def main(model_version: str, max_channels: int) -> None:
+    output_dir = os.path.join(well_known_paths["MODEL_OUTPUT_DIR"], model_version)
+    n_plots = 0
+    for model_type, (results_fname, value_column) in results.items():
+        results_fpath = os.path.join(output_dir, results_fname)
+        if os.path.exists(results_fpath):
+            log.info(f"Plotting the {model_type} results of {model_version}...")
+            plot_rescaled_values(results_fpath, value_column, max_channels)
+            n_plots += 1
+    if not n_plots:
+        raise RuntimeError(f"No saved results found in {output_dir}.")
+    log.info(f"Successfully plotted {n_plots} results of {model_version}!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Plot the saved results of attribution models"
+    )
+    parser.add_argument(
+        "--modelVersion",
+        action="store",
+        default=f"{curr_date}",
+        dest="model_version",
+        help="model version whose saved results are plotted",
+    )
+    parser.add_argument(
+        "--maxChannels",
+        action="store",
+        default=50,
+        type=int,
+        dest="max_channels",
+        help="channels of largest absolute value plotted",
+    )
+
+    args = parser.parse_args()
+    print(vars(args))
+    main(**vars(args))
@@ -0,0 +1,116 @@
+# HB: local invocation
+# python score.py --modelVersion=20221121 --sparkDate=20221116 --dataTag=generated_20221121
+"""
+Score the users of a preprocessed dataset with the credit table of a trained Shapley attribution model.
+"""
+import argparse
+from datetime import date
+
+from next_gen_attribution.modeling.attribution_factory import AttributionFactory
+from next_gen_attribution.utility import logger
+
+log = logger.init("score")
+
+curr_date = date.today().strftime("%Y%m%d")
+
+#############################################
+# scoring
+#############################################
+def main(
+    business_unit: str,
+    workflow_mode: str,
+    data_source: str,
+    model_version: str,
+    spark_date: str,
+    data_tag: str,
+    data_format: str,
+    chunksize: int,
+) -> None:
+    log.info("Instantiating attribution object...")
+    params = {}
+    if data_format:
+        params["data_format"] = data_format
+    if spark_date:
+        params["spark_date"] = spark_date
+    if data_tag:
+        params["data_tag"] = data_tag
+    attribution = AttributionFactory(
+        model_type="shapley",
+        business_unit=business_unit,
+        workflow_mode=workflow_mode,
+        data_source=data_source,
+        model_version=model_version,
+        params=params,
+    ).attribution()
+    output_fpath = attribution.score_users(chunksize)
+    log.info(f"Successfully scored users for {business_unit} to {output_fpath}!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score users with a trained attribution model"
+    )
+    parser.add_argument(
+        "--businessUnit",
+        default="tours",
+        action="store",
+        dest="business_unit",
+        help="business unit, one of {tours}",
+    )
+    parser.add_argument(
+        "--workflowMode",
+        default="dev",
+        action="store",
+        dest="workflow_mode",
+        choices=["dev", "prod"],
+        help="one of {dev, prod}",
+    )
+    parser.add_argument(
+        "--dataSource",
+        default="local",
+        action="store",
+        dest="data_source",
+        choices=["local", "s3"],
+        help="one of {local, s3}",
+    )
+    parser.add_argument(
+        "--modelVersion",
+        action="store",
+        default=f"{curr_date}",
+        dest="model_version",
+        help="model version whose credit table scores the users",
+    )
+    parser.add_argument(
+        "--sparkDate",
+        action="store",
+        default=None,
+        dest="spark_date",
+        help="spark date of the user-level data to score, defaults to the one of the model params",
+    )
+    parser.add_argument(
+        "--dataTag",
+        action="store",
+        default=None,
+        dest="data_tag",
+        help="data tag of the user-level data to score, defaults to the one of the model params",
+    )
+    parser.add_argument(
+        "--dataFormat",
+        action="store",
+        default=None,
+        dest="data_format",
+        choices=["csv", "parquet"],
+        help="one of {csv, parquet}, the format the user-level data were saved in, defaults to the one of the model params",
+    )
+    parser.add_argument(
+        "--chunksize",
+        action="store",
+        default=None,
+        type=int,
+        dest="chunksize",
+        help="users read and scored at once, defaults to the scoring.chunksize model param",
+    )
+
+    args = parser.parse_args()
+    print(vars(args))
+    main(**vars(args))
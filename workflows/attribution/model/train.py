@@ -22,6 +22,7 @@ def main(
     workflow_mode: str,
     data_source: str,
     model_version: str,
+    profile_stage: str,
 ) -> None:
     log.info("Instantiating attribution object...")
     attribution = AttributionFactory(
@@ -30,8 +31,9 @@ def main(
         workflow_mode=workflow_mode,
         data_source=data_source,
         model_version=model_version,
-    )
-    attribution.train()
+    ).attribution()
+    attribution.train(profile_stage=profile_stage)
+    attribution.join_plots()
     log.info(
         f"Successfully trained a {model_type} attribution model for {business_unit}!"
     )
@@ -77,6 +79,13 @@ if __name__ == "__main__":
         dest="model_version",
         help="model version prepended to the path",
     )
+    parser.add_argument(
+        "--profileStage",
+        action="store",
+        default=None,
+        dest="profile_stage",
+        help="training stage to profile with cProfile, e.g., bitmask_shapley_values",
+    )
 
     args = parser.parse_args()
     print(vars(args))
@@ -0,0 +1,96 @@
+# HB: local invocation
+# python train_batch.py --batchParams=../../../next_gen_attribution/modeling/params/batch/default.yaml --nWorkers=4
+"""
+Train a batch of attribution model variants on data loaded once and report them together.
+"""
+import argparse
+import os
+from datetime import date
+
+from next_gen_attribution.modeling.batch_attribution import BatchAttribution
+from next_gen_attribution.utility import logger, well_known_paths
+from next_gen_attribution.utility.utility import load_params
+
+log = logger.init("train_batch")
+
+curr_date = date.today().strftime("%Y%m%d")
+
+#############################################
+# batch training
+#############################################
+def main(
+    batch_params: str,
+    business_unit: str,
+    workflow_mode: str,
+    data_source: str,
+    model_version: str,
+    n_workers: int,
+) -> None:
+    variants = load_params(batch_params)["variants"]
+    log.info(f"Instantiating a batch of {len(variants)} attribution variants...")
+    batch = BatchAttribution(
+        variants,
+        business_unit=business_unit,
+        workflow_mode=workflow_mode,
+        data_source=data_source,
+        model_version=model_version,
+        n_workers=n_workers,
+    )
+    report = batch.train()
+    n_failed = report.loc[report["error"].notna(), "variant"].nunique()
+    log.info(
+        f"Trained {len(variants) - n_failed} out of {len(variants)} attribution variants for {business_unit}!"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a batch of attribution models")
+    parser.add_argument(
+        "--batchParams",
+        default=os.path.join(well_known_paths["PARAMS_DIR"], "batch", "default.yaml"),
+        action="store",
+        dest="batch_params",
+        help="yaml file listing the variants, each with a name, model_type and params overriding its defaults",
+    )
+    parser.add_argument(
+        "--businessUnit",
+        default="tours",
+        action="store",
+        dest="business_unit",
+        help="business unit, one of {tours}",
+    )
+    parser.add_argument(
+        "--workflowMode",
+        default="dev",
+        action="store",
+        dest="workflow_mode",
+        choices=["dev", "prod"],
+        help="one of {dev, prod}",
+    )
+    parser.add_argument(
+        "--dataSource",
+        default="local",
+        action="store",
+        dest="data_source",
+        choices=["local", "s3"],
+        help="one of {local, s3}",
+    )
+    parser.add_argument(
+        "--modelVersion",
+        action="store",
+        default=f"{curr_date}",
+        dest="model_version",
+        help="model version prepended to the path, each variant writes to <modelVersion>/<name>/",
+    )
+    parser.add_argument(
+        "--nWorkers",
+        action="store",
+        default=None,
+        type=int,
+        dest="n_workers",
+        help="number of worker processes, defaults to the number of CPUs",
+    )
+
+    args = parser.parse_args()
+    print(vars(args))
+    main(**vars(args))
@@ -0,0 +1,142 @@
+# HB: local invocation
+# python train_rolling.py --dateRange=20221101-20221130 --windowDays=7 --stepDays=1 --modelTypes=shapley,markov
+"""
+Train attribution models on rolling windows over the per-day journey counts of a date range.
+"""
+import argparse
+from datetime import date
+
+from next_gen_attribution.modeling.rolling_attribution import RollingAttribution
+from next_gen_attribution.preprocessing.preprocessor_factory import PreprocessorFactory
+from next_gen_attribution.utility import logger
+
+log = logger.init("train_rolling")
+
+curr_date = date.today().strftime("%Y%m%d")
+
+#############################################
+# rolling-window training
+#############################################
+def main(
+    date_range: str,
+    window_days: int,
+    step_days: int,
+    model_types: str,
+    business_unit: str,
+    workflow_mode: str,
+    data_source: str,
+    data_tag: str,
+    n_workers: int,
+    rebuild_snapshots: bool,
+    model_version: str,
+) -> None:
+    log.info("Preprocessing spark dates without a journey-count snapshot...")
+    daily_journeys, daily_paths = PreprocessorFactory(
+        business_unit, workflow_mode, data_source, date_range, data_tag
+    ).etl_daily(date_range, n_workers, rebuild_snapshots)
+
+    log.info("Instantiating rolling attribution object...")
+    rolling = RollingAttribution(
+        model_types.split(","),
+        business_unit=business_unit,
+        workflow_mode=workflow_mode,
+        data_source=data_source,
+        model_version=model_version,
+        window_days=window_days,
+        step_days=step_days,
+    )
+    trends = rolling.train(daily_journeys, daily_paths)
+    log.info(
+        f"Successfully trained {model_types} attribution models on {trends['window_end'].nunique()} windows for {business_unit}!"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train attribution models on rolling windows"
+    )
+    parser.add_argument(
+        "--dateRange",
+        action="store",
+        required=True,
+        dest="date_range",
+        help="date range like 20221101-20221130 whose spark dates the windows slide over",
+    )
+    parser.add_argument(
+        "--windowDays",
+        action="store",
+        default=7,
+        type=int,
+        dest="window_days",
+        help="number of days of each window, e.g., 1 for daily and 7 for weekly attribution",
+    )
+    parser.add_argument(
+        "--stepDays",
+        action="store",
+        default=1,
+        type=int,
+        dest="step_days",
+        help="number of days the window slides by",
+    )
+    parser.add_argument(
+        "--modelTypes",
+        default="shapley,markov",
+        action="store",
+        dest="model_types",
+        help="comma-separated subset of {shapley, markov}",
+    )
+    parser.add_argument(
+        "--businessUnit",
+        default="tours",
+        action="store",
+        dest="business_unit",
+        help="business unit, one of {tours}",
+    )
+    parser.add_argument(
+        "--workflowMode",
+        default="dev",
+        action="store",
+        dest="workflow_mode",
+        choices=["dev", "prod"],
+        help="one of {dev, prod}",
+    )
+    parser.add_argument(
+        "--dataSource",
+        default="local",
+        action="store",
+        dest="data_source",
+        choices=["local", "s3"],
+        help="one of {local, s3}",
+    )
+    parser.add_argument(
+        "--dataTag",
+        action="store",
+        default=f"generated_{curr_date}",
+        dest="data_tag",
+        help="string that tags the data, e.g., a date",
+    )
+    parser.add_argument(
+        "--nWorkers",
+        action="store",
+        default=None,
+        type=int,
+        dest="n_workers",
+        help="number of worker processes preprocessing the spark dates, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--rebuildSnapshots",
+        action="store_true",
+        dest="rebuild_snapshots",
+        help="preprocess every spark date again and overwrite its snapshot",
+    )
+    parser.add_argument(
+        "--modelVersion",
+        action="store",
+        default=f"{curr_date}",
+        dest="model_version",
+        help="model version prepended to the path, each model writes to <modelVersion>/<modelType>/",
+    )
+
+    args = parser.parse_args()
+    print(vars(args))
+    main(**vars(args))
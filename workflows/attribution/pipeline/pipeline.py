@@ -0,0 +1,215 @@
+# HB: local invocation
+# python pipeline.py --businessUnit=tours --modelType=shapley --workflowMode=dev
+"""
+Preprocess the datasets and train an attribution model on the result in a single process.
+"""
+
+import argparse
+from datetime import date
+
+from next_gen_attribution.modeling.attribution_factory import AttributionFactory
+from next_gen_attribution.preprocessing.preprocessor_factory import PreprocessorFactory
+from next_gen_attribution.utility import logger
+from next_gen_attribution.utility.artifact_cache import ArtifactCache
+
+log = logger.init("pipeline")
+curr_date = date.today().strftime("%Y%m%d")
+
+#############################################
+# pipeline
+#############################################
+def main(
+    business_unit: str,
+    model_type: str,
+    workflow_mode: str,
+    data_source: str,
+    spark_date: str,
+    data_tag: str,
+    data_format: str,
+    user_level: bool,
+    campaign_level: bool,
+    streaming: bool,
+    memory_budget_mb: float,
+    persist: bool,
+    use_cache: bool,
+    cache_max_entries: int,
+    cache_max_gb: float,
+    cache_content_hash: bool,
+    model_version: str,
+) -> None:
+    log.info("Instantiating attribution object...")
+    attribution = AttributionFactory(
+        model_type=model_type,
+        business_unit=business_unit,
+        workflow_mode=workflow_mode,
+        data_source=data_source,
+        model_version=model_version,
+        params={
+            "spark_date": spark_date,
+            "data_tag": data_tag,
+            "data_format": data_format,
+        },
+    ).attribution()
+
+    cache = None
+    if use_cache:
+        cache = ArtifactCache(
+            max_entries=cache_max_entries,
+            max_bytes=cache_max_gb * 2**30,
+            content_hash=cache_content_hash,
+        )
+
+    log.info("Preprocessing data...")
+    # the aggregated journeys (or the path counts of path-based models) are handed over in memory instead of
+    # being read back
+    data = PreprocessorFactory(
+        business_unit,
+        workflow_mode,
+        data_source,
+        spark_date,
+        data_tag,
+        data_format,
+    ).etl(
+        cache=cache,
+        streaming=streaming,
+        memory_budget_mb=memory_budget_mb,
+        user_level=user_level,
+        campaign_level=campaign_level,
+        persist=persist,
+        path_level=attribution.path_level(),
+    )
+    attribution.train(data=data)
+    attribution.join_plots()
+    log.info(
+        f"Successfully preprocessed data and trained a {model_type} attribution model for {business_unit}!"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run preprocessing and train an attribution model"
+    )
+    parser.add_argument(
+        "--businessUnit",
+        action="store",
+        default="tours",
+        dest="business_unit",
+        help="one of {tours, ...}",
+    )
+    parser.add_argument(
+        "--modelType",
+        default="shapley",
+        action="store",
+        dest="model_type",
+        choices=["shapley", "markov"],
+        help="one of {shapley, markov,...}",
+    )
+    parser.add_argument(
+        "--workflowMode",
+        action="store",
+        default="dev",
+        dest="workflow_mode",
+        choices=["dev", "prod"],
+        help="one of {dev, prod}",
+    )
+    parser.add_argument(
+        "--dataSource",
+        default="local",
+        action="store",
+        dest="data_source",
+        choices=["local", "s3"],
+        help="one of {local, s3}",
+    )
+    parser.add_argument(
+        "--sparkDate",
+        action="store",
+        default="20221116",
+        dest="spark_date",
+        help="string that gives the spark generation date",
+    )
+    parser.add_argument(
+        "--dataTag",
+        action="store",
+        default=f"generated_{curr_date}",
+        dest="data_tag",
+        help="string that tags the data, e.g., a date",
+    )
+    parser.add_argument(
+        "--dataFormat",
+        default="csv",
+        action="store",
+        dest="data_format",
+        choices=["csv", "parquet"],
+        help="one of {csv, parquet}, the format the aggregated journeys are saved in with --persist",
+    )
+    parser.add_argument(
+        "--userLevel",
+        action="store_true",
+        dest="user_level",
+        help="with --persist, also save the user-level preprocessed data next to the aggregated journeys",
+    )
+    parser.add_argument(
+        "--campaignLevel",
+        action="store_true",
+        dest="campaign_level",
+        help="with --persist, also save the path counts of campaign and source/campaign touchpoints",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        dest="streaming",
+        help="preprocess lytics data chunk by chunk within --memoryBudgetMB",
+    )
+    parser.add_argument(
+        "--memoryBudgetMB",
+        action="store",
+        default=1024,
+        type=float,
+        dest="memory_budget_mb",
+        help="memory budget of the streaming mode, in megabytes",
+    )
+    parser.add_argument(
+        "--persist",
+        action="store_true",
+        dest="persist",
+        help="also save the aggregated journeys, e.g., to train other models on them later",
+    )
+    parser.add_argument(
+        "--useCache",
+        action="store_true",
+        dest="use_cache",
+        help="with --persist, link preprocessed data from the artifact cache when the input data and preprocessing logic are unchanged",
+    )
+    parser.add_argument(
+        "--cacheMaxEntries",
+        action="store",
+        default=20,
+        type=int,
+        dest="cache_max_entries",
+        help="number of entries the artifact cache keeps before evicting the least recently used ones",
+    )
+    parser.add_argument(
+        "--cacheMaxGB",
+        action="store",
+        default=50,
+        type=float,
+        dest="cache_max_gb",
+        help="size in gigabytes the artifact cache keeps before evicting the least recently used entries",
+    )
+    parser.add_argument(
+        "--cacheContentHash",
+        action="store_true",
+        dest="cache_content_hash",
+        help="key the artifact cache by a hash of the input contents instead of their size and modification time",
+    )
+    parser.add_argument(
+        "--modelVersion",
+        action="store",
+        default=f"{curr_date}",
+        dest="model_version",
+        help="model version prepended to the path",
+    )
+
+    args = parser.parse_args()
+    print(vars(args))
+    main(**vars(args))